@@ -0,0 +1,381 @@
+################################################################################
+# Streams a synthetic release end to end: a multi-volume RAR set of a video-like
+# file is split into yEnc articles served by a fake NNTP server, and nzb2http.py
+# is run on a matching NZB. Prints a JSON report of time to first byte on
+# /video, sustained throughput, time to first frame for a player reading the
+# index at the end of the file, seek latency and peak RSS, to compare across
+# commits.
+#
+#   python benchmarks/bench_e2e.py [--size 256] [--method store] [--container mkv]
+#                                  [--latency 0.05] [--output report.json]
+#
+# Compressed sets are written by the rar executable, when it is installed.
+################################################################################
+import argparse
+import distutils.spawn
+import json
+import os
+import random
+import resource
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import urllib2
+import zlib
+
+import fakenntp
+import rarwriter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from nzb2http import container
+
+################################################################################
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+READ_SIZE = 64 * 1024
+
+# Bytes a player reads from the start of the video to find its index
+CONTAINER_HEAD_SIZE = 64 * 1024
+
+# Size of the index following the media data of the video, and bytes a player
+# reads from the start of the media data to decode its first frame
+INDEX_SIZE       = 2 * 1024 * 1024
+FIRST_FRAME_SIZE = 512 * 1024
+
+################################################################################
+def _ebml_size(size, length=1):
+    if length == 1:
+        return chr(0x80 | size)
+    return chr(1 << (8 - length)) + struct.pack('>Q', size)[8 - length + 1:]
+
+################################################################################
+def iter_video_content(size, container_type):
+    """
+    Yields size bytes of an MP4 or Matroska file whose index, the moov box or
+    the Cues, follows the media data as in many releases.
+    """
+    if container_type == 'mp4':
+        head = struct.pack('>I4s4sI4s4s', 24, 'ftyp', 'isom', 0x200, 'isom', 'mp41')
+        tail = struct.pack('>I4s', INDEX_SIZE, 'moov') + os.urandom(INDEX_SIZE - 8)
+        head = head + struct.pack('>I4s', size - len(head) - len(tail), 'mdat')
+    else:
+        ebml_header    = '\x1a\x45\xdf\xa3' + _ebml_size(11) + '\x42\x82' + _ebml_size(8) + 'matroska'
+        segment_header = '\x18\x53\x80\x67\x01\xff\xff\xff\xff\xff\xff\xff'
+        seek_head_size = 4 + 1 + 2 + 1 + 3 + 4 + 3 + 8
+        cluster_size   = size - len(ebml_header) - len(segment_header) - seek_head_size - 12 - INDEX_SIZE
+        cues_position  = seek_head_size + 12 + cluster_size
+        seek           = '\x53\xab' + _ebml_size(4) + '\x1c\x53\xbb\x6b' + '\x53\xac' + _ebml_size(8) + struct.pack('>Q', cues_position)
+        seek_head      = '\x11\x4d\x9b\x74' + _ebml_size(len(seek) + 3) + '\x4d\xbb' + _ebml_size(len(seek)) + seek
+        head           = ebml_header + segment_header + seek_head + '\x1f\x43\xb6\x75' + _ebml_size(cluster_size, 8)
+        tail           = '\x1c\x53\xbb\x6b' + _ebml_size(INDEX_SIZE - 12, 8) + os.urandom(INDEX_SIZE - 12)
+
+    yield head
+    for block in rarwriter.iter_content(size - len(head) - len(tail)):
+        yield block
+    yield tail
+
+################################################################################
+def write_release(work_dir, method, container_type, size, volume_size):
+    """
+    Returns:
+        - paths: paths of the RAR volumes written, in order
+        - crc32: CRC32 of the video file
+    """
+    base_path = os.path.join(work_dir, 'bench')
+    if method == 'store':
+        return rarwriter.write_store_volumes(base_path, 'bench.' + container_type, iter_video_content(size, container_type), size, volume_size)
+
+    video_path = os.path.join(work_dir, 'bench.' + container_type)
+    crc32      = 0
+    with open(video_path, 'wb') as video_file:
+        for block in iter_video_content(size, container_type):
+            crc32 = zlib.crc32(block, crc32)
+            video_file.write(block)
+
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(['rar', 'a', '-m3', '-ep', '-v{0}b'.format(volume_size), base_path + '.rar', video_path], stdout=devnull)
+    os.remove(video_path)
+
+    paths = sorted(os.path.join(work_dir, name) for name in os.listdir(work_dir) if name.endswith('.rar'))
+    return (paths, crc32 & 0xffffffff)
+
+################################################################################
+def build_nzb(paths, segment_size):
+    """
+    Splits the files into articles, which replace them on disk.
+
+    Returns:
+        - articles: {message_id: body_lines}
+        - nzb_content: NZB listing the files
+    """
+    articles = {}
+    lines    = ['<?xml version="1.0" encoding="iso-8859-1" ?>', '<nzb xmlns="http://www.newzbin.com/DTD/2003/nzb">']
+    for number, path in enumerate(paths):
+        name = os.path.basename(path)
+        with open(path, 'rb') as release_file:
+            data = release_file.read()
+        os.remove(path)
+
+        lines.append('<file poster="bench@nzb2http" date="0" subject="bench [{0}/{1}] - &quot;{2}&quot; yEnc (1/1)">'.format(number + 1, len(paths), name))
+        lines.append('<groups><group>alt.binaries.bench</group></groups>')
+        lines.append('<segments>')
+        for part, (message_id, size, body_lines) in enumerate(fakenntp.build_articles(name, data, segment_size)):
+            articles[message_id] = body_lines
+            lines.append('<segment bytes="{0}" number="{1}">{2}</segment>'.format(size, part + 1, message_id))
+        lines.append('</segments>')
+        lines.append('</file>')
+    lines.append('</nzb>')
+    return (articles, '\n'.join(lines))
+
+################################################################################
+def get_free_port():
+    free_socket = socket.socket()
+    free_socket.bind(('127.0.0.1', 0))
+    port = free_socket.getsockname()[1]
+    free_socket.close()
+    return port
+
+################################################################################
+def open_video(base_url, offset=0, timeout=120):
+    """
+    Requests /video from offset until the server has a video file to serve.
+
+    Returns:
+        - response: response whose first byte was read
+        - first_byte: that byte
+    """
+    request = urllib2.Request(base_url + '/video')
+    if offset:
+        request.add_header('Range', 'bytes={0}-'.format(offset))
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            response = urllib2.urlopen(request, timeout=timeout)
+            if response.info().gettype().startswith('video/'):
+                return (response, response.read(1))
+            response.close()
+        except (urllib2.URLError, socket.error):
+            pass
+        time.sleep(0.05)
+    raise RuntimeError('No video served after {0}s'.format(timeout))
+
+################################################################################
+def get_peak_rss(pid):
+    # VmHWM is only known while the process runs, on Linux
+    try:
+        with open('/proc/{0}/status'.format(pid)) as status_file:
+            for line in status_file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    return None
+
+################################################################################
+def run_server(args, nntp_servers, nzb_path, download_dir, log_file, measure):
+    """
+    Runs nzb2http.py on the NZB and calls measure(base_url) once it is
+    started.
+
+    Returns:
+        - result: dict returned by measure, with the peak RSS of the server
+    """
+    port    = get_free_port()
+    command = [sys.executable, os.path.join(ROOT_DIR, 'nzb2http.py'), nntp_servers[0], nzb_path, '-d', download_dir, '-p', str(port), '-m', str(args.connections), '-t', '0']
+    for backup_server in nntp_servers[1:]:
+        command = command + ['-b', backup_server]
+
+    start_time = time.time()
+    process    = subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT)
+    base_url   = 'http://127.0.0.1:{0}'.format(port)
+    try:
+        result = measure(base_url, start_time)
+        result['peak_rss_bytes'] = get_peak_rss(process.pid)
+        return result
+    finally:
+        try:
+            urllib2.urlopen(base_url + '/shutdown', timeout=10).read()
+        except (urllib2.URLError, socket.error):
+            pass
+        deadline = time.time() + 10
+        while process.poll() is None and time.time() < deadline:
+            time.sleep(0.1)
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+################################################################################
+def measure_stream(base_url, start_time, size, crc32):
+    response, data = open_video(base_url)
+    first_byte_time = time.time()
+    received        = len(data)
+    received_crc32  = zlib.crc32(data)
+    while True:
+        data = response.read(READ_SIZE)
+        if not data:
+            break
+        received       = received + len(data)
+        received_crc32 = zlib.crc32(data, received_crc32)
+    end_time = time.time()
+
+    return {
+                'ttfb_seconds':         first_byte_time - start_time,
+                'stream_seconds':       end_time - first_byte_time,
+                'throughput_mb_s':      received / (end_time - first_byte_time) / 1024 / 1024,
+                'intact':               received == size and (received_crc32 & 0xffffffff) == crc32
+           }
+
+################################################################################
+def measure_playback(base_url, start_time, size):
+    # Reads like a player starting playback: the headers, the index wherever
+    # it is, then the first frame
+    response, head = open_video(base_url)
+    head = head + response.read(CONTAINER_HEAD_SIZE - 1)
+    response.close()
+
+    index = container.find_tail_index(head, size)
+    if index:
+        response, data = open_video(base_url, index[1])
+        remaining = index[2] - index[1] - len(data)
+        while remaining > 0:
+            data = response.read(min(READ_SIZE, remaining))
+            if not data:
+                break
+            remaining = remaining - len(data)
+        response.close()
+
+    response, data = open_video(base_url, len(head))
+    data = data + response.read(FIRST_FRAME_SIZE - 1)
+    response.close()
+
+    return {
+                'ttff_seconds':         time.time() - start_time,
+                'tail_index':           index is not None
+           }
+
+################################################################################
+def measure_seeks(base_url, start_time, size, seeks, seek_read_size):
+    # Seeks go forward like a player skipping through the video, mostly past
+    # what has been downloaded
+    response, data = open_video(base_url)
+    response.close()
+
+    latencies = []
+    offsets   = sorted(random.randint(1, size - seek_read_size) for i in range(seeks))
+    for offset in offsets:
+        seek_time      = time.time()
+        response, data = open_video(base_url, offset)
+        latencies.append(time.time() - seek_time)
+        remaining = seek_read_size - len(data)
+        while remaining > 0:
+            data = response.read(min(READ_SIZE, remaining))
+            if not data:
+                break
+            remaining = remaining - len(data)
+        response.close()
+
+    latencies.sort()
+    return {
+                'seek_offsets':         offsets,
+                'seek_seconds':         latencies,
+                'seek_median_seconds':  latencies[len(latencies) // 2] if latencies else None,
+                'seek_max_seconds':     latencies[-1] if latencies else None
+           }
+
+################################################################################
+def get_revision():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIR, stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+################################################################################
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--size', default=256, type=int, help='Size of the video file in MB')
+    arg_parser.add_argument('--volume-size', default=20, type=int, help='Size of the RAR volumes in MB')
+    arg_parser.add_argument('--segment-size', default=768 * 1024, type=int, help='Size of the articles in bytes')
+    arg_parser.add_argument('--method', default='store', choices=['store', 'compressed'])
+    arg_parser.add_argument('--container', default='mkv', choices=['mkv', 'mp4'], help='Container of the video, whose index follows the media data')
+    arg_parser.add_argument('--connections', default=8, type=int)
+    arg_parser.add_argument('--latency', default=0.05, type=float, help='Seconds each article response is delayed by')
+    arg_parser.add_argument('--jitter', default=0.0, type=float, help='Maximum random seconds added to the latency')
+    arg_parser.add_argument('--bandwidth', default=0, type=int, help='Per-connection bytes per second, 0 for unlimited')
+    arg_parser.add_argument('--missing-rate', default=0.0, type=float, help='Share of the articles missing from the primary server, which are then fetched from a backup server')
+    arg_parser.add_argument('--drop-rate', default=0.0, type=float, help='Probability for an article request to drop its connection')
+    arg_parser.add_argument('--seeks', default=5, type=int)
+    arg_parser.add_argument('--seek-read-size', default=1024 * 1024, type=int, help='Bytes read after each seek')
+    arg_parser.add_argument('--seed', default=None, type=int)
+    arg_parser.add_argument('--output', default=None, help='File the JSON report is written to, stdout if not given')
+    arg_parser.add_argument('--keep', action='store_true', help='Keep the work directory')
+    args = arg_parser.parse_args()
+
+    if args.method == 'compressed' and not distutils.spawn.find_executable('rar'):
+        arg_parser.error('the rar executable is required for compressed sets')
+
+    random.seed(args.seed)
+    size        = args.size * 1024 * 1024
+    volume_size = args.volume_size * 1024 * 1024
+    work_dir    = tempfile.mkdtemp(prefix='nzb2http-bench-')
+    try:
+        release_dir = os.path.join(work_dir, 'release')
+        os.makedirs(release_dir)
+        paths, crc32       = write_release(release_dir, args.method, args.container, size, volume_size)
+        articles, nzb      = build_nzb(paths, args.segment_size)
+        nzb_path           = os.path.join(work_dir, 'bench.nzb')
+        with open(nzb_path, 'w') as nzb_file:
+            nzb_file.write(nzb)
+
+        missing     = [message_id for message_id in articles if random.random() < args.missing_rate]
+        fake_server = fakenntp.FakeNNTPServer(articles, latency=args.latency, jitter=args.jitter, bandwidth=args.bandwidth, missing=missing, drop_rate=args.drop_rate)
+        fake_server.start()
+        nntp_servers = ['bench:bench@127.0.0.1:{0}'.format(fake_server.get_port())]
+        if missing:
+            backup_server = fakenntp.FakeNNTPServer(articles, latency=args.latency, jitter=args.jitter, bandwidth=args.bandwidth)
+            backup_server.start()
+            nntp_servers.append('bench:bench@127.0.0.1:{0}'.format(backup_server.get_port()))
+
+        # Streaming, playback and seeking each start from an empty download
+        # directory, they would otherwise read downloaded data
+        with open(os.path.join(work_dir, 'nzb2http.log'), 'w') as log_file:
+            stream   = run_server(args, nntp_servers, nzb_path, os.path.join(work_dir, 'stream'), log_file, lambda base_url, start_time: measure_stream(base_url, start_time, size, crc32))
+            playback = run_server(args, nntp_servers, nzb_path, os.path.join(work_dir, 'playback'), log_file, lambda base_url, start_time: measure_playback(base_url, start_time, size))
+            seek     = run_server(args, nntp_servers, nzb_path, os.path.join(work_dir, 'seek'), log_file, lambda base_url, start_time: measure_seeks(base_url, start_time, size, args.seeks, args.seek_read_size))
+
+        peak_rss = [rss for rss in (stream.pop('peak_rss_bytes'), playback.pop('peak_rss_bytes'), seek.pop('peak_rss_bytes')) if rss is not None]
+        if not peak_rss:
+            # Without /proc, the peak of the servers once they have exited
+            maxrss   = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            peak_rss = [maxrss if sys.platform == 'darwin' else maxrss * 1024]
+
+        report = {
+                    'revision':     get_revision(),
+                    'time':         time.time(),
+                    'parameters':   dict(vars(args), volumes=len(paths), articles=len(articles), missing_articles=len(missing)),
+                    'results':      dict(stream, peak_rss_bytes=max(peak_rss), **dict(playback, **seek))
+                 }
+        report_json = json.dumps(report, indent=4, sort_keys=True)
+        if args.output:
+            with open(args.output, 'w') as output_file:
+                output_file.write(report_json + '\n')
+        else:
+            sys.stdout.write(report_json + '\n')
+
+        if not stream['intact']:
+            sys.stderr.write('The streamed video does not match the release, see {0}\n'.format(os.path.join(work_dir, 'nzb2http.log')))
+            args.keep = True
+            sys.exit(1)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, True)
+
+################################################################################
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+################################################################################
+# Extracts a synthetic store-mode RAR set through unrar with the buffered
+# extractor and with the former chunk by chunk copy, in MB/s and CPU seconds.
+#
+#   python benchmarks/bench_extract.py [--size 2048] [--volume-size 100]
+################################################################################
+import argparse
+import ctypes
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import unrar
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import rarwriter
+
+from nzb2http import extractor
+
+################################################################################
+class LegacyExtractor(extractor.Extractor):
+    def _callback(self, msg, userdata, p1, p2):
+        if self.stop_requested:
+            return -1
+
+        if msg == unrar.constants.UCM_PROCESSDATA:
+            self.output_file.write((ctypes.c_char * p2).from_address(p1).raw)
+            self.output_file.flush()
+            self.output_watermark.advance(self.output_file.tell())
+
+        return 1
+
+################################################################################
+def measure(extractor_class, rar_path, size, crc32):
+    start_usage = resource.getrusage(resource.RUSAGE_SELF)
+    start_time  = time.time()
+
+    # Stored entries are served from the volumes, extract one anyway
+    rar_extractor = extractor_class()
+    rar_extractor.extract_file(os.path.join(os.path.dirname(rar_path), 'bench.mkv'), rar_path)
+
+    elapsed     = time.time() - start_time
+    end_usage   = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_time    = (end_usage.ru_utime - start_usage.ru_utime) + (end_usage.ru_stime - start_usage.ru_stime)
+
+    output_path  = rar_extractor.files[0]['path']
+    output_crc32 = 0
+    with open(output_path, 'rb') as output_file:
+        for chunk in iter(lambda: output_file.read(1024 * 1024), ''):
+            output_crc32 = zlib.crc32(chunk, output_crc32)
+    os.remove(output_path)
+
+    if output_crc32 & 0xffffffff != crc32:
+        raise Exception('{0} extracted corrupt data'.format(extractor_class.__name__))
+
+    return (size / elapsed / (1024 * 1024), cpu_time)
+
+################################################################################
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--size', default=2048, type=int, help='size of the stored file in MB')
+    arg_parser.add_argument('--volume-size', default=100, type=int, help='size of the volumes in MB')
+    args = arg_parser.parse_args()
+
+    sys.stdout = open(os.devnull, 'w')
+
+    size     = args.size * 1024 * 1024
+    work_dir = tempfile.mkdtemp(prefix='nzb2http-bench-')
+    try:
+        paths, crc32 = rarwriter.write_store_volumes(os.path.join(work_dir, 'bench'), 'bench.mkv', rarwriter.iter_content(size), size, args.volume_size * 1024 * 1024)
+
+        results = []
+        for extractor_class in (LegacyExtractor, extractor.Extractor):
+            results.append((extractor_class.__name__, measure(extractor_class, paths[0], size, crc32)))
+    finally:
+        sys.stdout = sys.__stdout__
+        shutil.rmtree(work_dir)
+
+    for name, (throughput, cpu_time) in results:
+        sys.stdout.write('{0:<16} {1:8.1f} MB/s {2:8.2f} s CPU\n'.format(name, throughput, cpu_time))
+
+################################################################################
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+################################################################################
+# Downloads a release from a primary fake NNTP server which is missing articles
+# and drops connections, with a complete backup server, then checks every file
+# was rebuilt intact.
+#
+#   python benchmarks/bench_failover.py [--missing-rate 0.05] [--drop-rate 0.02]
+################################################################################
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import fakenntp
+
+from nzb2http import downloader
+from nzb2http import filewriter
+from nzb2http import scheduler
+
+################################################################################
+class BenchSegment:
+    def __init__(self, number, size, message_id):
+        self.number     = number
+        self.bytes      = size
+        self.message_id = message_id
+
+################################################################################
+class BenchFile:
+    def __init__(self, name, path, segments):
+        self.name     = name
+        self.path     = path
+        self.segments = segments
+
+################################################################################
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--volumes', default=10, type=int)
+    arg_parser.add_argument('--volume-size', default=1024 * 1024, type=int)
+    arg_parser.add_argument('--segment-size', default=128 * 1024, type=int)
+    arg_parser.add_argument('--connections', default=4, type=int)
+    arg_parser.add_argument('--missing-rate', default=0.05, type=float)
+    arg_parser.add_argument('--drop-rate', default=0.02, type=float)
+    args = arg_parser.parse_args()
+
+    articles = {}
+    volumes  = []
+    for volume in range(args.volumes):
+        name     = 'bench.part{0:02d}.rar'.format(volume + 1)
+        data     = os.urandom(args.volume_size)
+        segments = []
+        for number, (message_id, size, body_lines) in enumerate(fakenntp.build_articles(name, data, args.segment_size)):
+            articles[message_id] = body_lines
+            segments.append(BenchSegment(number + 1, size, message_id))
+        volumes.append((name, data, segments))
+
+    missing = [message_id for message_id in articles if random.random() < args.missing_rate]
+    primary = fakenntp.FakeNNTPServer(articles, latency=0.01, missing=missing, drop_rate=args.drop_rate)
+    backup  = fakenntp.FakeNNTPServer(articles, latency=0.05)
+    primary.start()
+    backup.start()
+
+    nntp_servers = []
+    for server in (primary, backup):
+        nntp_servers.append({'host': '127.0.0.1', 'port': server.get_port(), 'username': None, 'password': None, 'use_ssl': False, 'max_connections': args.connections})
+
+    download_dir       = tempfile.mkdtemp(prefix='nzb2http-bench-')
+    download_scheduler = scheduler.Scheduler(2, len(nntp_servers))
+    for name, data, segments in volumes:
+        nzb_file = BenchFile(name, os.path.join(download_dir, name), segments)
+        download_scheduler.add_file(nzb_file, filewriter.FileWriter(nzb_file.path, len(segments)))
+
+    try:
+        start_time = time.time()
+        workers    = []
+        for server_index, nntp_credentials in enumerate(nntp_servers):
+            for i in range(nntp_credentials['max_connections']):
+                worker = downloader.Worker(server_index, nntp_credentials, download_scheduler, 4)
+                worker.start()
+                workers.append(worker)
+        while not download_scheduler.wait_finished(1):
+            pass
+        elapsed = time.time() - start_time
+        download_scheduler.stop()
+        for worker in workers:
+            worker.join()
+
+        intact = 0
+        for name, data, segments in volumes:
+            with open(os.path.join(download_dir, name), 'rb') as volume_file:
+                if volume_file.read() == data:
+                    intact = intact + 1
+
+        sys.stdout.write('missing on primary: {0} articles, dropped connections: {1}\n'.format(len(missing), primary.dropped_count))
+        sys.stdout.write('intact volumes: {0}/{1} in {2:.2f} s\n'.format(intact, len(volumes), elapsed))
+    finally:
+        shutil.rmtree(download_dir)
+        primary.shutdown()
+        backup.shutdown()
+
+################################################################################
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+################################################################################
+# Parses a synthetic NZB with pynzb and with the streaming parser, each in a
+# process of its own, reporting the time to the first file, the time to the
+# whole NZB and the peak RSS.
+#
+#   python benchmarks/bench_nzb.py [--files 200] [--segments 500] [--gzip]
+################################################################################
+import argparse
+import gzip
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+################################################################################
+def write_nzb(path, file_count, segment_count, compress):
+    open_nzb = gzip.open if compress else open
+    with open_nzb(path, 'wb') as nzb_file:
+        nzb_file.write('<?xml version="1.0" encoding="iso-8859-1" ?>\n<nzb xmlns="http://www.newzbin.com/DTD/2003/nzb">\n')
+        for file_index in range(file_count):
+            name = 'season.pack.s01e{0:02d}.part{1:02d}.rar'.format(file_index // 50 + 1, file_index % 50 + 1)
+            nzb_file.write('<file poster="bench@nzb2http" date="1500000000" subject="bench [{0}/{1}] - &quot;{2}&quot; yEnc (1/{3})">\n'.format(file_index + 1, file_count, name, segment_count))
+            nzb_file.write('<groups><group>alt.binaries.bench</group></groups>\n<segments>\n')
+            for number in range(1, segment_count + 1):
+                nzb_file.write('<segment bytes="{0}" number="{1}">part{1}of{2}.{3:016x}@bench.nzb2http</segment>\n'.format(792000 + number % 1000, number, segment_count, file_index * segment_count + number))
+            nzb_file.write('</segments>\n</file>\n')
+        nzb_file.write('</nzb>\n')
+
+################################################################################
+def parse(parser, path):
+    # Runs in a process of its own for its peak RSS to be the parser's
+    start_time = time.time()
+    if parser == 'pynzb':
+        import pynzb
+        import re
+        with (gzip.open if path.endswith('.gz') else open)(path, 'rb') as nzb_file:
+            nzb_files = pynzb.nzb_parser.parse(nzb_file.read())
+        first_time = time.time()
+        for nzb_file in nzb_files:
+            nzb_file.name = re.search('\"(.+)\"', nzb_file.subject).group(1)
+        segment_count = sum(len(nzb_file.segments) for nzb_file in nzb_files)
+    else:
+        from nzb2http import nzbparser
+        nzb_files  = []
+        first_time = None
+        with open(path, 'rb') as nzb_file:
+            for parsed_file in nzbparser.iter_files(nzb_file):
+                first_time = first_time or time.time()
+                nzb_files.append(parsed_file)
+        segment_count = sum(len(nzb_file.segments) for nzb_file in nzb_files)
+    end_time = time.time()
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    sys.stdout.write('{0} {1} {2} {3}\n'.format(first_time - start_time, end_time - start_time, maxrss if sys.platform == 'darwin' else maxrss * 1024, segment_count))
+
+################################################################################
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--files', default=200, type=int)
+    arg_parser.add_argument('--segments', default=500, type=int, help='Segments per file')
+    arg_parser.add_argument('--gzip', action='store_true')
+    arg_parser.add_argument('--parse', nargs=2, help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.parse:
+        parse(*args.parse)
+        return
+
+    nzb_fd, nzb_path = tempfile.mkstemp(suffix='.nzb.gz' if args.gzip else '.nzb', prefix='nzb2http-bench-')
+    os.close(nzb_fd)
+    try:
+        write_nzb(nzb_path, args.files, args.segments, args.gzip)
+        print('{0} files, {1} segments, {2:.1f} MB NZB'.format(args.files, args.files * args.segments, os.path.getsize(nzb_path) / 1024.0 / 1024))
+
+        for parser in ('pynzb', 'nzbparser'):
+            output = subprocess.check_output([sys.executable, __file__, '--parse', parser, nzb_path])
+            first_seconds, total_seconds, peak_rss, segment_count = output.split()
+            print('{0:10s} first file {1:6.3f}s  all files {2:6.3f}s  peak RSS {3:6.1f} MB  ({4} segments)'.format(parser, float(first_seconds), float(total_seconds), int(peak_rss) / 1024.0 / 1024, segment_count))
+    finally:
+        os.remove(nzb_path)
+
+################################################################################
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+################################################################################
+# Streams each episode of a synthetic season pack, stored one after the other
+# in a multi-volume RAR set, through /files/<index>. Prints a JSON report of
+# the time to first byte and the volumes downloaded per episode: with
+# selective extraction, the last episode comes as fast as the first one and
+# only the volumes it spans are downloaded.
+#
+#   python benchmarks/bench_pack.py [--episodes 8] [--size 64] [--volume-size 20]
+#                                   [--latency 0.05] [--output report.json]
+################################################################################
+import argparse
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+import urllib2
+import zlib
+
+import bench_e2e
+import fakenntp
+import rarwriter
+
+################################################################################
+def open_file(base_url, index, timeout=120):
+    """
+    Requests /files/<index> until the server has the file to serve.
+
+    Returns:
+        - response: response whose first byte was read
+        - first_byte: that byte
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            response = urllib2.urlopen('{0}/files/{1}'.format(base_url, index), timeout=timeout)
+            if not response.info().gettype().startswith('text/'):
+                return (response, response.read(1))
+            response.close()
+        except (urllib2.URLError, socket.error):
+            pass
+        time.sleep(0.05)
+    raise RuntimeError('File {0} not served after {1}s'.format(index, timeout))
+
+################################################################################
+def measure_episode(base_url, start_time, index, size, crc32, download_dir):
+    response, data = open_file(base_url, index)
+    first_byte_time = time.time()
+    received        = len(data)
+    received_crc32  = zlib.crc32(data)
+    while True:
+        data = response.read(bench_e2e.READ_SIZE)
+        if not data:
+            break
+        received       = received + len(data)
+        received_crc32 = zlib.crc32(data, received_crc32)
+    end_time = time.time()
+
+    volumes = 0
+    for dir_path, dir_names, file_names in os.walk(download_dir):
+        volumes = volumes + len([name for name in file_names if name.endswith('.rar')])
+
+    return {
+                'episode':              index + 1,
+                'ttfb_seconds':         first_byte_time - start_time,
+                'stream_seconds':       end_time - first_byte_time,
+                'volumes_downloaded':   volumes,
+                'intact':               received == size and (received_crc32 & 0xffffffff) == crc32
+           }
+
+################################################################################
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--episodes', default=8, type=int)
+    arg_parser.add_argument('--size', default=64, type=int, help='Size of each episode in MB')
+    arg_parser.add_argument('--volume-size', default=20, type=int, help='Size of the RAR volumes in MB')
+    arg_parser.add_argument('--segment-size', default=768 * 1024, type=int, help='Size of the articles in bytes')
+    arg_parser.add_argument('--connections', default=8, type=int)
+    arg_parser.add_argument('--latency', default=0.05, type=float, help='Seconds each article response is delayed by')
+    arg_parser.add_argument('--output', default=None, help='File the JSON report is written to, stdout if not given')
+    arg_parser.add_argument('--keep', action='store_true', help='Keep the work directory')
+    args = arg_parser.parse_args()
+
+    size        = args.size * 1024 * 1024
+    volume_size = args.volume_size * 1024 * 1024
+    work_dir    = tempfile.mkdtemp(prefix='nzb2http-bench-')
+    try:
+        release_dir = os.path.join(work_dir, 'release')
+        os.makedirs(release_dir)
+        files         = [('bench.e{0:02d}.mkv'.format(number + 1), bench_e2e.iter_video_content(size, 'mkv'), size) for number in range(args.episodes)]
+        paths, crc32s = rarwriter.write_store_pack(os.path.join(release_dir, 'bench'), files, volume_size)
+        articles, nzb = bench_e2e.build_nzb(paths, args.segment_size)
+        nzb_path      = os.path.join(work_dir, 'bench.nzb')
+        with open(nzb_path, 'w') as nzb_file:
+            nzb_file.write(nzb)
+
+        fake_server = fakenntp.FakeNNTPServer(articles, latency=args.latency)
+        fake_server.start()
+        nntp_servers = ['bench:bench@127.0.0.1:{0}'.format(fake_server.get_port())]
+
+        # Each episode is streamed from an empty download directory
+        episodes = []
+        with open(os.path.join(work_dir, 'nzb2http.log'), 'w') as log_file:
+            for index in range(args.episodes):
+                download_dir = os.path.join(work_dir, 'e{0:02d}'.format(index + 1))
+                episode      = bench_e2e.run_server(args, nntp_servers, nzb_path, download_dir, log_file, lambda base_url, start_time: measure_episode(base_url, start_time, index, size, crc32s[index], download_dir))
+                episode.pop('peak_rss_bytes')
+                episodes.append(episode)
+
+        report = {
+                    'revision':     bench_e2e.get_revision(),
+                    'time':         time.time(),
+                    'parameters':   dict(vars(args), volumes=len(paths), articles=len(articles)),
+                    'results':      {'episodes': episodes}
+                 }
+        report_json = json.dumps(report, indent=4, sort_keys=True)
+        if args.output:
+            with open(args.output, 'w') as output_file:
+                output_file.write(report_json + '\n')
+        else:
+            sys.stdout.write(report_json + '\n')
+
+        if not all(episode['intact'] for episode in episodes):
+            sys.stderr.write('A streamed episode does not match the release, see {0}\n'.format(os.path.join(work_dir, 'nzb2http.log')))
+            args.keep = True
+            sys.exit(1)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, True)
+
+################################################################################
+if __name__ == '__main__':
+    main()
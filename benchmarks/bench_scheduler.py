@@ -0,0 +1,107 @@
+################################################################################
+# Measures aggregate download throughput of the segment scheduler against a
+# local fake NNTP server, for a 50 volume release.
+#
+#   python benchmarks/bench_scheduler.py [--connections 8] [--active-files 1,4]
+#                                        [--pipeline-depth 1,4]
+################################################################################
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import fakenntp
+
+from nzb2http import downloader
+from nzb2http import filewriter
+from nzb2http import scheduler
+
+################################################################################
+class BenchSegment:
+    def __init__(self, number, size, message_id):
+        self.number     = number
+        self.bytes      = size
+        self.message_id = message_id
+
+################################################################################
+class BenchFile:
+    def __init__(self, name, path, segments):
+        self.name     = name
+        self.path     = path
+        self.segments = segments
+
+################################################################################
+def build_release(volume_count, volume_size, segment_size):
+    articles  = {}
+    volumes   = []
+    for volume in range(volume_count):
+        name     = 'bench.part{0:02d}.rar'.format(volume + 1)
+        segments = []
+        for number, (message_id, size, body_lines) in enumerate(fakenntp.build_articles(name, os.urandom(volume_size), segment_size)):
+            articles[message_id] = body_lines
+            segments.append(BenchSegment(number + 1, size, message_id))
+        volumes.append((name, segments))
+    return articles, volumes
+
+################################################################################
+def run_download(port, volumes, download_dir, connections, max_active_files, pipeline_depth):
+    nntp_credentials = {'host': '127.0.0.1', 'port': port, 'username': None, 'password': None, 'use_ssl': False, 'max_connections': connections}
+
+    download_scheduler = scheduler.Scheduler(max_active_files, 1)
+    for name, segments in volumes:
+        nzb_file = BenchFile(name, os.path.join(download_dir, name), segments)
+        download_scheduler.add_file(nzb_file, filewriter.FileWriter(nzb_file.path, len(segments)))
+
+    start_time = time.time()
+
+    workers = [downloader.Worker(0, nntp_credentials, download_scheduler, pipeline_depth) for i in range(connections)]
+    for worker in workers:
+        worker.start()
+    while not download_scheduler.wait_finished(1):
+        pass
+    download_scheduler.stop()
+    for worker in workers:
+        worker.join()
+
+    return time.time() - start_time
+
+################################################################################
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--volumes', default=50, type=int)
+    arg_parser.add_argument('--volume-size', default=2 * 1024 * 1024, type=int)
+    arg_parser.add_argument('--segment-size', default=256 * 1024, type=int)
+    arg_parser.add_argument('--connections', default=8, type=int)
+    arg_parser.add_argument('--active-files', default='1,2,4')
+    arg_parser.add_argument('--pipeline-depth', default='1')
+    arg_parser.add_argument('--latency', default=0.05, type=float)
+    arg_parser.add_argument('--jitter', default=0.2, type=float)
+    arg_parser.add_argument('--bandwidth', default=0, type=int, help='Per-connection bytes per second')
+    args = arg_parser.parse_args()
+
+    articles, volumes = build_release(args.volumes, args.volume_size, args.segment_size)
+    total_size        = args.volumes * args.volume_size
+
+    server = fakenntp.FakeNNTPServer(articles, latency=args.latency, jitter=args.jitter, bandwidth=args.bandwidth)
+    server.start()
+
+    # max_active_files=1 and pipeline_depth=1 reproduce the former behaviour of
+    # one file at a time and one request at a time per connection
+    for max_active_files in [int(value) for value in args.active_files.split(',')]:
+        for pipeline_depth in [int(value) for value in args.pipeline_depth.split(',')]:
+            download_dir = tempfile.mkdtemp(prefix='nzb2http-bench-')
+            try:
+                elapsed = run_download(server.get_port(), volumes, download_dir, args.connections, max_active_files, pipeline_depth)
+                sys.stdout.write('active_files={0:<3} connections={1:<3} pipeline_depth={2:<3} {3:8.2f} s {4:8.2f} MB/s\n'.format(max_active_files, args.connections, pipeline_depth, elapsed, total_size / elapsed / (1024 * 1024)))
+            finally:
+                shutil.rmtree(download_dir)
+
+    server.shutdown()
+
+################################################################################
+if __name__ == '__main__':
+    main()
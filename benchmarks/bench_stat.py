@@ -0,0 +1,107 @@
+################################################################################
+# Checks the availability of the segments of a large NZB with pipelined STAT
+# commands, on a primary fake NNTP server missing some articles and a complete
+# backup server, and compares the time taken with one round trip per segment.
+#
+#   python benchmarks/bench_stat.py [--segments 30000] [--connections 8]
+#                                   [--latency 0.05] [--missing-rate 0.01]
+################################################################################
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import fakenntp
+
+from nzb2http import availability
+from nzb2http import downloader
+from nzb2http import scheduler
+
+################################################################################
+class BenchSegment:
+    def __init__(self, number, size, message_id):
+        self.number     = number
+        self.bytes      = size
+        self.message_id = message_id
+
+################################################################################
+class BenchFile:
+    def __init__(self, name, segments):
+        self.name     = name
+        self.segments = segments
+
+################################################################################
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--segments', default=30000, type=int)
+    arg_parser.add_argument('--segments-per-file', default=100, type=int)
+    arg_parser.add_argument('--connections', default=8, type=int)
+    arg_parser.add_argument('--pipeline', default=4, type=int)
+    arg_parser.add_argument('--latency', default=0.05, type=float, help='Seconds each response is delayed by')
+    arg_parser.add_argument('--missing-rate', default=0.01, type=float, help='Share of the articles missing from the primary server')
+    args = arg_parser.parse_args()
+
+    # Articles are only checked, their bodies are never sent
+    articles = {}
+    segments = []
+    for file_number in range((args.segments + args.segments_per_file - 1) // args.segments_per_file):
+        file_segments = []
+        for number in range(min(args.segments_per_file, args.segments - file_number * args.segments_per_file)):
+            message_id = 'bench.{0}.{1}@fakenntp'.format(file_number, number)
+            articles[message_id] = []
+            file_segments.append(BenchSegment(number + 1, 768000, message_id))
+        nzb_file = BenchFile('bench.part{0:03d}.rar'.format(file_number + 1), file_segments)
+        segments.extend((nzb_file, index) for index in range(len(file_segments)))
+
+    missing = [message_id for message_id in articles if random.random() < args.missing_rate]
+    primary = fakenntp.FakeNNTPServer(articles, latency=args.latency, missing=missing)
+    backup  = fakenntp.FakeNNTPServer(articles, latency=args.latency)
+    primary.start()
+    backup.start()
+
+    nntp_servers = []
+    for server in (primary, backup):
+        nntp_servers.append({'host': '127.0.0.1', 'port': server.get_port(), 'username': None, 'password': None, 'use_ssl': False, 'max_connections': args.connections})
+
+    condition          = threading.Condition()
+    download_scheduler = scheduler.Scheduler(2, len(nntp_servers), condition)
+    scan               = availability.AvailabilityScan(segments, len(nntp_servers), condition)
+
+    try:
+        workers = []
+        for server_index, nntp_credentials in enumerate(nntp_servers):
+            for i in range(nntp_credentials['max_connections']):
+                worker = downloader.Worker(server_index, nntp_credentials, download_scheduler, args.pipeline)
+                worker.start()
+                workers.append(worker)
+
+        # Connections are opened before the scan starts, as in a running job
+        time.sleep(1)
+        scan.start_time = time.time()
+        download_scheduler.scan_availability(scan)
+        with condition:
+            while not scan.is_finished():
+                condition.wait(1)
+        elapsed = scan.end_time - scan.start_time
+
+        download_scheduler.stop()
+        for worker in workers:
+            worker.join()
+
+        sequential = args.segments * args.latency / args.connections
+        sys.stdout.write('{0} segments, {1} connections per server, {2:.0f} ms latency\n'.format(args.segments, args.connections, args.latency * 1000))
+        sys.stdout.write('primary:  {0} checked, {1} missing ({2} expected)\n'.format(scan.checked[0], len(scan.missing[0]), len(missing)))
+        sys.stdout.write('backup:   {0} checked, {1} missing\n'.format(scan.checked[1], len(scan.missing[1])))
+        sys.stdout.write('pipelined STAT: {0:.2f} s, {1:.0f} segments/s\n'.format(elapsed, args.segments / elapsed))
+        sys.stdout.write('one round trip per segment: {0:.1f} s\n'.format(sequential))
+    finally:
+        primary.shutdown()
+        backup.shutdown()
+
+################################################################################
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+################################################################################
+# Writes decoded segments to a file the former way, seeking, writing, syncing
+# and journaling every segment, and through FileWriter, in MB/s, CPU seconds,
+# write system calls and syncs per GB.
+#
+#   python benchmarks/bench_write.py [--size 1024] [--segment-size 768000]
+#                                    [--dir /tmp]
+################################################################################
+import argparse
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from nzb2http import filewriter
+from nzb2http import journal
+
+################################################################################
+class LegacyWriter:
+    def __init__(self, path, size):
+        self.journal = journal.Journal(os.path.join(os.path.dirname(path), '.journal'))
+        self.name    = os.path.basename(path)
+        self.file    = open(path, 'w+b')
+        self.file.truncate(size)
+
+    def write_segment(self, index, size, offset, data, crc32):
+        self.file.seek(offset)
+        self.file.write(data)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.journal.segments_written(self.name, [(index, offset, len(data), crc32, size)])
+
+    def close(self):
+        self.file.close()
+        self.journal.close()
+
+################################################################################
+class PositionalWriter:
+    def __init__(self, path, size):
+        self.journal     = journal.Journal(os.path.join(os.path.dirname(path), '.journal'))
+        self.file_writer = filewriter.FileWriter(path, (size + SEGMENT_SIZE - 1) // SEGMENT_SIZE, self.journal)
+
+    def write_segment(self, index, size, offset, data, crc32):
+        self.file_writer.write_segment(index, size, offset, data, crc32)
+
+    def close(self):
+        self.journal.close()
+
+################################################################################
+SEGMENT_SIZE = 768000
+
+_sync_count = [0]
+
+def _count_syncs(sync):
+    def counting_sync(fd):
+        _sync_count[0] = _sync_count[0] + 1
+        return sync(fd)
+    return counting_sync
+
+os.fsync               = _count_syncs(os.fsync)
+filewriter._fdatasync  = _count_syncs(filewriter._fdatasync)
+
+################################################################################
+def get_write_syscalls():
+    # Write system calls of the process, where /proc tells
+    try:
+        with open('/proc/self/io') as io_file:
+            for line in io_file:
+                if line.startswith('syscw:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return None
+
+################################################################################
+def measure(writer_class, work_dir, size):
+    path      = os.path.join(work_dir, writer_class.__name__)
+    count     = (size + SEGMENT_SIZE - 1) // SEGMENT_SIZE
+    segment   = os.urandom(SEGMENT_SIZE)
+    last      = segment[:size - (count - 1) * SEGMENT_SIZE]
+    crc32s    = (zlib.crc32(segment) & 0xffffffff, zlib.crc32(last) & 0xffffffff)
+
+    _sync_count[0] = 0
+    start_syscalls = get_write_syscalls()
+    start_usage    = resource.getrusage(resource.RUSAGE_SELF)
+    start_time     = time.time()
+
+    writer = writer_class(path, size)
+    for index in range(count):
+        if index < count - 1:
+            writer.write_segment(index, size, index * SEGMENT_SIZE, segment, crc32s[0])
+        else:
+            writer.write_segment(index, size, index * SEGMENT_SIZE, last, crc32s[1])
+    writer.close()
+
+    elapsed   = time.time() - start_time
+    end_usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_time  = (end_usage.ru_utime - start_usage.ru_utime) + (end_usage.ru_stime - start_usage.ru_stime)
+    syscalls  = get_write_syscalls()
+    gigabytes = size / float(1024 ** 3)
+
+    for name in os.listdir(work_dir):
+        os.remove(os.path.join(work_dir, name))
+
+    return (size / elapsed / (1024 * 1024), cpu_time / gigabytes, (syscalls - start_syscalls) / gigabytes if syscalls is not None else float('nan'), _sync_count[0] / gigabytes)
+
+################################################################################
+def main():
+    global SEGMENT_SIZE
+
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--size', default=1024, type=int, help='Size of the file in MB')
+    arg_parser.add_argument('--segment-size', default=SEGMENT_SIZE, type=int)
+    arg_parser.add_argument('--dir', default=None, help='Directory on the disk to measure')
+    args = arg_parser.parse_args()
+
+    SEGMENT_SIZE = args.segment_size
+    size         = args.size * 1024 * 1024
+    work_dir     = tempfile.mkdtemp(prefix='nzb2http-bench-', dir=args.dir)
+    try:
+        print('{0} MB in {1} byte segments'.format(args.size, SEGMENT_SIZE))
+        for writer_class in (LegacyWriter, PositionalWriter):
+            throughput, cpu_seconds, syscalls, syncs = measure(writer_class, work_dir, size)
+            print('{0:16s} {1:8.1f} MB/s  {2:6.2f} CPU s/GB  {3:8.0f} write syscalls/GB  {4:6.0f} syncs/GB'.format(writer_class.__name__, throughput, cpu_seconds, syscalls, syncs))
+    finally:
+        shutil.rmtree(work_dir)
+
+################################################################################
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+################################################################################
+# Compares the bulk yEnc decoder against the former line by line decoder, in
+# MB/s of decoded data, then decodes from several threads, in the threads and
+# in a decoder process pool.
+#
+#   python benchmarks/bench_yenc.py [--segment-size 768000] [--rounds 200]
+#                                   [--threads 8] [--processes 4]
+################################################################################
+import argparse
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import time
+import yenc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import fakenntp
+
+from nzb2http import decoder
+from nzb2http import downloader
+
+################################################################################
+def legacy_yenc_decode(text_lines):
+    RE_YENC_BEGIN = re.compile('=ybegin .*name=(.+)')
+    RE_YENC_PART  = re.compile('=ypart .*begin=(.+) ')
+
+    yenc_decoder        = None
+    content_file_name   = None
+    content_file_offset = 0
+
+    for text_line in text_lines:
+        if not yenc_decoder:
+            match_result = RE_YENC_BEGIN.match(text_line)
+            if match_result:
+                content_file_name = match_result.group(1)
+                yenc_decoder = yenc.Decoder()
+            continue
+        if text_line.startswith('=ypart '):
+            content_file_offset = int(RE_YENC_PART.match(text_line).group(1)) - 1
+            continue
+        if text_line.startswith('=yend '):
+            break
+
+        yenc_decoder.feed(text_line)
+
+    return yenc_decoder.getDecoded()
+
+################################################################################
+def measure(function, argument, rounds, decoded_size):
+    start_time = time.time()
+    for i in range(rounds):
+        function(argument)
+    return decoded_size * rounds / (time.time() - start_time) / (1024 * 1024)
+
+################################################################################
+def measure_threads(decode, body, rounds, thread_count, decoded_size):
+    thread_rounds = rounds // thread_count
+    threads       = [threading.Thread(target=lambda: [decode(body) for i in range(thread_rounds)]) for i in range(thread_count)]
+    start_time    = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return decoded_size * thread_rounds * thread_count / (time.time() - start_time) / (1024 * 1024)
+
+################################################################################
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--segment-size', default=768000, type=int)
+    arg_parser.add_argument('--rounds', default=200, type=int)
+    arg_parser.add_argument('--threads', default=8, type=int)
+    arg_parser.add_argument('--processes', default=multiprocessing.cpu_count(), type=int)
+    args = arg_parser.parse_args()
+
+    data = os.urandom(args.segment_size)
+    message_id, size, body_lines = fakenntp.build_articles('bench.part01.rar', data, args.segment_size)[0]
+    body = '\r\n'.join(body_lines) + '\r\n'
+
+    name, file_size, offset, content, crc32, crc_ok = downloader._yenc_decode(body)
+    assert content == data and crc_ok and legacy_yenc_decode(body_lines) == data
+
+    sys.stdout.write('legacy _yenc_decode (lines)  {0:8.2f} MB/s\n'.format(measure(legacy_yenc_decode, body_lines, args.rounds, len(data))))
+    sys.stdout.write('bulk _yenc_decode (buffer)   {0:8.2f} MB/s\n'.format(measure(downloader._yenc_decode, body, args.rounds, len(data))))
+
+    decoder_pool = decoder.DecoderPool(args.processes, args.threads, downloader._yenc_decode)
+    def pool_decode(article):
+        slot, result = decoder_pool.decode(article)
+        decoder_pool.release(slot)
+        return result
+    try:
+        slot, result = decoder_pool.decode(body)
+        assert str(result[3]) == data and result[4:] == (crc32, True)
+        decoder_pool.release(slot)
+
+        sys.stdout.write('{0} threads                    {1:8.2f} MB/s\n'.format(args.threads, measure_threads(downloader._yenc_decode, body, args.rounds, args.threads, len(data))))
+        sys.stdout.write('{0} threads, {1} processes       {2:8.2f} MB/s\n'.format(args.threads, args.processes, measure_threads(pool_decode, body, args.rounds, args.threads, len(data))))
+    finally:
+        decoder_pool.close()
+
+################################################################################
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+################################################################################
+import Queue
+import random
+import re
+import socket
+import SocketServer
+import sys
+import threading
+import time
+import zlib
+
+################################################################################
+YENC_LINE_LENGTH = 128
+
+RE_YENC_CRITICAL = re.compile('[\x00\n\r=]')
+
+YENC_TABLE = ''.join(chr((i + 42) % 256) for i in range(256))
+
+################################################################################
+def yenc_encode_lines(data):
+    encoded = RE_YENC_CRITICAL.sub(lambda match: '=' + chr((ord(match.group(0)) + 64) % 256), data.translate(YENC_TABLE))
+
+    lines    = []
+    position = 0
+    while position < len(encoded):
+        end = position + YENC_LINE_LENGTH
+        if encoded[end - 1:end] == '=':
+            end = end + 1
+        lines.append(encoded[position:end])
+        position = end
+    return lines
+
+################################################################################
+def build_articles(file_name, data, segment_size):
+    """
+    Splits data into yEnc encoded parts. Returns a list of (message_id, size,
+    body_lines) tuples, size being the encoded size as an NZB would report it.
+    """
+    articles = []
+    total    = (len(data) + segment_size - 1) // segment_size
+    for part in range(total):
+        begin      = part * segment_size
+        part_data  = data[begin:begin + segment_size]
+        body_lines = ['=ybegin part={0} total={1} line={2} size={3} name={4}'.format(part + 1, total, YENC_LINE_LENGTH, len(data), file_name),
+                      '=ypart begin={0} end={1}'.format(begin + 1, begin + len(part_data))]
+        body_lines = body_lines + yenc_encode_lines(part_data)
+        body_lines.append('=yend size={0} part={1} pcrc32={2:08x}'.format(len(part_data), part + 1, zlib.crc32(part_data) & 0xFFFFFFFF))
+
+        message_id = '{0}.{1}@fakenntp'.format(file_name, part + 1)
+        articles.append((message_id, sum(len(line) + 2 for line in body_lines), body_lines))
+    return articles
+
+################################################################################
+class FakeNNTPHandler(SocketServer.StreamRequestHandler):
+    """
+    Commands are read as they arrive and their responses queued for a writer
+    thread, which sends each one latency seconds after its command was
+    received. Like a network round trip, this delays pipelined commands
+    without serializing their latencies.
+    """
+    ############################################################################
+    def handle(self):
+        self.server.connection_count = self.server.connection_count + 1
+        self.responses = Queue.Queue()
+        self.due_time  = 0
+
+        writer = threading.Thread(target=self._write_responses)
+        writer.daemon = True
+        writer.start()
+
+        self._queue('200 fakenntp ready', 0)
+
+        while True:
+            try:
+                line = self.rfile.readline()
+            except socket.error:
+                break
+            if not line:
+                break
+
+            command = line.strip().split(' ')
+            verb    = command[0].upper()
+
+            if verb == 'QUIT':
+                self._queue('205 bye', 0)
+                break
+            elif verb == 'AUTHINFO':
+                if command[1].upper() == 'USER':
+                    self._queue('381 password required', 0)
+                else:
+                    self._queue('281 authenticated', 0)
+            elif verb in ('ARTICLE', 'BODY', 'STAT'):
+                self._queue_article(verb, command[1])
+            else:
+                self._queue('500 unknown command', 0)
+
+        self.responses.put(None)
+        writer.join()
+
+    ############################################################################
+    def _queue_article(self, verb, message_id):
+        if random.random() < self.server.drop_rate:
+            self.server.dropped_count = self.server.dropped_count + 1
+            self.request.shutdown(socket.SHUT_RDWR)
+            return
+
+        latency    = self.server.latency + random.random() * self.server.jitter
+        body_lines = self.server.articles.get(message_id.strip('<>'))
+        if body_lines is None or message_id.strip('<>') in self.server.missing:
+            self._queue('430 no such article', latency)
+            return
+
+        if verb == 'STAT':
+            self._queue('223 0 {0}'.format(message_id), latency)
+            return
+
+        response = []
+        if verb == 'ARTICLE':
+            response.append('220 0 {0}'.format(message_id))
+            response.append('Message-ID: {0}'.format(message_id))
+            response.append('')
+        else:
+            response.append('222 0 {0}'.format(message_id))
+        for body_line in body_lines:
+            if body_line.startswith('.'):
+                body_line = '.' + body_line
+            response.append(body_line)
+        response.append('.')
+
+        self._queue('\r\n'.join(response), latency)
+
+    ############################################################################
+    def _queue(self, response, latency):
+        # Responses keep the order of their commands
+        self.due_time = max(self.due_time, time.time() + latency)
+        self.responses.put((self.due_time, response + '\r\n'))
+
+    ############################################################################
+    def _write_responses(self):
+        try:
+            item = self.responses.get()
+            while item:
+                due_time, payload = item
+                time.sleep(max(0, due_time - time.time()))
+                if self.server.bandwidth:
+                    chunk_size = 64 * 1024
+                    for position in range(0, len(payload), chunk_size):
+                        self.wfile.write(payload[position:position + chunk_size])
+                        time.sleep(float(chunk_size) / self.server.bandwidth)
+                else:
+                    self.wfile.write(payload)
+                self.wfile.flush()
+                item = self.responses.get()
+        except socket.error:
+            pass
+
+################################################################################
+class FakeNNTPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """
+    Serves yEnc articles from memory. Arguments:
+        - latency: seconds each article response is delayed by
+        - jitter: maximum random seconds added on top of latency
+        - bandwidth: per-connection bytes per second, 0 for unlimited
+        - missing: message ids answered with 430 although present
+        - drop_rate: probability for an article request to drop its connection
+    """
+    allow_reuse_address = True
+    daemon_threads      = True
+
+    ############################################################################
+    def __init__(self, articles, latency=0.0, jitter=0.0, bandwidth=0, missing=(), drop_rate=0.0, port=0):
+        SocketServer.TCPServer.__init__(self, ('127.0.0.1', port), FakeNNTPHandler)
+        self.articles         = articles
+        self.latency          = latency
+        self.jitter           = jitter
+        self.bandwidth        = bandwidth
+        self.missing          = set(missing)
+        self.drop_rate        = drop_rate
+        self.connection_count = 0
+        self.dropped_count    = 0
+
+    ############################################################################
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    ############################################################################
+    def get_port(self):
+        return self.server_address[1]
+
+    ############################################################################
+    def handle_error(self, request, client_address):
+        # Clients disconnecting with responses still pending are expected
+        if not isinstance(sys.exc_info()[1], socket.error):
+            SocketServer.TCPServer.handle_error(self, request, client_address)
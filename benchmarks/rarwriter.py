@@ -0,0 +1,177 @@
+################################################################################
+# Writes synthetic multi-volume RAR 2.9 archives holding files stored without
+# compression, which unrar extracts like a real release.
+################################################################################
+import os
+import struct
+import zlib
+
+################################################################################
+RAR_MARKER = 'Rar!\x1a\x07\x00'
+
+BLOCK_MAIN = 0x73
+BLOCK_FILE = 0x74
+BLOCK_END  = 0x7b
+
+MAIN_FLAG_VOLUME     = 0x0001
+MAIN_FLAG_NEW_NAMING = 0x0010
+MAIN_FLAG_FIRST      = 0x0100
+
+FILE_FLAG_SPLIT_BEFORE = 0x0001
+FILE_FLAG_SPLIT_AFTER  = 0x0002
+FILE_FLAG_ADD_SIZE     = 0x8000
+
+END_FLAG_NEXT_VOLUME = 0x0001
+
+METHOD_STORE = 0x30
+
+################################################################################
+def _block(block_type, flags, body):
+    header = struct.pack('<BHH', block_type, flags, 7 + len(body)) + body
+    return struct.pack('<H', zlib.crc32(header) & 0xffff) + header
+
+################################################################################
+def _file_header_size(name):
+    return 7 + 25 + len(name)
+
+################################################################################
+def iter_content(size, block_size=1024 * 1024):
+    """
+    Yields size bytes of incompressible content in blocks, without holding all
+    of it in memory.
+    """
+    block    = os.urandom(block_size)
+    position = 0
+    while position < size:
+        length   = min(block_size, size - position)
+        yield block[:length] if length < block_size else block
+        position = position + length
+
+################################################################################
+def write_store_volumes(base_path, name, content, size, volume_size):
+    """
+    Writes content, an iterable of strings adding up to size bytes, as the file
+    name stored in volumes of at most volume_size bytes, named
+    base_path.partNN.rar.
+
+    Returns:
+        - paths: paths of the volumes written, in order
+        - crc32: CRC32 of the stored file
+    """
+    overhead    = len(RAR_MARKER) + 13 + _file_header_size(name) + 7
+    volume_data = volume_size - overhead
+    volumes     = max(1, (size + volume_data - 1) // volume_data)
+    digits      = max(2, len(str(volumes)))
+    paths       = []
+    crc32       = 0
+    pending     = ''
+    content     = iter(content)
+
+    for volume in range(volumes):
+        length = min(volume_data, size - volume * volume_data)
+        last   = volume == volumes - 1
+
+        # The file header precedes the data it describes, so the data of the
+        # volume is gathered first
+        chunks = []
+        needed = length
+        while needed > 0:
+            if not pending:
+                pending = next(content)
+            chunk   = pending[:needed]
+            pending = pending[needed:]
+            chunks.append(chunk)
+            needed  = needed - len(chunk)
+
+        volume_crc32 = 0
+        for chunk in chunks:
+            volume_crc32 = zlib.crc32(chunk, volume_crc32)
+            crc32        = zlib.crc32(chunk, crc32)
+
+        main_flags = MAIN_FLAG_VOLUME | MAIN_FLAG_NEW_NAMING | (MAIN_FLAG_FIRST if volume == 0 else 0)
+        file_flags = FILE_FLAG_ADD_SIZE | (FILE_FLAG_SPLIT_BEFORE if volume > 0 else 0) | (FILE_FLAG_SPLIT_AFTER if not last else 0)
+        file_crc32 = (crc32 if last else volume_crc32) & 0xffffffff
+        file_body  = struct.pack('<IIBIIBBHI', length, size, 2, file_crc32, 0x4a000000, 29, METHOD_STORE, len(name), 0x20) + name
+
+        path = '{0}.part{1:0{2}d}.rar'.format(base_path, volume + 1, digits)
+        with open(path, 'wb') as volume_file:
+            volume_file.write(RAR_MARKER)
+            volume_file.write(_block(BLOCK_MAIN, main_flags, struct.pack('<HI', 0, 0)))
+            volume_file.write(_block(BLOCK_FILE, file_flags, file_body))
+            for chunk in chunks:
+                volume_file.write(chunk)
+            volume_file.write(_block(BLOCK_END, 0 if last else END_FLAG_NEXT_VOLUME, ''))
+        paths.append(path)
+
+    return (paths, crc32 & 0xffffffff)
+
+################################################################################
+def write_store_pack(base_path, files, volume_size):
+    """
+    Writes files, a list of (name, content, size) with content as for
+    write_store_volumes, stored one after the other in volumes of at most
+    volume_size bytes, like a season pack. Files start in the middle of the
+    volume where the previous one ends.
+
+    Returns:
+        - paths: paths of the volumes written, in order
+        - crc32s: CRC32 of each file
+    """
+    # The volumes are first laid out as (file index, offset, length) parts
+    volumes  = [[]]
+    capacity = volume_size - len(RAR_MARKER) - 13 - 7
+    for index, (name, content, size) in enumerate(files):
+        offset = 0
+        while offset < size or not size:
+            room = capacity - sum(_file_header_size(files[part[0]][0]) + part[2] for part in volumes[-1]) - _file_header_size(name)
+            if room <= 0:
+                volumes.append([])
+                continue
+            length = min(room, size - offset)
+            volumes[-1].append((index, offset, length))
+            offset = offset + length
+            if not size:
+                break
+
+    digits   = max(2, len(str(len(volumes))))
+    paths    = []
+    crc32s   = [0] * len(files)
+    contents = [iter(content) for name, content, size in files]
+    pending  = [''] * len(files)
+
+    for volume, parts in enumerate(volumes):
+        main_flags = MAIN_FLAG_VOLUME | MAIN_FLAG_NEW_NAMING | (MAIN_FLAG_FIRST if volume == 0 else 0)
+        path       = '{0}.part{1:0{2}d}.rar'.format(base_path, volume + 1, digits)
+        with open(path, 'wb') as volume_file:
+            volume_file.write(RAR_MARKER)
+            volume_file.write(_block(BLOCK_MAIN, main_flags, struct.pack('<HI', 0, 0)))
+
+            for index, offset, length in parts:
+                name, content, size = files[index]
+                chunks = []
+                needed = length
+                while needed > 0:
+                    if not pending[index]:
+                        pending[index] = next(contents[index])
+                    chunk          = pending[index][:needed]
+                    pending[index] = pending[index][needed:]
+                    chunks.append(chunk)
+                    needed         = needed - len(chunk)
+
+                part_crc32 = 0
+                for chunk in chunks:
+                    part_crc32    = zlib.crc32(chunk, part_crc32)
+                    crc32s[index] = zlib.crc32(chunk, crc32s[index])
+
+                last       = offset + length == size
+                file_flags = FILE_FLAG_ADD_SIZE | (FILE_FLAG_SPLIT_BEFORE if offset else 0) | (FILE_FLAG_SPLIT_AFTER if not last else 0)
+                file_crc32 = (crc32s[index] if last else part_crc32) & 0xffffffff
+                file_body  = struct.pack('<IIBIIBBHI', length, size, 2, file_crc32, 0x4a000000, 29, METHOD_STORE, len(name), 0x20) + name
+                volume_file.write(_block(BLOCK_FILE, file_flags, file_body))
+                for chunk in chunks:
+                    volume_file.write(chunk)
+
+            volume_file.write(_block(BLOCK_END, 0 if volume == len(volumes) - 1 else END_FLAG_NEXT_VOLUME, ''))
+        paths.append(path)
+
+    return (paths, [crc32 & 0xffffffff for crc32 in crc32s])
@@ -10,37 +10,66 @@ from nzb2http import server
 ################################################################################
 def main():
     arg_parser = argparse.ArgumentParser()
-    arg_parser.add_argument('server', help='Usenet server (username:password@host:port)')
-    arg_parser.add_argument('nzb_path', help='NZB file or URL')
+    arg_parser.add_argument('server', help='Usenet server (username:password@host:port[/connections])')
+    arg_parser.add_argument('nzb_path', nargs='?', help='NZB file or URL, gzip compressed or not, more can be added through POST /jobs')
+    arg_parser.add_argument('-b', '--backup-server', action='append', default=[], help='Backup Usenet server for missing articles, tried in order (username:password@host:port[/connections])')
     arg_parser.add_argument('-p', '--http-port', default=8080, help='Port used for HTTP server')
     arg_parser.add_argument('-d', '--download-dir', default='.', help='Directory to use for downloading')
     arg_parser.add_argument('-s', '--ssl', action='store_true', help='Use SSL connection')
-    arg_parser.add_argument('-m', '--connections', default=1, help='Max concurrent connections')
-    arg_parser.add_argument('-t', '--timeout', default=30, help='Automatic shutdown timeout')
+    arg_parser.add_argument('-m', '--connections', default=1, help='Max concurrent connections per server')
+    arg_parser.add_argument('-n', '--min-connections', default=None, help='Min concurrent connections to the first server, adapting their number to keep --target-buffer downloaded ahead of readers')
+    arg_parser.add_argument('--target-buffer', default=60, help='Seconds of video kept downloaded ahead of readers with --min-connections')
+    arg_parser.add_argument('-f', '--active-files', default=2, help='Max files downloaded concurrently')
+    arg_parser.add_argument('-l', '--pipeline', default=4, help='Max pipelined requests per connection')
+    arg_parser.add_argument('-j', '--decode-processes', default=0, help='Processes decoding articles, 0 to decode them in the connection threads')
+    arg_parser.add_argument('--stat-scan', action='store_true', help='Check the availability of every segment on the servers with pipelined STAT commands first, to fetch missing ones from the servers which have them and the PAR2 volumes they need right away')
+    arg_parser.add_argument('--disk-budget', default=None, help='MB of disk space a job may use, deleting the volumes and extracted data readers are done with')
+    arg_parser.add_argument('--cache-size', default=64, help='MB of recently downloaded and extracted data kept in memory for readers, 0 to read everything back from disk')
+    arg_parser.add_argument('-e', '--http-engine', default='cherrypy', choices=['cherrypy', 'stream'], help='HTTP server: CherryPy with a thread per request, or a single thread stream server sending files with sendfile')
+    arg_parser.add_argument('-t', '--timeout', default=30, help='Automatic shutdown timeout, 0 to never shut down')
     args = arg_parser.parse_args()
 
-    RE_HOST = re.compile('(.+):(.+)@(.+):(\d+)')
+    RE_HOST = re.compile('(.+):(.+)@(.+):(\d+)(?:/(\d+))?$')
 
-    nntp_credentials = {    
-                            'host':             RE_HOST.search(args.server).group(3),
-                            'port':             int(RE_HOST.search(args.server).group(4)),
-                            'username':         RE_HOST.search(args.server).group(1),
-                            'password':         RE_HOST.search(args.server).group(2),
-                            'use_ssl':          args.ssl,
-                            'max_connections':  int(args.connections)
+    nntp_servers = []
+    for nntp_server in [args.server] + args.backup_server:
+        nntp_credentials = {    
+                                'host':             RE_HOST.search(nntp_server).group(3),
+                                'port':             int(RE_HOST.search(nntp_server).group(4)),
+                                'username':         RE_HOST.search(nntp_server).group(1),
+                                'password':         RE_HOST.search(nntp_server).group(2),
+                                'use_ssl':          args.ssl,
+                                'max_connections':  int(RE_HOST.search(nntp_server).group(5) or args.connections)
+                           }
+        nntp_servers.append(nntp_credentials)
+
+    download_options = {
+                            'max_active_files': int(args.active_files),
+                            'pipeline_depth':   int(args.pipeline),
+                            'decode_processes': int(args.decode_processes),
+                            'min_connections':  int(args.min_connections) if args.min_connections is not None else None,
+                            'target_buffer':    int(args.target_buffer),
+                            'disk_budget':      int(args.disk_budget) * 1024 * 1024 if args.disk_budget is not None else None,
+                            'stat_scan':        args.stat_scan,
+                            'cache_size':       int(args.cache_size) * 1024 * 1024
                        }
 
-    if os.path.isfile(args.nzb_path):
-        nzb_name = os.path.basename(args.nzb_path)
-        with open(args.nzb_path, 'r') as nzb:
-            nzb_content = nzb.read()
-    else:
+    # The NZB is handed over open, it is parsed as it is read
+    nzb_name    = None
+    nzb_content = None
+    if args.nzb_path and os.path.isfile(args.nzb_path):
+        nzb_name    = os.path.basename(args.nzb_path)
+        nzb_content = open(args.nzb_path, 'rb')
+    elif args.nzb_path:
         filename, headers = urllib.urlretrieve(args.nzb_path)
         nzb_name          = re.search('.+filename=(.+)$', headers['Content-Disposition']).group(1)  
-        with open(filename, 'r') as nzb:
-            nzb_content = nzb.read()        
+        nzb_content       = open(filename, 'rb')
+
+    # Gzip compressed NZBs are downloaded to the directory of the plain name
+    if nzb_name and nzb_name.endswith('.gz'):
+        nzb_name = nzb_name[:-3]
 
-    server = nzb2http.server.Server(int(args.http_port), nntp_credentials, args.download_dir, int(args.timeout), nzb_name, nzb_content)
+    server = nzb2http.server.Server(int(args.http_port), nntp_servers, download_options, args.download_dir, int(args.timeout), nzb_name, nzb_content, args.http_engine)
     server.run()
 
 ################################################################################
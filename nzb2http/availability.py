@@ -0,0 +1,104 @@
+################################################################################
+import collections
+import time
+
+################################################################################
+# STAT commands sent at once by a connection, answered in one round trip
+STAT_BATCH_SIZE = 100
+
+################################################################################
+class AvailabilityScan:
+    """
+    Checks which servers have the segments of a job with STAT commands,
+    pipelined in batches over the connections downloading them. Every segment
+    is checked on the first server, and those it is missing on the next
+    servers in turn, so that backup servers only get the segments they are
+    needed for.
+    """
+    ############################################################################
+    def __init__(self, segments, server_count, condition):
+        # segments are (nzb_file, index) tuples; the scan shares the
+        # condition of the scheduler handing out its batches
+        self.server_count  = server_count
+        self.condition     = condition
+        self.segment_count = len(segments)
+        self.pending       = [collections.deque() for server_index in range(server_count)]
+        self.in_flight     = [0] * server_count
+        self.checked       = [0] * server_count
+        self.start_time    = time.time()
+        self.end_time      = None if segments else self.start_time
+
+        # Segments found missing, per server
+        self.missing       = [set() for server_index in range(server_count)]
+
+        self.pending[0].extend(segments)
+
+    ############################################################################
+    def get_batch(self, server_index):
+        """
+        Returns:
+            - batch: list of at most STAT_BATCH_SIZE segments to check on a
+              server, None if there are none
+        """
+        with self.condition:
+            pending = self.pending[server_index]
+            batch   = [pending.popleft() for i in range(min(STAT_BATCH_SIZE, len(pending)))]
+            if not batch:
+                return None
+            self.in_flight[server_index] = self.in_flight[server_index] + len(batch)
+            return batch
+
+    ############################################################################
+    def batch_done(self, server_index, batch, responses):
+        # Records the responses to the STAT commands of a batch. Segments the
+        # server does not have are checked on the next one; other errors tell
+        # nothing and the segment is deemed available.
+        with self.condition:
+            self.in_flight[server_index] = self.in_flight[server_index] - len(batch)
+            self.checked[server_index]   = self.checked[server_index] + len(batch)
+            for segment, response in zip(batch, responses):
+                if response[:3] == '430':
+                    self.missing[server_index].add(segment)
+                    if server_index + 1 < self.server_count:
+                        self.pending[server_index + 1].append(segment)
+
+            if self.end_time is None and not any(self.pending) and not any(self.in_flight):
+                self.end_time = time.time()
+            self.condition.notify_all()
+
+    ############################################################################
+    def batch_cancelled(self, server_index, batch):
+        # Requeues a batch whose responses were not read, e.g. when its
+        # connection was lost
+        with self.condition:
+            self.in_flight[server_index] = self.in_flight[server_index] - len(batch)
+            self.pending[server_index].extendleft(reversed(batch))
+            self.condition.notify_all()
+
+    ############################################################################
+    def get_server_index(self, nzb_file, index):
+        """
+        Returns:
+            - server_index: first server which is not known to miss a segment,
+              None if every server misses it
+        """
+        segment = (nzb_file, index)
+        with self.condition:
+            for server_index in range(self.server_count):
+                if segment not in self.missing[server_index]:
+                    return server_index
+            return None
+
+    ############################################################################
+    def is_finished(self):
+        with self.condition:
+            return self.end_time is not None
+
+    ############################################################################
+    def get_missing(self):
+        """
+        Returns:
+            - segments: (nzb_file, index) of the segments no server has
+        """
+        with self.condition:
+            return sorted(self.missing[-1], key=lambda segment: (segment[0].name, segment[1]))
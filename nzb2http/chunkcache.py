@@ -0,0 +1,94 @@
+################################################################################
+import bisect
+import collections
+import stats
+import threading
+
+################################################################################
+class ChunkCache:
+    """
+    Recently written data kept in memory up to max_size bytes, the least
+    recently used chunks being evicted first: segments as decoded, keyed by
+    the path of their volume, and data as extracted, keyed by the path of the
+    extracted file. Readers near the playhead get it from there instead of
+    reading back what was just written.
+    """
+    ############################################################################
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size     = 0
+        self.lock     = threading.Lock()
+
+        # Chunks keyed by (path, offset), from the least to the most recently
+        # used, and their sorted offsets per path to find the chunk holding
+        # any offset
+        self.chunks   = collections.OrderedDict()
+        self.offsets  = {}
+
+        self.hits      = stats.counter('nzb2http_cache_hits_total', 'Reads served from the in-memory chunk cache')
+        self.misses    = stats.counter('nzb2http_cache_misses_total', 'Reads not served from the in-memory chunk cache')
+        self.hit_bytes = stats.counter('nzb2http_cache_hit_bytes_total', 'Bytes served from the in-memory chunk cache')
+        stats.gauge('nzb2http_cache_bytes', 'Bytes held by the in-memory chunk cache', lambda: [({}, self.size)])
+
+    ############################################################################
+    def put(self, path, offset, data):
+        # data is copied, it may be a view of a buffer reused afterwards
+        if len(data) > self.max_size:
+            return
+        data = data.tobytes() if isinstance(data, memoryview) else str(data)
+
+        with self.lock:
+            self._remove((path, offset))
+            while self.size + len(data) > self.max_size:
+                self._remove(next(iter(self.chunks)))
+
+            self.chunks[(path, offset)] = data
+            self.size = self.size + len(data)
+            bisect.insort(self.offsets.setdefault(path, []), offset)
+
+    ############################################################################
+    def get(self, path, offset, size):
+        """
+        Returns:
+            - data: at most size bytes of path from offset on, None if no chunk
+              holds the byte at offset
+        """
+        with self.lock:
+            offsets = self.offsets.get(path)
+            if offsets:
+                start = offsets[bisect.bisect_right(offsets, offset) - 1] if offsets[0] <= offset else None
+                data  = self.chunks[(path, start)] if start is not None else None
+                if data is not None and offset < start + len(data):
+                    # Moved to the most recently used end
+                    del self.chunks[(path, start)]
+                    self.chunks[(path, start)] = data
+                    data = data[offset - start:offset - start + size]
+                    self.hits.add()
+                    self.hit_bytes.add(len(data))
+                    return data
+
+        self.misses.add()
+        return None
+
+    ############################################################################
+    def discard(self, path, end=None):
+        # Drops the chunks of path, only those before end if given, e.g. once
+        # the file is deleted or rewritten
+        with self.lock:
+            for offset in list(self.offsets.get(path, [])):
+                if end is not None and offset + len(self.chunks[(path, offset)]) > end:
+                    break
+                self._remove((path, offset))
+
+    ############################################################################
+    def _remove(self, key):
+        data = self.chunks.pop(key, None)
+        if data is None:
+            return
+
+        self.size = self.size - len(data)
+        path, offset = key
+        offsets = self.offsets[path]
+        del offsets[bisect.bisect_left(offsets, offset)]
+        if not offsets:
+            del self.offsets[path]
@@ -0,0 +1,155 @@
+################################################################################
+import struct
+
+################################################################################
+EBML_ID_HEADER    = 0x1A45DFA3
+EBML_ID_SEGMENT   = 0x18538067
+EBML_ID_SEEK_HEAD = 0x114D9B74
+EBML_ID_SEEK      = 0x4DBB
+EBML_ID_SEEK_ID   = 0x53AB
+EBML_ID_SEEK_POS  = 0x53AC
+EBML_ID_CUES      = 0x1C53BB6B
+EBML_ID_CLUSTER   = 0x1F43B675
+
+MP4_FIRST_BOX_TYPES = ('ftyp', 'styp')
+
+################################################################################
+def find_tail_index(head, file_size):
+    """
+    Looks for an index players read before playing, stored after the media
+    data: the moov box of an MP4 file or the Cues of a Matroska file.
+
+    Arguments:
+        - head: first bytes of the file, enough for its top level headers
+        - file_size: size of the whole file
+
+    Returns:
+        - (container, index_start, index_end): container being 'mp4' or 'mkv',
+          None if the container is not recognized or has no index past head
+    """
+    if head[4:8] in MP4_FIRST_BOX_TYPES:
+        index_start = _find_mp4_tail_index(head, file_size)
+        container   = 'mp4'
+    elif head[:4] == struct.pack('>I', EBML_ID_HEADER):
+        index_start = _find_mkv_tail_index(head)
+        container   = 'mkv'
+    else:
+        return None
+
+    if index_start is None or index_start < len(head) or index_start >= file_size:
+        return None
+    return (container, index_start, file_size)
+
+################################################################################
+def _find_mp4_tail_index(head, file_size):
+    # Walks the top level boxes; a moov box which is not ahead of mdat follows
+    # it
+    position = 0
+    while position + 8 <= len(head):
+        size, box_type = struct.unpack_from('>I4s', head, position)
+        if size == 1:
+            if position + 16 > len(head):
+                return None
+            size = struct.unpack_from('>Q', head, position + 8)[0]
+        elif size == 0:
+            size = file_size - position
+
+        if box_type == 'moov' or size < 8:
+            return None
+        if box_type == 'mdat':
+            return position + size
+        position = position + size
+    return None
+
+################################################################################
+def _find_mkv_tail_index(head):
+    # The position of the Cues is given by the SeekHead, the first element of
+    # the Segment, relative to the start of the Segment data
+    element_id, size, position = _read_element_header(head, 0)
+    if element_id != EBML_ID_HEADER or size is None:
+        return None
+
+    element_id, size, segment_start = _read_element_header(head, position + size)
+    if element_id != EBML_ID_SEGMENT:
+        return None
+
+    position = segment_start
+    while position is not None and position < len(head):
+        element_id, size, data_start = _read_element_header(head, position)
+        if element_id is None or element_id == EBML_ID_CLUSTER or size is None:
+            return None
+        if element_id == EBML_ID_SEEK_HEAD:
+            cues_position = _find_seek_position(head[data_start:data_start + size], EBML_ID_CUES)
+            if cues_position is not None:
+                return segment_start + cues_position
+        position = data_start + size
+    return None
+
+################################################################################
+def _find_seek_position(seek_head, wanted_id):
+    position = 0
+    while position < len(seek_head):
+        element_id, size, data_start = _read_element_header(seek_head, position)
+        if element_id is None or size is None:
+            return None
+
+        if element_id == EBML_ID_SEEK:
+            seek_id       = None
+            seek_position = None
+            child         = data_start
+            while child < data_start + size:
+                child_id, child_size, child_start = _read_element_header(seek_head, child)
+                if child_id is None or child_size is None:
+                    return None
+                value = _read_uint(seek_head[child_start:child_start + child_size])
+                if child_id == EBML_ID_SEEK_ID:
+                    seek_id = value
+                elif child_id == EBML_ID_SEEK_POS:
+                    seek_position = value
+                child = child_start + child_size
+
+            if seek_id == wanted_id:
+                return seek_position
+        position = data_start + size
+    return None
+
+################################################################################
+def _read_element_header(data, position):
+    """
+    Returns:
+        - (element_id, size, data_start): size being None for elements of
+          unknown size, all None if data is cut off
+    """
+    element_id, id_length = _read_vint(data, position, keep_marker=True)
+    if element_id is None:
+        return (None, None, None)
+    size, size_length = _read_vint(data, position + id_length)
+    if size_length is None:
+        return (None, None, None)
+    if size == (1 << (7 * size_length)) - 1:
+        size = None
+    return (element_id, size, position + id_length + size_length)
+
+################################################################################
+def _read_vint(data, position, keep_marker=False):
+    if position >= len(data):
+        return (None, None)
+
+    first  = ord(data[position])
+    length = 1
+    while length <= 8 and not first & (0x80 >> (length - 1)):
+        length = length + 1
+    if length > 8 or position + length > len(data):
+        return (None, None)
+
+    value = first if keep_marker else first & ((0x80 >> (length - 1)) - 1)
+    for byte in data[position + 1:position + length]:
+        value = (value << 8) | ord(byte)
+    return (value, length)
+
+################################################################################
+def _read_uint(data):
+    value = 0
+    for byte in data:
+        value = (value << 8) | ord(byte)
+    return value
@@ -0,0 +1,49 @@
+################################################################################
+CRC32_POLYNOMIAL = 0xedb88320
+
+# Operators appending a number of zero bytes to a CRC32, keyed by that number.
+# Segments of a file mostly have the same size, so very few are ever built.
+_zero_operators = {}
+
+################################################################################
+def crc32_combine(crc1, crc2, length2):
+    """
+    Computes the CRC32 of two blocks of data put together from the CRC32 of
+    each of them and the length of the second, as zlib's crc32_combine does.
+    """
+    operator = _zero_operators.get(length2)
+    if operator is None:
+        if len(_zero_operators) > 64:
+            _zero_operators.clear()
+        operator = _zero_operators[length2] = _get_zero_operator(length2)
+    return (_gf2_matrix_times(operator, crc1 & 0xffffffff) ^ crc2) & 0xffffffff
+
+################################################################################
+def _get_zero_operator(length):
+    # Operator for one zero bit, squared three times for one zero byte
+    operator = [CRC32_POLYNOMIAL] + [1 << n for n in range(31)]
+    for i in range(3):
+        operator = _gf2_matrix_square(operator)
+
+    result = [1 << n for n in range(32)]
+    while length:
+        if length & 1:
+            result = [_gf2_matrix_times(operator, column) for column in result]
+        operator = _gf2_matrix_square(operator)
+        length   = length >> 1
+    return result
+
+################################################################################
+def _gf2_matrix_times(matrix, vector):
+    result = 0
+    index  = 0
+    while vector:
+        if vector & 1:
+            result = result ^ matrix[index]
+        vector = vector >> 1
+        index  = index + 1
+    return result
+
+################################################################################
+def _gf2_matrix_square(matrix):
+    return [_gf2_matrix_times(matrix, column) for column in matrix]
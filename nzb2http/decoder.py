@@ -0,0 +1,86 @@
+################################################################################
+import mmap
+import multiprocessing
+import Queue
+import signal
+
+################################################################################
+# Shared memory for one article being decoded; larger articles are decoded in
+# the calling thread
+DECODE_SLOT_SIZE = 4 * 1024 * 1024
+
+# Set in the processes of the pool when they start
+_shared_memory = None
+_decode        = None
+
+################################################################################
+def _init_process(shared_memory, decode):
+    global _shared_memory
+    global _decode
+    _shared_memory = shared_memory
+    _decode        = decode
+
+    # Interrupts are handled by the main process, which stops the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+################################################################################
+def _decode_slot(slot, length):
+    # Runs in a process of the pool. The decoded data, never larger than the
+    # article, replaces it in its slot.
+    start = slot * DECODE_SLOT_SIZE
+    name, size, offset, content, crc32, crc_ok = _decode(_shared_memory[start:start + length])
+    _shared_memory[start:start + len(content)] = content
+    return (name, size, offset, len(content), crc32, crc_ok)
+
+################################################################################
+class DecoderPool:
+    """
+    Decodes articles in worker processes, so that decoding is not serialized
+    by the GIL held by the threads doing network I/O. Articles and decoded
+    data go through slots of an anonymous shared memory mapping inherited by
+    the processes, only slot numbers and decoding results being pickled.
+    """
+    ############################################################################
+    def __init__(self, processes, slot_count, decode):
+        self.decode_function = decode
+        self.shared_memory   = mmap.mmap(-1, slot_count * DECODE_SLOT_SIZE)
+        self.free_slots      = Queue.Queue()
+        for slot in range(slot_count):
+            self.free_slots.put(slot)
+        self.process_pool    = multiprocessing.Pool(processes, _init_process, (self.shared_memory, decode))
+
+    ############################################################################
+    def decode(self, article):
+        """
+        Decodes an article like the decode function, blocking the calling
+        thread only. The decoded data is a buffer on a slot of the shared
+        memory, valid until the slot is released.
+
+        Returns:
+            - slot: slot to release once the data is used, None if the article
+              was decoded in the calling thread
+            - result: (name, size, offset, data, crc32, crc_ok)
+        """
+        if len(article) > DECODE_SLOT_SIZE:
+            return (None, self.decode_function(article))
+
+        slot  = self.free_slots.get()
+        start = slot * DECODE_SLOT_SIZE
+        try:
+            self.shared_memory[start:start + len(article)] = article
+            name, size, offset, length, crc32, crc_ok = self.process_pool.apply_async(_decode_slot, (slot, len(article))).get()
+        except Exception:
+            self.free_slots.put(slot)
+            raise
+        return (slot, (name, size, offset, buffer(self.shared_memory, start, length), crc32, crc_ok))
+
+    ############################################################################
+    def release(self, slot):
+        if slot is not None:
+            self.free_slots.put(slot)
+
+    ############################################################################
+    def close(self):
+        self.process_pool.terminate()
+        self.process_pool.join()
+        self.shared_memory.close()
@@ -1,20 +1,29 @@
 ################################################################################
+import availability
+import collections
+import container
 import extractor
-import multiprocessing
+import filewrapper
+import filewriter
+import journal
 import nntp
+import nntplib
 import os
-import pynzb
+import nzbparser
+import par2index
+import rarheader
 import re
+import repairer
+import scheduler
+import socket
+import stats
 import sys
 import threading
+import time
 import yenc
 import zlib
 
-from multiprocessing.pool import ThreadPool
-
 ################################################################################
-RE_NZB_FILE_NAME = re.compile('\"(.+)\"')
-
 RE_RAR      = re.compile('\.rar$')
 RE_RXX      = re.compile('\.r\d+$')
 RE_XXX      = re.compile('\.\d\d\d$')
@@ -22,104 +31,333 @@ RE_PART_XX  = re.compile('.part\d+.rar$')
 RE_PART_01  = re.compile('.part01.rar$')
 RE_001      = re.compile('.001$')
 
-WORKERS = {}
+RE_YENC_NAME   = re.compile(' name=(.*)$')
+RE_YENC_SIZE   = re.compile(' size=(\d+)')
+RE_YENC_BEGIN  = re.compile(' begin=(\d+)')
+RE_YENC_PCRC32 = re.compile(' pcrc32=([0-9a-fA-F]+)')
+RE_YENC_CRC32  = re.compile(' crc32=([0-9a-fA-F]+)')
 
-################################################################################
-def _init_worker(nntp_credentials):
-    WORKERS[threading.current_thread()] = nntp.NNTP(nntp_credentials['host'], nntp_credentials['port'], nntp_credentials['username'], nntp_credentials['password'], nntp_credentials['use_ssl'])
+# Number of segments moved to the front of the queue when a reader asks for
+# extracted bytes which are not downloaded yet
+PREFETCH_SEGMENTS = 16
+
+# Maximum delay between two attempts to reconnect to a server
+MAX_RECONNECT_DELAY = 30
+
+# Journal of the segments downloaded, in the NZB directory
+JOURNAL_FILE_NAME = '.nzb2http.journal'
+
+# Bytes read from the start of a stored video to find where its index is, and
+# maximum size of the index moved to the front of the queue
+CONTAINER_HEAD_SIZE     = 64 * 1024
+MAX_INDEX_PREFETCH_SIZE = 32 * 1024 * 1024
+
+# Seconds between two looks for the start of the video while it downloads
+INDEX_CHECK_INTERVAL = 0.1
+
+VIDEO_EXTENSIONS = ('.mkv', '.mp4')
+
+# With a disk budget, bytes kept behind the slowest reader for short seeks
+# back, and seconds a read position keeps the data after it on disk, for
+# players reading the index at the end of a video before playing it
+DISK_RELEASE_MARGIN = 16 * 1024 * 1024
+DISK_RELEASE_DELAY  = 10
 
 ################################################################################
-def _run_worker(nzb_segment):
-    response, number, message_id, text_lines = WORKERS[threading.current_thread()].article('<' + nzb_segment.message_id + '>')
-    return _yenc_decode(text_lines)
+def _yenc_decode(article):
+    """
+    Decodes a yEnc article body in one pass over the buffer. Line endings may
+    be left in place but dot-stuffing must already be removed.
 
-############################################################################
-def _yenc_decode(text_lines):
-    RE_YENC_BEGIN = re.compile('=ybegin .*name=(.+)')
-    RE_YENC_PART  = re.compile('=ypart .*begin=(.+) ')
+    Returns:
+        - (name, size, offset, data, crc32, crc_ok): size being the size of the
+          whole file, offset the position of data within it, crc32 the CRC32 of
+          data and crc_ok whether it matches the part CRC32 of the =yend
+          trailer, if any
+    """
+    begin_start = article.find('=ybegin ')
+    if begin_start == -1:
+        raise ValueError('No yEnc data found')
+    begin_end = article.find('\n', begin_start)
+    begin     = article[begin_start:begin_end].rstrip('\r')
 
-    yenc_decoder        = None
-    content_file_name   = None
+    content_file_name   = RE_YENC_NAME.search(begin).group(1)
+    content_file_size   = int(RE_YENC_SIZE.search(begin).group(1))
     content_file_offset = 0
+    multipart           = article.startswith('=ypart ', begin_end + 1)
+
+    data_start = begin_end + 1
+    if multipart:
+        part_end            = article.find('\n', data_start)
+        content_file_offset = int(RE_YENC_BEGIN.search(article[data_start:part_end]).group(1)) - 1
+        data_start          = part_end + 1
+
+    end_start = article.rfind('=yend ', data_start)
+    if end_start == -1:
+        end_start = len(article)
+    end = article[end_start:].split('\n', 1)[0]
 
-    for text_line in text_lines:
-        if not yenc_decoder:
-            match_result = RE_YENC_BEGIN.match(text_line)
-            if match_result:
-                content_file_name = match_result.group(1)
-                yenc_decoder = yenc.Decoder()
-            continue
-        if text_line.startswith('=ypart '):
-            content_file_offset = int(RE_YENC_PART.match(text_line).group(1)) - 1
-            continue
-        if text_line.startswith('=yend '):
-            break
+    yenc_decoder = yenc.Decoder()
+    yenc_decoder.feed(article[data_start:end_start])
+    content = yenc_decoder.getDecoded()
+    crc32   = int(yenc_decoder.getCrc32(), 16)
 
-        yenc_decoder.feed(text_line)
+    # crc32 is the CRC32 of the whole file, that of the data of single part
+    # articles only
+    match_result = RE_YENC_PCRC32.search(end) or (not multipart and RE_YENC_CRC32.search(end))
+    if match_result:
+        crc_ok = int(match_result.group(1), 16) == crc32
+    else:
+        match_result = RE_YENC_SIZE.search(end)
+        crc_ok       = not match_result or int(match_result.group(1)) == len(content)
 
-    return yenc_decoder.getDecoded()
+    return (content_file_name, content_file_size, content_file_offset, content, crc32, crc_ok)
 
 ################################################################################
-class Downloader(threading.Thread):
+class Worker(threading.Thread):
     ############################################################################
-    def __init__(self, nntp_credentials, download_dir, nzb_name, nzb_content):
+    def __init__(self, server_index, nntp_credentials, scheduler, pipeline_depth, connection_index=0, decoder_pool=None):
         threading.Thread.__init__(self)
+        self.server_index     = server_index
         self.nntp_credentials = nntp_credentials
+        self.scheduler        = scheduler
+        self.pipeline_depth   = pipeline_depth
+        self.connection_index = connection_index
+        self.decoder_pool     = decoder_pool
+
+        self.received_bytes   = stats.counter('nzb2http_received_bytes_total', 'Bytes of articles received per connection', server=nntp_credentials['host'], connection=connection_index)
+        self.fetch_time       = stats.histogram('nzb2http_segment_fetch_seconds', 'Time from sending BODY to receiving the whole article', server=nntp_credentials['host'])
+        self.decode_time      = stats.histogram('nzb2http_yenc_decode_seconds', 'Time spent decoding an article')
+        self.write_time       = stats.histogram('nzb2http_segment_write_seconds', 'Time spent writing a decoded segment to disk')
+
+    ############################################################################
+    def run(self):
+        connection      = None
+        reconnect_delay = 0
+        pipeline        = collections.deque()
+
+        while not self.scheduler.stop_requested:
+            if not connection:
+                time.sleep(reconnect_delay)
+                try:
+                    connection      = nntp.NNTP(self.nntp_credentials['host'], self.nntp_credentials['port'], self.nntp_credentials['username'], self.nntp_credentials['password'], self.nntp_credentials['use_ssl'])
+                    reconnect_delay = 0
+                except (nntplib.NNTPError, socket.error, EOFError) as exception:
+                    reconnect_delay = min(MAX_RECONNECT_DELAY, max(1, reconnect_delay * 2))
+                    sys.stdout.write('[nzb2http][downloader] Failed to connect to {0}: {1}\n'.format(self.nntp_credentials['host'], exception))
+                    continue
+
+            # Keep pipeline_depth BODY commands in flight, only blocking for a
+            # new job when nothing is left to read. A batch of STAT commands
+            # takes one place, as (scan, segments).
+            try:
+                while len(pipeline) < self.pipeline_depth:
+                    job = self.scheduler.get(self.server_index, block=not pipeline)
+                    if not job:
+                        break
+                    scheduled_file, index = job
+                    pipeline.append((scheduled_file, index, time.time()))
+                    if isinstance(scheduled_file, availability.AvailabilityScan):
+                        connection.send_stats(['<' + nzb_file.segments[segment_index].message_id + '>' for nzb_file, segment_index in index])
+                    else:
+                        connection.send_body('<' + scheduled_file.nzb_file.segments[index].message_id + '>')
+            except socket.error as exception:
+                self._drop_connection(connection, pipeline, exception)
+                connection = None
+                continue
+
+            if not pipeline:
+                break
+
+            scheduled_file, index, send_time = pipeline.popleft()
+            if isinstance(scheduled_file, availability.AvailabilityScan):
+                try:
+                    responses = [connection.recv_stat() for segment in index]
+                except (socket.error, EOFError) as exception:
+                    scheduled_file.batch_cancelled(self.server_index, index)
+                    self._drop_connection(connection, pipeline, exception)
+                    connection = None
+                    continue
+                scheduled_file.batch_done(self.server_index, index, responses)
+                continue
+
+            try:
+                response, article = connection.recv_body()
+                receive_time = time.time()
+                self.fetch_time.observe(receive_time - send_time)
+                self.received_bytes.add(len(article))
+
+                # Articles of a connection are decoded and written in order
+                slot = None
+                if self.decoder_pool:
+                    slot, result = self.decoder_pool.decode(article)
+                else:
+                    result = _yenc_decode(article)
+                try:
+                    content_file_name, content_file_size, content_file_offset, content, crc32, crc_ok = result
+                    decode_time = time.time()
+                    self.decode_time.observe(decode_time - receive_time)
+                    if not crc_ok:
+                        sys.stdout.write('[nzb2http][downloader] CRC32 mismatch for segment {0} of {1}\n'.format(index + 1, scheduled_file.file_writer.path))
+                        self.scheduler.task_failed(scheduled_file, index, self.server_index, True)
+                        continue
+                    complete = scheduled_file.file_writer.write_segment(index, content_file_size, content_file_offset, content, crc32)
+                    self.write_time.observe(time.time() - decode_time)
+                finally:
+                    if slot is not None:
+                        self.decoder_pool.release(slot)
+                if complete:
+                    sys.stdout.write('[nzb2http][downloader] Downloaded {0}\n'.format(scheduled_file.file_writer.path))
+                self.scheduler.task_done(scheduled_file, index)
+            except nntplib.NNTPError as exception:
+                self.scheduler.task_failed(scheduled_file, index, self.server_index, nntp.get_error_code(exception) == '430')
+            except (socket.error, EOFError) as exception:
+                self.scheduler.task_failed(scheduled_file, index, self.server_index, False)
+                self._drop_connection(connection, pipeline, exception)
+                connection = None
+            except Exception as exception:
+                sys.stdout.write('[nzb2http][downloader] Failed to download segment {0} of {1}: {2}\n'.format(index + 1, scheduled_file.file_writer.path, exception))
+                self.scheduler.task_failed(scheduled_file, index, self.server_index, False)
+
+        while pipeline:
+            scheduled_file, index, send_time = pipeline.popleft()
+            self._cancel(scheduled_file, index)
+        if connection:
+            try:
+                connection.quit()
+            except (nntplib.NNTPError, socket.error, EOFError):
+                pass
+
+    ############################################################################
+    def _drop_connection(self, connection, pipeline, exception):
+        sys.stdout.write('[nzb2http][downloader] Connection to {0} lost: {1}\n'.format(self.nntp_credentials['host'], exception))
+        while pipeline:
+            scheduled_file, index, send_time = pipeline.popleft()
+            self._cancel(scheduled_file, index)
+        try:
+            connection.sock.close()
+        except socket.error:
+            pass
+
+    ############################################################################
+    def _cancel(self, scheduled_file, index):
+        if isinstance(scheduled_file, availability.AvailabilityScan):
+            scheduled_file.batch_cancelled(self.server_index, index)
+        else:
+            self.scheduler.task_cancelled(scheduled_file, index, self.server_index)
+
+################################################################################
+class Downloader(threading.Thread):
+    ############################################################################
+    def __init__(self, connection_pool, cache, download_options, download_dir, nzb_name, nzb_content):
+        threading.Thread.__init__(self)
+        self.connection_pool  = connection_pool
+        self.cache            = cache
+        self.download_options = download_options
         self.download_dir     = download_dir
         self.nzb_name         = nzb_name
         self.nzb_dir          = os.path.join(self.download_dir, nzb_name[:-4])
 
         sys.stdout.write('[nzb2http][downloader] Downloading {0}\n'.format(nzb_name))
-        self.nzb_files = pynzb.nzb_parser.parse(nzb_content)
-        for nzb_file in self.nzb_files:
-            nzb_file.name  = RE_NZB_FILE_NAME.search(nzb_file.subject).group(1)
-            nzb_file.path  = os.path.join(self.nzb_dir, nzb_file.name)
-
-        self.incomplete_files = list(self.nzb_files)
-
-        # sfv_files = self._get_files(self.nzb_files, '.sfv')
-        # if sfv_files and os.path.isfile(sfv_files[0].path):
-        #     sys.stdout.write('[nzb2http][downloader] - Verifying completeness using sfv file: {0}\n'.format(sfv_files[0].name))
-        #     complete_files, incomplete_files = self._parse_sfv_file(sfv_files[0].path, self.nzb_files)
-        #     for complete_file in complete_files:
-        #        sys.stdout.write('[nzb2http][downloader] - Complete: {0} ({1})\n'.format(complete_file.name, complete_file.crc32))
-        #     self.incomplete_files = incomplete_files
-        # else:
-        #     sys.stdout.write('[nzb2http][downloader] - Verifying completeness using file presence\n')
-        #     for nzb_file in self.nzb_files:
-        #         if os.path.isfile(nzb_file.path):
-        #             sys.stdout.write('[nzb2http][downloader] - Complete: {0}\n'.format(nzb_file.name))
-        #             self.incomplete_files.remove(nzb_file)
 
-        self.incomplete_files = self._sort_files(self.incomplete_files)
+        # The rest of the NZB is parsed by the job, once the first file has
+        # shown it to be one
+        self.nzb_content       = nzb_content
+        self.nzb_file_iterator = nzbparser.iter_files(nzb_content)
+        first_nzb_file         = next(self.nzb_file_iterator, None)
+        if not first_nzb_file:
+            raise ValueError('No files in {0}'.format(nzb_name))
 
-        sys.stdout.write('[nzb2http][downloader] {0} files will be downloaded in order:\n'.format(len(self.incomplete_files)))
-        for incomplete_file in self.incomplete_files:
-           sys.stdout.write('[nzb2http][downloader] - {0}\n'.format(incomplete_file.name))
+        # Segments written by a previous run are not downloaded again
+        self.journal          = journal.Journal(os.path.join(self.nzb_dir, JOURNAL_FILE_NAME))
+        self.nzb_files        = []
+        self.file_writers     = {}
+        self.rar_files        = []
+        self.volume_entries   = {}
+        self.playhead         = None
+        self.incomplete_files = []
+        self.early_files      = []
+        self.index_checked    = False
+        self.checked_files    = set()
+        self.repairer         = None
+        self.stop_requested   = False
+
+        # With stat_scan, the availability of every segment is checked before
+        # it is downloaded
+        self.availability_scan     = None
+        self.availability_reported = False
+
+        # Entries of the archive as far as the headers of the volumes are read,
+        # and those readers asked for, whose volumes only are downloaded
+        self.files            = []
+        self.selected_files   = set()
+        self.entry_starts     = {}
+        self.partial_entries  = {}
+        self.header_segments  = {}
+        self.layout_known     = False
 
-        self.pool = ThreadPool(self.nntp_credentials['max_connections'], _init_worker, (self.nntp_credentials,))
+        # With a disk budget, files are handed to the scheduler as consumed
+        # volumes are deleted. Readers admit the volumes they need from their
+        # own threads, under admit_lock.
+        self.disk_budget      = self.download_options['disk_budget']
+        self.admitted_files   = set()
+        self.held_files       = []
+        self.admit_lock       = threading.Lock()
+        self.read_samples     = collections.deque()
+
+        self.scheduler = scheduler.Scheduler(self.download_options['max_active_files'], len(self.connection_pool.nntp_servers), self.connection_pool.condition)
+        self.extractor = extractor.Extractor(self.file_writers, self.disk_budget // 2 if self.disk_budget else None, self.cache)
+        self._add_nzb_file(first_nzb_file)
 
     ############################################################################
     def run(self):
         sys.stdout.write('[nzb2http][downloader] Started\n')
-        self.stop_requested = False
 
-        self.extractor = extractor.Extractor(self.get_first_rar_path())
         self.extractor.start()
+        self.connection_pool.add_job(self)
 
-        for incomplete_file in self.incomplete_files:
-            map_result_async = self.pool.map_async(_run_worker, incomplete_file.segments)
-            while not self.stop_requested:
-                try:
-                    map_result = map_result_async.get(1)
-                    self._write_nzb_file(incomplete_file, map_result)
-                    sys.stdout.write('[nzb2http][downloader] Downloaded {0}\n'.format(incomplete_file.path))
+        try:
+            for nzb_file in self.nzb_file_iterator:
+                if self.stop_requested:
                     break
-                except multiprocessing.TimeoutError:
-                    pass
+                self._add_nzb_file(nzb_file)
+        except SyntaxError as exception:
+            sys.stdout.write('[nzb2http][downloader] Stopped parsing {0}: {1}\n'.format(self.nzb_name, exception))
+        finally:
+            if hasattr(self.nzb_content, 'close'):
+                self.nzb_content.close()
+            self.nzb_file_iterator = None
+            self.nzb_content       = None
+
+        if not self.stop_requested:
+            self._schedule_files()
+            if self.repairer:
+                self.repairer.start()
+            if self.download_options['stat_scan']:
+                self._scan_availability()
+
+        # Volumes are handed to the scheduler as readers ask for the entries
+        # they hold, and with a disk budget, consumed data is freed as long as
+        # the job runs
+        while not self.stop_requested:
+            finished = self.scheduler.wait_finished(1 if self.index_checked and self.layout_known else INDEX_CHECK_INTERVAL)
+            self._scan_volumes()
+            self._request_extractions()
+            self.index_checked = self._prefetch_video_index()
+            if self.disk_budget:
+                self._free_disk_space()
+            else:
+                self._admit_files()
+            if self.availability_scan and not self.availability_reported and self.availability_scan.is_finished():
+                self._report_availability()
 
-        self.pool.terminate()
-        self.pool.join()
+            if finished and not self.disk_budget and self.layout_known and not self.held_files:
+                break
+            if finished:
+                time.sleep(1 if self.layout_known else INDEX_CHECK_INTERVAL)
+
+        self.scheduler.stop()
+        self.connection_pool.remove_job(self)
 
         sys.stdout.write('[nzb2http][downloader] Stopped\n')
 
@@ -127,20 +365,503 @@ class Downloader(threading.Thread):
     def stop(self):
         sys.stdout.write('[nzb2http][downloader] Stopping\n')
 
-        self.extractor.stop()
         self.stop_requested = True
         self.join()
+        self.extractor.stop()
+        if self.repairer:
+            self.repairer.stop()
+        for file_writer in self.file_writers.values():
+            file_writer.sync()
+        self.journal.close()
+
+    ############################################################################
+    def select_file(self, path):
+        # Entries readers ask for are downloaded, and extracted if compressed;
+        # the volumes holding only other entries are not
+        if path not in self.selected_files:
+            sys.stdout.write('[nzb2http][downloader] Selecting {0}\n'.format(path))
+            self.selected_files.add(path)
+            with self.scheduler.condition:
+                self.scheduler.condition.notify_all()
+
+    ############################################################################
+    def is_file_ready(self, file_info):
+        """
+        Returns:
+            - ready: whether an entry can be read, stored ones once their
+              location is known and compressed ones once their extraction has
+              started
+        """
+        if file_info.get('stored'):
+            return self.locate_stored_range(file_info['path'], 0) is not None
+        return file_info['path'] in self.extractor.watermarks and os.path.isfile(file_info['path'])
+
+    ############################################################################
+    def get_available_bytes(self, path):
+        file_writer = self.file_writers.get(path)
+        if file_writer:
+            return file_writer.available
+        return 0
+
+    ############################################################################
+    def update_playhead(self, path, offset):
+        # Remembers where in the volumes readers of an extracted file are
+        location = self._locate_extracted_offset(os.path.relpath(path, self.nzb_dir), offset)
+        if location:
+            self.playhead = location[:2]
 
     ############################################################################
-    def get_first_rar_path(self):
-        return self._get_first_rar_file(self.nzb_files).path
+    def get_buffered_bytes(self):
+        """
+        Returns:
+            - buffered_bytes: bytes downloaded contiguously from the playhead on,
+              None until something is read
+        """
+        if not self.playhead:
+            return None
+        return self._get_buffered_bytes(*self.playhead)
+
+    ############################################################################
+    def get_buffered_bytes_at(self, path, offset):
+        """
+        Returns:
+            - buffered_bytes: bytes downloaded contiguously in the volumes from
+              offset of an extracted file on, None if its location is unknown
+        """
+        location = self._locate_extracted_offset(os.path.relpath(path, self.nzb_dir), offset)
+        if not location:
+            return None
+        return self._get_buffered_bytes(location[0], location[1])
+
+    ############################################################################
+    def _get_buffered_bytes(self, volume_index, volume_offset):
+        buffered_bytes = 0
+        for rar_file in self.rar_files[volume_index:]:
+            file_writer    = self.file_writers[rar_file.path]
+            buffered_bytes = buffered_bytes + max(0, file_writer.available - volume_offset)
+            if not file_writer.complete:
+                break
+            volume_offset  = 0
+        return buffered_bytes
+
+    ############################################################################
+    def request_extracted_range(self, path, offset, length=None):
+        """
+        Moves the segments holding length bytes from offset of an extracted
+        file, or PREFETCH_SEGMENTS segments if length is not given, to the
+        front of the download queue. The volume offset is exact for stored
+        entries and estimated from the compression ratio otherwise.
+        """
+        location = self._locate_extracted_offset(os.path.relpath(path, self.nzb_dir), offset)
+        if not location:
+            return
+
+        volume_index, volume_offset, length = location
+        self._admit_file(self.rar_files[volume_index])
+        sys.stdout.write('[nzb2http][downloader] Prioritizing {0} at {1} for {2} at {3}\n'.format(self.rar_files[volume_index].name, volume_offset, path, offset))
+
+        segments  = []
+        remaining = length
+        while volume_index < len(self.rar_files) and (len(segments) < PREFETCH_SEGMENTS if length is None else remaining > 0):
+            rar_file      = self.rar_files[volume_index]
+            segment_count = len(rar_file.segments)
+            volume_size   = self.file_writers[rar_file.path].size or self.file_writers[self.rar_files[0].path].size
+            index         = self._get_segment_index(rar_file, volume_offset, volume_size)
+            if length is None:
+                end_index = min(segment_count, index + PREFETCH_SEGMENTS - len(segments))
+            else:
+                end_index = min(segment_count, (volume_offset + remaining) * segment_count // volume_size + 1)
+                remaining = remaining - (volume_size - volume_offset)
+            for index in range(index, end_index):
+                segments.append((rar_file, index))
+            volume_index  = volume_index + 1
+            volume_offset = 0
+
+        self.scheduler.prioritize(segments)
+
+    ############################################################################
+    def _get_segment_index(self, rar_file, offset, volume_size):
+        """
+        Segments hold parts of the same decoded size but for the last one of a
+        volume, which is shorter. The part size is known once the first
+        segment of the volume, or of the first volume, is written; until then
+        the index is estimated from the volume size, which can overshoot by
+        one segment.
+
+        Returns:
+            - index: index of the segment of a volume holding offset, or of the
+              one before it when estimated
+        """
+        segment_count = len(rar_file.segments)
+        for known_file in (rar_file, self.rar_files[0]):
+            first = self.file_writers[known_file.path].segment_crc32s.get(0)
+            if first and len(known_file.segments) > 1:
+                return min(segment_count - 1, offset // first[1])
+        return max(0, min(segment_count - 1, offset * segment_count // volume_size - 1))
+
+    ############################################################################
+    def locate_stored_range(self, path, offset):
+        """
+        Locates the bytes at offset of a stored entry within the downloaded
+        volumes, so they can be read without extracting them.
+
+        Returns:
+            - location: (volume file writer, volume offset, bytes of the entry
+              left in the volume from there), None until the volume layout is
+              known
+        """
+        location = self._locate_extracted_offset(os.path.relpath(path, self.nzb_dir), offset)
+        if not location or location[2] is None:
+            return None
+
+        volume_index, volume_offset, length = location
+        return (self.file_writers[self.rar_files[volume_index].path], volume_offset, length)
+
+    ############################################################################
+    def _add_nzb_file(self, nzb_file):
+        # The first volume is downloaded as soon as it is parsed, the other
+        # files once the whole NZB is known and they can be put in order
+        nzb_file.path = os.path.join(self.nzb_dir, nzb_file.name)
+        self.nzb_files.append(nzb_file)
+        self.file_writers[nzb_file.path] = filewriter.FileWriter(nzb_file.path, len(nzb_file.segments), self.journal, self.cache)
+
+        if not self.early_files and self._is_first_volume(nzb_file.name):
+            if not self.file_writers[nzb_file.path].complete:
+                sys.stdout.write('[nzb2http][downloader] - Downloading first: {0}\n'.format(nzb_file.name))
+                self.scheduler.add_file(nzb_file, self.file_writers[nzb_file.path])
+                self.admitted_files.add(nzb_file)
+            self.early_files.append(nzb_file)
+            self.rar_files = [nzb_file]
+
+    ############################################################################
+    def _prefetch_video_index(self):
+        """
+        Players read the index of a video before its first frame, seeking to
+        the end of the file for it when it follows the media data. Once the
+        start of a stored video readers asked for is downloaded, the segments
+        holding such an index are moved to the front of the queue, for it to
+        be served without waiting for the rest of the file. Compressed videos
+        can only be extracted in order and are left alone.
+
+        Returns:
+            - checked: whether the videos asked for were inspected or cannot be
+        """
+        if not self.selected_files:
+            return self.layout_known
+
+        checked = True
+        for path in list(self.selected_files):
+            if path in self.checked_files or not path.lower().endswith(VIDEO_EXTENSIONS):
+                continue
+            if self._prefetch_index(path):
+                self.checked_files.add(path)
+            else:
+                checked = False
+        return checked
+
+    ############################################################################
+    def _prefetch_index(self, path):
+        """
+        Returns:
+            - checked: whether the video was inspected or cannot be
+        """
+        start = self._get_entry_start(os.path.relpath(path, self.nzb_dir))
+        if not start:
+            return False
+
+        volume_index, video_entry = start
+        if not video_entry.is_stored:
+            return True
+
+        file_writer = self.file_writers[self.rar_files[volume_index].path]
+        head_size   = min(CONTAINER_HEAD_SIZE, video_entry.data_size)
+        if file_writer.get_written_end(video_entry.data_offset) < video_entry.data_offset + head_size:
+            return False
+
+        index = container.find_tail_index(self._read_volume(volume_index, video_entry.data_offset, head_size), video_entry.unpacked_size)
+        if index:
+            container_type, index_start, index_end = index
+            index_end = min(index_end, index_start + MAX_INDEX_PREFETCH_SIZE)
+            sys.stdout.write('[nzb2http][downloader] Prefetching {0} index of {1} at {2}-{3}\n'.format(container_type, path, index_start, index_end))
+            self.request_extracted_range(path, index_start, index_end - index_start)
+        return True
+
+    ############################################################################
+    def _scan_volumes(self):
+        """
+        Reads the headers of the volumes, downloading the segments holding
+        them ahead of the rest: the first segment of every volume, and the
+        segments holding the headers of entries starting in the middle of a
+        volume. The entries of the archive and the volumes they span are thus
+        known before the volumes are downloaded. Entries are listed in
+        self.files in archive order, as far as the headers of every volume
+        before them are read so that their index never changes.
+        """
+        if self.layout_known:
+            return
+
+        files        = []
+        listed       = True
+        layout_known = self.nzb_file_iterator is None
+        for volume_index, rar_file in enumerate(self.rar_files):
+            entries = self._get_volume_entries(volume_index)
+            if volume_index not in self.volume_entries:
+                layout_known = False
+                self._request_header_segments(volume_index)
+
+            if listed:
+                for entry in entries or []:
+                    if not entry.split_before:
+                        file_info = {'path': os.path.join(self.nzb_dir, entry.name), 'size': entry.unpacked_size}
+                        if entry.is_stored:
+                            file_info['stored'] = True
+                        files.append(file_info)
+                listed = volume_index in self.volume_entries
+
+        self.files        = files
+        self.layout_known = layout_known
+
+        # The main video of a release is downloaded before readers ask for it,
+        # as it always was, which entry of a pack is wanted is up to them
+        if not self.selected_files and self.nzb_file_iterator is None:
+            archive_size = sum(rar_file.segments.get_total_bytes() for rar_file in self.rar_files)
+            video_files  = [file_info for file_info in files if file_info['path'].lower().endswith(VIDEO_EXTENSIONS)]
+            for file_info in video_files:
+                if file_info['size'] * 2 > archive_size or (layout_known and len(video_files) == 1):
+                    self.select_file(file_info['path'])
+                    break
+
+    ############################################################################
+    def _request_extractions(self):
+        # Compressed entries readers asked for are extracted from the volume
+        # they start in
+        for file_info in self.files:
+            if not file_info.get('stored') and file_info['path'] in self.selected_files:
+                start = self._get_entry_start(os.path.relpath(file_info['path'], self.nzb_dir))
+                self.extractor.request(file_info['path'], self.rar_files[start[0]].path)
+
+    ############################################################################
+    def _request_header_segments(self, volume_index):
+        # Schedules the segments holding the next header of a volume to read,
+        # unless the whole volume is
+        rar_file    = self.rar_files[volume_index]
+        file_writer = self.file_writers[rar_file.path]
+        if rar_file in self.admitted_files or file_writer.complete or file_writer.deleted:
+            return
+
+        offset    = self.partial_entries[volume_index][2] if volume_index in self.partial_entries else 0
+        first     = file_writer.segment_crc32s.get(0)
+        part_size = first[1] if first else None
+        index     = offset // part_size if part_size else 0
+        indexes   = [index]
+        if part_size and offset % part_size + rarheader.HEADER_READ_SIZE > part_size:
+            indexes.append(index + 1)
+
+        requested = self.header_segments.setdefault(volume_index, set())
+        indexes   = [index for index in indexes if index < len(rar_file.segments) and index not in requested and not file_writer.segments_done[index]]
+        if indexes:
+            requested.update(indexes)
+            self.scheduler.add_file(rar_file, file_writer, indexes)
+
+    ############################################################################
+    def _scan_availability(self):
+        # Segments are checked in download order, those already downloaded
+        # excepted
+        segments = []
+        for nzb_file in self.early_files + self.incomplete_files + self.par2_volume_files:
+            file_writer = self.file_writers[nzb_file.path]
+            for index in range(len(nzb_file.segments)):
+                if not file_writer.segments_done[index]:
+                    segments.append((nzb_file, index))
+
+        sys.stdout.write('[nzb2http][downloader] Checking the availability of {0} segments\n'.format(len(segments)))
+        self.availability_scan = availability.AvailabilityScan(segments, len(self.connection_pool.nntp_servers), self.scheduler.condition)
+        self.scheduler.scan_availability(self.availability_scan)
+
+    ############################################################################
+    def _report_availability(self):
+        # Segments no server has are given up when their turn comes, and
+        # enough PAR2 volumes to recover them are downloaded right away
+        scan    = self.availability_scan
+        missing = scan.get_missing()
+        sys.stdout.write('[nzb2http][downloader] Checked the availability of {0} segments in {1:.1f}s:\n'.format(scan.segment_count, scan.end_time - scan.start_time))
+        for server_index, nntp_credentials in enumerate(self.connection_pool.nntp_servers):
+            sys.stdout.write('[nzb2http][downloader] - {0}: {1} checked, {2} missing\n'.format(nntp_credentials['host'], scan.checked[server_index], len(scan.missing[server_index])))
+        if scan.segment_count:
+            sys.stdout.write('[nzb2http][downloader] Expected completeness: {0:.2f}%, {1} segments missing from every server\n'.format(100.0 * (scan.segment_count - len(missing)) / scan.segment_count, len(missing)))
+
+        if missing and self.repairer:
+            self.repairer.expect_missing(missing)
+        self.availability_reported = True
+
+    ############################################################################
+    def _is_first_volume(self, name):
+        if 'subs' in name:
+            return False
+        if RE_PART_XX.search(name):
+            return bool(RE_PART_01.search(name))
+        return bool(RE_RAR.search(name) or RE_001.search(name))
+
+    ############################################################################
+    def _schedule_files(self):
+        self.rar_files = self._get_rar_files(self.nzb_files)
+        if self.early_files and self.early_files[0] in self.rar_files:
+            self.rar_files.remove(self.early_files[0])
+            self.rar_files.insert(0, self.early_files[0])
+
+        for nzb_file in self.nzb_files:
+            if self.file_writers[nzb_file.path].complete:
+                sys.stdout.write('[nzb2http][downloader] - Complete: {0}\n'.format(nzb_file.name))
+            elif nzb_file not in self.early_files:
+                self.incomplete_files.append(nzb_file)
+
+        sfv_files = self._get_files(self.nzb_files, '.sfv')
+        if sfv_files and self.file_writers[sfv_files[0].path].complete:
+            sys.stdout.write('[nzb2http][downloader] - Verifying completeness using sfv file: {0}\n'.format(sfv_files[0].name))
+            self._verify_files(self._parse_sfv_file(sfv_files[0].path))
+
+        # PAR2 volumes are only downloaded when a repair needs them
+        self.par2_index_file   = self._get_par2_index_file(self.nzb_files)
+        self.par2_volume_files = [nzb_file for nzb_file in self.nzb_files if par2index.get_volume_blocks(nzb_file.name)]
+        self.incomplete_files  = [nzb_file for nzb_file in self.incomplete_files if nzb_file not in self.par2_volume_files]
+
+        self.incomplete_files = self._sort_files(self.incomplete_files)
+
+        sys.stdout.write('[nzb2http][downloader] {0} files will be downloaded in order:\n'.format(len(self.incomplete_files)))
+        for incomplete_file in self.incomplete_files:
+           sys.stdout.write('[nzb2http][downloader] - {0}\n'.format(incomplete_file.name))
+
+        with self.admit_lock:
+            self.held_files = list(self.incomplete_files)
+        self._admit_files()
+
+        if self.par2_index_file and repairer.is_available():
+            self.repairer = repairer.Repairer(self.nzb_dir, self.scheduler, self.file_writers, self.par2_index_file, self.par2_volume_files)
+            for nzb_file in self.nzb_files:
+                if not nzb_file.name.lower().endswith('.par2'):
+                    self.file_writers[nzb_file.path].repairer = self.repairer
+        elif self.par2_index_file:
+            sys.stdout.write('[nzb2http][downloader] {0} not found, damaged files will not be repaired\n'.format(repairer.PAR2_EXECUTABLE))
+
+    ############################################################################
+    def _free_disk_space(self):
+        """
+        Keeps the job within its disk budget. Volumes are deleted once unrar
+        is done with them and readers of the stored entries they hold are past
+        them, extracted data is freed behind readers, and files are handed to
+        the scheduler as long as they fit. Data behind the slowest reader of a
+        file over the last DISK_RELEASE_DELAY seconds is freed, as long as it
+        is DISK_RELEASE_MARGIN bytes behind it; reads of it fail afterwards.
+        """
+        current_time = time.time()
+        self.read_samples.append((current_time, filewrapper.get_read_positions(self)))
+        while self.read_samples[0][0] < current_time - DISK_RELEASE_DELAY:
+            self.read_samples.popleft()
+
+        read_positions = {}
+        for sample_time, positions in self.read_samples:
+            for path, offset in positions:
+                read_positions[path] = min(read_positions.get(path, offset), offset)
+
+        for volume_index in range(self._get_extracted_volume_count() if self.index_checked else 0):
+            file_writer = self.file_writers[self.rar_files[volume_index].path]
+            if file_writer.deleted or not file_writer.complete or volume_index not in self.volume_entries:
+                continue
+
+            # Entries are located through the headers of the volumes, which are
+            # kept once parsed
+            if all(self._is_entry_read(volume_index, entry, read_positions) for entry in self._get_volume_entries(volume_index) if entry.is_stored):
+                sys.stdout.write('[nzb2http][downloader] Deleting consumed {0}\n'.format(file_writer.path))
+                file_writer.delete()
+
+        for file_info in list(self.files):
+            if not file_info.get('stored') and file_info['path'] in read_positions:
+                self.extractor.release(file_info['path'], read_positions[file_info['path']] - DISK_RELEASE_MARGIN)
+
+        self._admit_files()
+
+    ############################################################################
+    def _is_entry_read(self, volume_index, entry, read_positions):
+        # Whether readers of a stored entry are past its part in a volume
+        offset = read_positions.get(os.path.join(self.nzb_dir, entry.name))
+        if offset is None:
+            return False
+        location = self._locate_extracted_offset(entry.name, max(0, offset - DISK_RELEASE_MARGIN))
+        return location is not None and location[0] > volume_index
+
+    ############################################################################
+    def _admit_files(self):
+        # Files are handed to the scheduler in download order, RAR volumes
+        # once they hold part of an entry readers asked for, and with a disk
+        # budget while they fit in it. Should volumes prioritized for readers
+        # fill it up while unrar waits in the middle of a compressed entry,
+        # the volume it needs is downloaded anyway, for it to go on freeing the
+        # others. A pending repair needs the whole PAR2 set, which is
+        # downloaded whatever readers asked for and the disk budget, lest its
+        # readers wait forever.
+        usage = self.extractor.get_disk_usage()
+        for nzb_file in self.nzb_files:
+            file_writer = self.file_writers[nzb_file.path]
+            if not file_writer.deleted and (file_writer.complete or nzb_file in self.admitted_files):
+                usage = usage + (file_writer.size or nzb_file.segments.get_total_bytes())
+
+        repair_names = self.repairer.pending_names if self.repairer else ()
+        for nzb_file in list(self.held_files):
+            if nzb_file.name in repair_names:
+                usage = usage + nzb_file.segments.get_total_bytes()
+                self._admit_file(nzb_file)
+
+        for nzb_file in list(self.held_files):
+            if not self._is_file_wanted(nzb_file):
+                continue
+            if self.disk_budget and usage + nzb_file.segments.get_total_bytes() > self.disk_budget:
+                break
+            usage = usage + nzb_file.segments.get_total_bytes()
+            self._admit_file(nzb_file)
+
+        extracted_count = self._get_extracted_volume_count()
+        if extracted_count < len(self.rar_files) and self.rar_files[extracted_count] in self.held_files and self.extractor.output_file and not self.scheduler.get_queue_depth() and not self.scheduler.get_in_flight():
+            self._admit_file(self.rar_files[extracted_count])
+
+    ############################################################################
+    def _admit_file(self, nzb_file):
+        # Called by the job and by readers, a file is admitted once, if held
+        with self.admit_lock:
+            if nzb_file not in self.held_files:
+                return
+            self.held_files.remove(nzb_file)
+            self.admitted_files.add(nzb_file)
+            self.scheduler.add_file(nzb_file, self.file_writers[nzb_file.path])
+
+    ############################################################################
+    def _is_file_wanted(self, nzb_file):
+        # Files other than RAR volumes are always downloaded, and so are
+        # volumes whose headers cannot be read
+        if nzb_file not in self.rar_files:
+            return True
+        volume_index = self.rar_files.index(nzb_file)
+        if volume_index in self.volume_entries and self.volume_entries[volume_index] is None:
+            return True
+        for entry in self._get_volume_entries(volume_index) or []:
+            if os.path.join(self.nzb_dir, entry.name) in self.selected_files:
+                return True
+        return False
+
+    ############################################################################
+    def _get_extracted_volume_count(self):
+        # Number of volumes before the first one unrar still needs
+        volume_names = [os.path.basename(volume_path) for volume_path in self.extractor.get_volume_paths()]
+        for volume_index, rar_file in enumerate(self.rar_files):
+            if rar_file.name in volume_names:
+                return volume_index
+        return len(self.rar_files)
 
     ############################################################################
     def _sort_files(self, nzb_files):
         sorted_files = []
         sorted_files = sorted_files + self._get_files(nzb_files, '.sfv')
-        sorted_files = sorted_files + self._get_rar_files(nzb_files)
         sorted_files = sorted_files + self._get_files(nzb_files, '.par2')
+        sorted_files = sorted_files + self._get_rar_files(nzb_files)
         sorted_files = sorted_files + self._get_remaining_files(nzb_files, sorted_files)
         return sorted_files
 
@@ -153,6 +874,13 @@ class Downloader(threading.Thread):
         files.sort(key=lambda file: file.name)
         return files
 
+    ############################################################################
+    def _get_par2_index_file(self, nzb_files):
+        # The smallest PAR2 file which is not a volume holds the index only
+        index_files = [nzb_file for nzb_file in self._get_files(nzb_files, '.par2') if not par2index.get_volume_blocks(nzb_file.name)]
+        if index_files:
+            return min(index_files, key=lambda index_file: index_file.segments.get_total_bytes())
+
     ############################################################################
     def _get_first_rar_file(self, nzb_files):
         for nzb_file in nzb_files:
@@ -176,62 +904,158 @@ class Downloader(threading.Thread):
         return rar_files
 
     ############################################################################
-    def _get_remaining_files(self, nzb_files, current_files):
-        files = []
-        for nzb_file in nzb_files:
-            if nzb_file not in current_files:
-                files.append(nzb_file)
-        return files
+    def _get_volume_entries(self, volume_index):
+        # Returns the headers of the entries held by a volume, as far as the
+        # parts of the volume holding them are downloaded, None until its
+        # beginning is
+        if volume_index in self.volume_entries:
+            return self.volume_entries[volume_index]
 
-    # ############################################################################
-    # def _get_file_crc32(self, nzb_file):
-    #     if os.path.isfile(nzb_file.path):
-    #         return '%X' % (zlib.crc32(open(nzb_file.path, 'rb').read()) & 0xFFFFFFFF)
+        file_writer = self.file_writers[self.rar_files[volume_index].path]
+        if not file_writer.complete and file_writer.segments_left == file_writer.segment_count:
+            return None
 
-    # ############################################################################
-    # def _parse_sfv_file(self, sfv_file_name, nzb_files):
-    #     RE_SFV_LINE = re.compile('(\S+)\s+(\w+)')
+        # Headers are read again once more segments are written
+        partial = self.partial_entries.get(volume_index)
+        if partial and partial[0] == file_writer.segments_left and not file_writer.complete:
+            return partial[1]
 
-    #     complete_files   = []
-    #     incomplete_files = []
+        entries, offset = rarheader.read_volume(lambda offset, size: self._read_volume(volume_index, offset, size))
+        if offset is None or file_writer.complete:
+            self.volume_entries[volume_index] = entries
+            self.partial_entries.pop(volume_index, None)
+        else:
+            self.partial_entries[volume_index] = (file_writer.segments_left, entries, offset)
+        return entries
 
-    #     sfv_data = {}
-    #     with open(sfv_file_name, 'r') as sfv_file:
-    #         for sfv_line in sfv_file:
-    #             sfv_data[RE_SFV_LINE.search(sfv_line).group(1).lower()] = RE_SFV_LINE.search(sfv_line).group(2).lower()
+    ############################################################################
+    def _get_volume_entry(self, volume_index, name, split_before):
+        # Returns the header of the part of entry name held by a volume, the
+        # first part or one continuing the entry, once the volume has been
+        # read that far
+        for entry in self._get_volume_entries(volume_index) or []:
+            if entry.name == name and entry.split_before == split_before:
+                return entry
+
+    ############################################################################
+    def _get_entry_start(self, name):
+        """
+        Returns:
+            - start: (volume index, header of the first part) of entry name,
+              None until the headers of the volume it starts in are read
+        """
+        if name in self.entry_starts:
+            return self.entry_starts[name]
 
-    #     for nzb_file in nzb_files:
-    #         if not hasattr(nzb_file, 'crc32'):
-    #             nzb_file.crc32 = self._get_file_crc32(nzb_file)
-    #             if nzb_file.crc32 == None:
-    #                 incomplete_files.append(nzb_file)
-    #                 continue
+        for volume_index in range(len(self.rar_files)):
+            entry = self._get_volume_entry(volume_index, name, False)
+            if entry:
+                self.entry_starts[name] = (volume_index, entry)
+                return self.entry_starts[name]
+        return None
 
-    #         if nzb_file.name.lower() in sfv_data:
-    #             if nzb_file.crc32.lower() == sfv_data[nzb_file.name.lower()].lower():
-    #                 complete_files.append(nzb_file)
-    #             else:
-    #                 incomplete_files.append(nzb_file)
+    ############################################################################
+    def _guess_part(self):
+        # Part of an entry in a volume whose headers are not read yet, assumed
+        # to fill the volume like the parts already known to
+        for entries in self.volume_entries.values():
+            for entry in entries or []:
+                if entry.split_before and entry.split_after:
+                    return entry
+        return None
+
+    ############################################################################
+    def _read_volume(self, volume_index, offset, size):
+        # Reads at most size bytes, as many as are written from offset on
+        file_writer = self.file_writers[self.rar_files[volume_index].path]
+        if not file_writer.complete:
+            size = min(size, file_writer.get_written_end(offset) - offset)
+            if size <= 0:
+                return ''
+        path = file_writer.path if file_writer.complete else file_writer.incomplete_path
 
-    #     return (complete_files, incomplete_files)
+        # The volume may be completed and renamed in the meantime
+        try:
+            volume_file = open(path, 'rb')
+        except IOError:
+            volume_file = open(file_writer.path, 'rb')
+        with volume_file:
+            volume_file.seek(offset)
+            return volume_file.read(size)
 
     ############################################################################
-    def _write_nzb_file(self, nzb_file, nzb_segments):
-        if not os.path.isdir(self.nzb_dir):
-            os.makedirs(self.nzb_dir)
+    def _locate_extracted_offset(self, name, offset):
+        """
+        Locates an offset of an entry within the volumes. Parts of the entry in
+        volumes whose headers are not read yet are assumed to fill them like
+        the other parts spanning whole volumes, as is the case for volumes
+        created by rar. Compressed entries are assumed not to shrink, which
+        video hardly does.
 
-        total_size = 0
-        for nzb_segment in nzb_segments:
-            total_size += len(nzb_segment)
+        Returns:
+            - location: (volume index, volume offset, bytes of the entry left in
+              the volume from there), the latter being None for compressed
+              entries whose location is only estimated
+        """
+        if not self.rar_files:
+            return None
 
-        nzb_file_path_incomplete = nzb_file.path + '.incomplete'
-        with open(nzb_file_path_incomplete, 'w+', 0) as nzb_file_fd:
-            for nzb_segment in nzb_segments:
-                nzb_file_fd.write(nzb_segment)
-                nzb_file_fd.flush()
-                os.fsync(nzb_file_fd.fileno())
+        start = self._get_entry_start(name)
+        if not start:
+            return None
 
-        while os.path.getsize(nzb_file_path_incomplete) != total_size:
-            time.sleep(0.1)
+        volume_index, entry = start
+        part     = entry
+        position = offset
+        while position >= part.data_size and part.split_after:
+            position     = position - part.data_size
+            volume_index = volume_index + 1
+            if volume_index >= len(self.rar_files):
+                return None
+            part = self._get_volume_entry(volume_index, name, True) or self._guess_part() or entry
+
+        if not entry.is_stored:
+            return (volume_index, part.data_offset + min(position, part.data_size), None)
+        return (volume_index, part.data_offset + position, part.data_size - position)
+
+    ############################################################################
+    def _get_remaining_files(self, nzb_files, current_files):
+        files = []
+        for nzb_file in nzb_files:
+            if nzb_file not in current_files:
+                files.append(nzb_file)
+        return files
+
+    ############################################################################
+    def _parse_sfv_file(self, sfv_path):
+        RE_SFV_LINE = re.compile('^(.+?)\s+([0-9a-fA-F]{8})\s*$')
+
+        sfv_crc32s = {}
+        with open(sfv_path, 'r') as sfv_file:
+            for sfv_line in sfv_file:
+                match_result = RE_SFV_LINE.search(sfv_line)
+                if match_result and not sfv_line.startswith(';'):
+                    sfv_crc32s[match_result.group(1).lower()] = int(match_result.group(2), 16)
+        return sfv_crc32s
+
+    ############################################################################
+    def _verify_files(self, sfv_crc32s):
+        # Completed files are checked against the CRC32 the journal computed
+        # while writing them, without reading them again
+        for nzb_file in self.nzb_files:
+            file_writer = self.file_writers[nzb_file.path]
+            completed   = self.journal.get_completed(file_writer.name)
+            sfv_crc32   = sfv_crc32s.get(nzb_file.name.lower())
+            if not file_writer.complete or not completed or completed[1] is None or sfv_crc32 is None:
+                continue
 
-        os.rename(nzb_file_path_incomplete, nzb_file.path)
+            if completed[1] == sfv_crc32:
+                sys.stdout.write('[nzb2http][downloader] - Verified: {0} ({1:08X})\n'.format(nzb_file.name, sfv_crc32))
+            else:
+                sys.stdout.write('[nzb2http][downloader] - Corrupt: {0} ({1:08X} instead of {2:08X})\n'.format(nzb_file.name, completed[1], sfv_crc32))
+                self.journal.forget(file_writer.name)
+                os.remove(nzb_file.path)
+                if self.cache:
+                    self.cache.discard(nzb_file.path)
+                self.file_writers[nzb_file.path] = filewriter.FileWriter(nzb_file.path, len(nzb_file.segments), self.journal, self.cache)
+                self.incomplete_files.append(nzb_file)
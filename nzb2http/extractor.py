@@ -1,59 +1,91 @@
 ################################################################################
+import collections
 import ctypes
+import fallocate
+import io
 import os
+import stats
 import threading
 import sys
 import time
 import unrar
+import watermark
 
 from unrar import unrarlib
 
+################################################################################
+RHDF_SPLITBEFORE   = 0x01
+
+# Extracted data is gathered in a buffer of this size before being written out
+# and made available to readers
+WRITE_BUFFER_SIZE  = 4 * 1024 * 1024
+
+# Chunks handed over by unrar from this size on are written straight from its
+# buffer instead
+DIRECT_WRITE_SIZE  = 256 * 1024
+
+# Extracted data is freed by blocks of this size once readers are past it
+RELEASE_BLOCK_SIZE = 1024 * 1024
+
+# Seconds between two checks for a volume not downloaded by a job, or for the
+# extraction to be stopped while waiting for one
+VOLUME_CHECK_INTERVAL = 1
+
 ################################################################################
 class Extractor(threading.Thread):
+    """
+    Extracts the compressed entries readers ask for, one after the other, each
+    from the volume it starts in so that unrar never goes through the volumes
+    of the entries before it. Stored entries are read straight from the
+    volumes and never extracted.
+    """
     ############################################################################
-    def __init__(self, rar_path):
+    def __init__(self, file_writers=None, max_ahead=None, cache=None):
         threading.Thread.__init__(self)
-        self.rar_path = rar_path
-        self.files    = []
-
-    ############################################################################
-    def run(self):
+        self.file_writers   = file_writers if file_writers is not None else {}
+        self.cache          = cache
+        self.files          = []
+        self.watermarks     = {}
         self.stop_requested = False
 
-        while not self.stop_requested and not os.path.isfile(self.rar_path):
-            time.sleep(1)
+        # (path, first volume path) of the entries to extract, the first one
+        # being extracted, and paths of the entries ever requested
+        self.requests       = collections.deque()
+        self.requested      = set()
+        self.condition      = threading.Condition()
 
-        if not self.stop_requested:
-            sys.stdout.write('[nzb2http][extractor] Extracting from {0}\n'.format(self.rar_path))
+        # Volume unrar is reading
+        self.volume_path = None
+        self.output_file = None
 
-            archive_data   = unrarlib.RAROpenArchiveDataEx(self.rar_path, mode=unrarlib.constants.RAR_OM_EXTRACT)
-            archive_handle = unrarlib.RAROpenArchiveEx(ctypes.byref(archive_data))  
-            
-            callback = unrarlib.UNRARCALLBACK(self._callback)
+        # With max_ahead, extraction waits while that many bytes of the file
+        # being extracted are on disk ahead of the offset released up to
+        self.max_ahead       = max_ahead
+        self.released        = {}
+        self.space_condition = threading.Condition()
+        self.hole_warned     = False
 
-            header_result, header_data = self._read_header(archive_handle)
-            while not self.stop_requested and header_result == unrarlib.constants.SUCCESS:
-                try:
-                    file_info = {}
-                    file_info['path'] = os.path.join(os.path.dirname(self.rar_path), header_data.FileName)
-                    file_info['size'] = header_data.UnpSize
-                    self.files.append(file_info)
-
-                    if not os.path.isdir(os.path.dirname(file_info['path'])):
-                        os.makedirs(os.path.dirname(file_info['path']))
-
-                    with open(file_info['path'], 'wb') as output_file:
-                        self.output_file = output_file
-                        unrarlib.RARSetCallback(archive_handle, callback, ctypes.addressof(ctypes.py_object(output_file)))
-                        unrarlib.RARProcessFileW(archive_handle, unrarlib.constants.RAR_TEST, None, None)
-                        self.output_file = None
+        self.write_buffer      = bytearray(WRITE_BUFFER_SIZE)
+        self.write_buffer_view = memoryview(self.write_buffer)
+        self.write_buffer_used = 0
+        self.write_address     = ctypes.addressof(ctypes.c_char.from_buffer(self.write_buffer))
 
-                    header_result, header_data = self._read_header(archive_handle)
+        self.extracted_bytes   = stats.counter('nzb2http_extracted_bytes_total', 'Bytes extracted by unrar')
+        self.volume_wait_time  = stats.histogram('nzb2http_extractor_volume_wait_seconds', 'Time unrar waited for a volume to be downloaded')
 
-                except unrarlib.UnrarException as exception:
-                    sys.stdout.write('[nzb2http][extractor] UnrarException: {0}\n'.format(exception))
+    ############################################################################
+    def run(self):
+        while not self.stop_requested:
+            with self.condition:
+                while not self.stop_requested and not self.requests:
+                    self.condition.wait(1)
+                if self.stop_requested:
+                    break
+                path, volume_path = self.requests[0]
 
-            unrarlib.RARCloseArchive(archive_handle)
+            self.extract_file(path, volume_path)
+            with self.condition:
+                self.requests.popleft()
 
         sys.stdout.write('[nzb2http][extractor] Stopped\n')
 
@@ -61,13 +93,141 @@ class Extractor(threading.Thread):
     def stop(self):
         sys.stdout.write('[nzb2http][extractor] Stopping\n')
         self.stop_requested = True
+        with self.condition:
+            self.condition.notify_all()
+        with self.space_condition:
+            self.space_condition.notify_all()
         self.join()
 
+        # Wake up readers still waiting for data
+        for path in self.watermarks:
+            self.watermarks[path].finish()
+
         for file in self.files:
             if os.path.isfile(file['path']):
                 sys.stdout.write('[nzb2http][extractor] Deleting {0}\n'.format(file['path']))
                 os.remove(file['path'])
 
+    ############################################################################
+    def request(self, path, volume_path):
+        # Queues the extraction of the entry extracted to path, which starts
+        # in volume_path, unless it was already requested
+        with self.condition:
+            if path not in self.requested:
+                self.requested.add(path)
+                self.requests.append((path, volume_path))
+                self.condition.notify_all()
+
+    ############################################################################
+    def get_volume_paths(self):
+        """
+        Returns:
+            - volume_paths: paths of the volume unrar is reading and of the
+              first volumes of the entries waiting to be extracted
+        """
+        with self.condition:
+            volume_paths = [volume_path for path, volume_path in self.requests]
+            if volume_paths and self.volume_path:
+                volume_paths[0] = self.volume_path
+            return volume_paths
+
+    ############################################################################
+    def extract_file(self, path, volume_path):
+        """
+        Extracts the entry extracted to path from the archive opened at
+        volume_path, once the volume is downloaded, skipping the entries
+        before it in the volume.
+        """
+        if not self._wait_for_volume(volume_path):
+            return
+
+        sys.stdout.write('[nzb2http][extractor] Extracting {0} from {1}\n'.format(path, volume_path))
+        self.volume_path = volume_path
+
+        archive_data   = unrarlib.RAROpenArchiveDataEx(volume_path, mode=unrarlib.constants.RAR_OM_EXTRACT)
+        archive_handle = unrarlib.RAROpenArchiveEx(ctypes.byref(archive_data))
+
+        callback = unrarlib.UNRARCALLBACK(self._callback)
+        unrarlib.RARSetCallback(archive_handle, callback, 0)
+
+        try:
+            header_result, header_data = self._read_header(archive_handle)
+            while not self.stop_requested and header_result == unrarlib.constants.SUCCESS:
+                entry_path = os.path.join(os.path.dirname(volume_path), header_data.FileName)
+                if entry_path != path or header_data.Flags & RHDF_SPLITBEFORE:
+                    unrarlib.RARProcessFileW(archive_handle, unrarlib.constants.RAR_SKIP, None, None)
+                    header_result, header_data = self._read_header(archive_handle)
+                    continue
+
+                file_info = {'path': path, 'size': header_data.UnpSize}
+                self.watermarks.setdefault(path, watermark.Watermark())
+                self.files.append(file_info)
+
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                if self.cache:
+                    self.cache.discard(path)
+
+                with io.FileIO(path, 'w') as output_file:
+                    self.output_file      = output_file
+                    self.output_path      = path
+                    self.output_watermark = self.watermarks[path]
+                    self.bytes_written    = 0
+                    try:
+                        unrarlib.RARProcessFileW(archive_handle, unrarlib.constants.RAR_TEST, None, None)
+                        self._flush()
+                    finally:
+                        self.output_watermark.finish()
+                        self.output_file       = None
+                        self.output_watermark  = None
+                        self.write_buffer_used = 0
+                break
+
+        except unrarlib.ArchiveEnd:
+            pass
+        except unrarlib.UnrarException as exception:
+            # Stopping while unrar waits for a volume makes it give up on it
+            if not self.stop_requested:
+                sys.stdout.write('[nzb2http][extractor] UnrarException: {0}\n'.format(exception))
+        finally:
+            unrarlib.RARCloseArchive(archive_handle)
+            self.volume_path = None
+
+    ############################################################################
+    def release(self, path, offset):
+        """
+        Frees the disk space of an extracted file up to offset, rounded down to
+        RELEASE_BLOCK_SIZE, by punching a hole in it. Readers can no longer get
+        the data, which reads as zeros.
+        """
+        offset = offset - offset % RELEASE_BLOCK_SIZE
+        with self.space_condition:
+            start = self.released.get(path, 0)
+            if offset <= start:
+                return
+
+            with io.FileIO(path, 'r+') as output_file:
+                punched = fallocate.punch_hole(output_file.fileno(), start, offset - start)
+            if not punched and not self.hole_warned:
+                sys.stdout.write('[nzb2http][extractor] Holes cannot be punched in {0}, extracted files keep their disk space\n'.format(path))
+                self.hole_warned = True
+
+            self.released[path] = offset
+            self.space_condition.notify_all()
+
+        if self.cache:
+            self.cache.discard(path, offset)
+
+    ############################################################################
+    def get_disk_usage(self):
+        # Bytes of the extracted files on disk, stored entries being left in
+        # the volumes
+        usage = 0
+        with self.space_condition:
+            for path, file_watermark in self.watermarks.items():
+                usage = usage + max(0, file_watermark.position - self.released.get(path, 0))
+        return usage
+
     ############################################################################
     def _read_header(self, archive_handle):
         header_data   = unrarlib.RARHeaderDataEx()
@@ -80,9 +240,95 @@ class Extractor(threading.Thread):
             return -1
 
         if msg == unrar.constants.UCM_PROCESSDATA:
-            self.output_file.write((ctypes.c_char * p2).from_address(p1).raw)
+            if p2 >= DIRECT_WRITE_SIZE:
+                self._flush()
+                self._write(memoryview((ctypes.c_char * p2).from_address(p1)))
+                return 1
+
+            # Small chunks are copied once, into the write buffer
+            while p2 > 0:
+                size = min(p2, WRITE_BUFFER_SIZE - self.write_buffer_used)
+                ctypes.memmove(self.write_address + self.write_buffer_used, p1, size)
+                self.write_buffer_used = self.write_buffer_used + size
+                p1 = p1 + size
+                p2 = p2 - size
+                if self.write_buffer_used == WRITE_BUFFER_SIZE:
+                    self._flush()
         elif msg == unrar.constants.UCM_CHANGEVOLUME:
-            if p2 == unrar.constants.RAR_VOL_NOTIFY:
-                sys.stdout.write('[nzb2http][extractor] Extracting from {0}\n'.format(ctypes.c_char_p(p1).value))
-        
+            # The next volume may not be downloaded yet, readers get what was
+            # extracted so far while unrar waits for it. unrar looks for it
+            # again once the callback returns, and gives up on -1.
+            self._flush()
+            if p2 == unrar.constants.RAR_VOL_ASK:
+                self.volume_path = ctypes.c_char_p(p1).value
+                if not self._wait_for_volume(self.volume_path):
+                    return -1
+            elif p2 == unrar.constants.RAR_VOL_NOTIFY:
+                self.volume_path = ctypes.c_char_p(p1).value
+                sys.stdout.write('[nzb2http][extractor] Extracting from {0}\n'.format(self.volume_path))
+
         return 1
+
+    ############################################################################
+    def _wait_for_volume(self, volume_path):
+        """
+        Waits until a volume is downloaded, on the writer of the volume when
+        the job downloads it, unrar only opening volumes under their final
+        name. A volume whose disk space was freed is never downloaded again by
+        this run.
+
+        Returns:
+            - available: whether the volume can be opened, False if it cannot
+              or the extraction is stopped
+        """
+        if os.path.isfile(volume_path):
+            return True
+
+        sys.stdout.write('[nzb2http][extractor] Waiting for {0}\n'.format(volume_path))
+        wait_start = time.time()
+        try:
+            while not self.stop_requested:
+                file_writer = self.file_writers.get(volume_path)
+                if file_writer and file_writer.deleted:
+                    sys.stdout.write('[nzb2http][extractor] {0} was deleted to free disk space\n'.format(volume_path))
+                    return False
+                if file_writer:
+                    if file_writer.wait_complete(VOLUME_CHECK_INTERVAL):
+                        return os.path.isfile(volume_path)
+                elif os.path.isfile(volume_path):
+                    return True
+                else:
+                    time.sleep(VOLUME_CHECK_INTERVAL)
+            return False
+        finally:
+            self.volume_wait_time.observe(time.time() - wait_start)
+
+    ############################################################################
+    def _flush(self):
+        if self.write_buffer_used:
+            self._write(self.write_buffer_view[:self.write_buffer_used])
+            self.write_buffer_used = 0
+
+    ############################################################################
+    def _write(self, data):
+        self._wait_for_space()
+
+        position = 0
+        while position < len(data):
+            position = position + self.output_file.write(data[position:])
+
+        # Readers get the data from memory while it is recent
+        if self.cache:
+            self.cache.put(self.output_path, self.bytes_written, data)
+
+        self.bytes_written = self.bytes_written + position
+        self.output_watermark.advance(self.bytes_written)
+        self.extracted_bytes.add(position)
+
+    ############################################################################
+    def _wait_for_space(self):
+        if self.max_ahead is None:
+            return
+        with self.space_condition:
+            while not self.stop_requested and self.bytes_written - self.released.get(self.output_path, 0) >= self.max_ahead:
+                self.space_condition.wait(1)
@@ -0,0 +1,104 @@
+################################################################################
+import ctypes
+import ctypes.util
+import errno
+import os
+
+################################################################################
+FALLOC_FL_KEEP_SIZE  = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+
+# Errors of file systems or systems that do not support an operation
+UNSUPPORTED_ERRNOS = (errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL)
+
+################################################################################
+# fallocate is Linux only, the functions below report it unsupported elsewhere
+# and fall back to seek and write without pwrite
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+except OSError:
+    _libc = None
+
+try:
+    _fallocate = getattr(_libc, 'fallocate64', None) or _libc.fallocate
+    _fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong]
+    _fallocate.restype  = ctypes.c_int
+except AttributeError:
+    _fallocate = None
+
+try:
+    _pwrite = getattr(_libc, 'pwrite64', None) or _libc.pwrite
+    _pwrite.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_longlong]
+    _pwrite.restype  = ctypes.c_ssize_t
+except AttributeError:
+    _pwrite = None
+
+# Address and length of the data of strings, buffers and bytearrays, without
+# copying them
+_as_read_buffer          = ctypes.pythonapi.PyObject_AsReadBuffer
+_as_read_buffer.argtypes = [ctypes.py_object, ctypes.POINTER(ctypes.c_void_p), ctypes.POINTER(ctypes.c_ssize_t)]
+_as_read_buffer.restype  = ctypes.c_int
+
+################################################################################
+def allocate(fd, offset, length):
+    """
+    Reserves the disk space of a range of a file, extending it if needed, for
+    it to be written without fragmenting it or running out of space midway.
+
+    Returns:
+        - allocated: False if the system or file system does not support it
+    """
+    if not _fallocate:
+        return False
+    if _fallocate(fd, 0, offset, length) != 0:
+        error = ctypes.get_errno()
+        if error in UNSUPPORTED_ERRNOS:
+            return False
+        raise OSError(error, os.strerror(error))
+    return True
+
+################################################################################
+def pwrite(fd, data, offset):
+    """
+    Writes data, a string, buffer or bytearray, at offset of a file in as few
+    system calls as possible, without using or moving the file position when
+    pwrite is available.
+    """
+    if not _pwrite:
+        os.lseek(fd, offset, os.SEEK_SET)
+        position = 0
+        while position < len(data):
+            position = position + os.write(fd, buffer(data, position))
+        return
+
+    address = ctypes.c_void_p()
+    length  = ctypes.c_ssize_t()
+    _as_read_buffer(data, ctypes.byref(address), ctypes.byref(length))
+
+    position = 0
+    while position < length.value:
+        written = _pwrite(fd, address.value + position, length.value - position, offset + position)
+        if written < 0:
+            error = ctypes.get_errno()
+            if error == errno.EINTR:
+                continue
+            raise OSError(error, os.strerror(error))
+        position = position + written
+
+################################################################################
+def punch_hole(fd, offset, length):
+    """
+    Frees the disk space of a range of a file, which then reads as zeros,
+    keeping the size of the file.
+
+    Returns:
+        - punched: False if the system or file system does not support it
+    """
+    if not _fallocate:
+        return False
+    if _fallocate(fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, offset, length) != 0:
+        error = ctypes.get_errno()
+        if error in UNSUPPORTED_ERRNOS:
+            return False
+        raise OSError(error, os.strerror(error))
+    return True
@@ -1,19 +1,56 @@
 ################################################################################
 import io
 import os
+import stats
 import sys
-import time
+import weakref
 
 ################################################################################
 VIRTUAL_READ_THRESHOLD = 100 * 1024
 
+# Files being served, to report how far ahead of their clients data is
+_file_wrappers = weakref.WeakSet()
+
+################################################################################
+def _get_buffered_bytes():
+    samples = []
+    for file_wrapper in list(_file_wrappers):
+        buffered_bytes = file_wrapper.get_buffered_bytes()
+        if buffered_bytes is not None:
+            samples.append(({'file': os.path.basename(file_wrapper.path), 'client': file_wrapper.client}, buffered_bytes))
+    return samples
+
+stats.gauge('nzb2http_client_buffered_bytes', 'Bytes available ahead of the read position of each HTTP client', _get_buffered_bytes)
+
+################################################################################
+def get_read_positions(downloader):
+    """
+    Returns:
+        - positions: [(path, offset), ...] of the files of a job being served
+    """
+    positions = []
+    for file_wrapper in list(_file_wrappers):
+        if file_wrapper.downloader is downloader:
+            position = file_wrapper.get_position()
+            if position is not None:
+                positions.append((file_wrapper.path, position))
+    return positions
+
+# Rate at which clients consume the files, limited by the download when they
+# catch up with it
+served_bytes = stats.counter('nzb2http_served_bytes_total', 'Bytes read by HTTP clients')
+
 ################################################################################
 class FileWrapper(io.RawIOBase):
-    def __init__(self, path, complete_size):
+    def __init__(self, path, complete_size, watermark, downloader):
         self.path          = path
         self.complete_size = complete_size
+        self.watermark     = watermark
+        self.downloader    = downloader
         self.file          = open(self.path, 'rb')
         self.virtual_read  = False
+        self.client        = None
+        _file_wrappers.add(self)
 
     def seek(self, offset, whence=io.SEEK_SET):
         if whence == io.SEEK_SET:
@@ -23,29 +60,241 @@ class FileWrapper(io.RawIOBase):
         elif whence == io.SEEK_END:
             new_position = self.complete_size + offset
 
-        if new_position > os.path.getsize(self.path):
+        if new_position > self.watermark.position:
             if (self.complete_size - new_position) < VIRTUAL_READ_THRESHOLD:
                 self.virtual_read = True
                 return
 
-            while new_position > os.path.getsize(self.path):
-                time.sleep(1)
-            return self.file.seek(new_position, io.SEEK_SET)
-        else:
-            return self.file.seek(new_position, io.SEEK_SET)
-        
+            # The next read waits for the extractor to get there
+            self.downloader.request_extracted_range(self.path, new_position)
+
+        return self.file.seek(new_position, io.SEEK_SET)
+
     def read(self, size=-1):
         if self.virtual_read:
             self.virtual_read = False
             return ""
 
+        position = self.file.tell()
         if size == -1:
-            size = complete_size - self.file.tell()
-
-        while (self.file.tell() + size) > os.path.getsize(self.path):
-            time.sleep(1)
+            size = self.complete_size - position
+        if position < self.downloader.extractor.released.get(self.path, 0):
+            raise IOError('{0} at {1} was deleted to free disk space'.format(self.path, position))
+        self.downloader.update_playhead(self.path, position)
 
-        return self.file.read(size)
+        # Return whatever is available up to size as soon as one byte is
+        available = self.watermark.wait(position)
+        size      = min(size, max(0, available - position))
+        data      = self.get_cached(size)
+        if data is None:
+            data = self.file.read(size)
+        else:
+            self.file.seek(len(data), io.SEEK_CUR)
+        served_bytes.add(len(data))
+        return data
 
     def close(self):
+        _file_wrappers.discard(self)
         return self.file.close()
+
+    def get_buffered_bytes(self):
+        if self.file.closed:
+            return None
+        return max(0, self.watermark.position - self.file.tell())
+
+    def get_position(self):
+        if self.file.closed:
+            return None
+        return self.file.tell()
+
+    def get_readable(self):
+        """
+        Tells what can be read from the current position on without waiting,
+        for the data to be sent straight from the file.
+
+        Returns:
+            - readable: (fileno, offset, length) of the available data, None if
+              it is not available yet, length being 0 past the end of the data
+        """
+        if self.virtual_read:
+            return (None, 0, 0)
+
+        position = self.file.tell()
+        if position < self.downloader.extractor.released.get(self.path, 0):
+            raise IOError('{0} at {1} was deleted to free disk space'.format(self.path, position))
+        self.downloader.update_playhead(self.path, position)
+
+        if self.watermark.position > position:
+            return (self.file.fileno(), position, self.watermark.position - position)
+        if self.watermark.complete:
+            return (None, 0, 0)
+        return None
+
+    def get_cached(self, size):
+        """
+        Returns:
+            - data: at most size bytes from the current position on, from the
+              cache of the job, None if it does not hold them
+        """
+        if not self.downloader.cache or size <= 0:
+            return None
+        return self.downloader.cache.get(self.path, self.file.tell(), size)
+
+    def advance(self, length):
+        # Moves past data read without read
+        self.file.seek(length, io.SEEK_CUR)
+        served_bytes.add(length)
+
+################################################################################
+class StoredFileWrapper(io.RawIOBase):
+    """
+    Reads an entry stored uncompressed in RAR volumes straight from the
+    downloaded volumes, including volumes still being downloaded.
+    """
+    def __init__(self, path, complete_size, downloader):
+        self.path          = path
+        self.complete_size = complete_size
+        self.downloader    = downloader
+        self.position      = 0
+        self.volume_files  = {}
+        self.client        = None
+        self.requested     = None
+        _file_wrappers.add(self)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position = self.position + offset
+        elif whence == io.SEEK_END:
+            self.position = self.complete_size + offset
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        if size == -1:
+            size = self.complete_size - self.position
+        size = min(size, self.complete_size - self.position)
+        if size <= 0:
+            return ""
+
+        location = self.downloader.locate_stored_range(self.path, self.position)
+        if not location:
+            raise IOError('No volume holds {0} at {1}'.format(self.path, self.position))
+
+        file_writer, volume_offset, length = location
+        if file_writer.deleted:
+            raise IOError('{0} at {1} was deleted to free disk space'.format(self.path, self.position))
+        self.downloader.update_playhead(self.path, self.position)
+        if not file_writer.is_written(volume_offset):
+            self.downloader.request_extracted_range(self.path, self.position)
+
+        # Prioritized segments may be written ahead of the rest of the volume
+        length = min(length, file_writer.wait_written(volume_offset) - volume_offset)
+
+        data = self.downloader.cache.get(file_writer.path, volume_offset, min(size, length)) if self.downloader.cache else None
+        if data is None:
+            volume_file = self._get_volume_file(file_writer)
+            volume_file.seek(volume_offset)
+            data = volume_file.read(min(size, length))
+        self.position = self.position + len(data)
+        served_bytes.add(len(data))
+        return data
+
+    def close(self):
+        _file_wrappers.discard(self)
+        for volume_file, complete in self.volume_files.values():
+            volume_file.close()
+        self.volume_files = {}
+
+    def get_buffered_bytes(self):
+        return self.downloader.get_buffered_bytes_at(self.path, self.position)
+
+    def get_position(self):
+        return self.position
+
+    def get_readable(self):
+        """
+        Tells what can be read from the current position on without waiting,
+        for the data to be sent straight from the volume holding it.
+
+        Returns:
+            - readable: (fileno, offset, length) of the available data, None if
+              it is not available yet, length being 0 past the end of the data
+        """
+        size = self.complete_size - self.position
+        if size <= 0:
+            return (None, 0, 0)
+
+        location = self.downloader.locate_stored_range(self.path, self.position)
+        if not location:
+            raise IOError('No volume holds {0} at {1}'.format(self.path, self.position))
+
+        file_writer, volume_offset, length = location
+        if file_writer.deleted:
+            raise IOError('{0} at {1} was deleted to free disk space'.format(self.path, self.position))
+        self.downloader.update_playhead(self.path, self.position)
+
+        end = file_writer.get_written_end(volume_offset)
+        if end <= volume_offset:
+            if file_writer.complete:
+                return (None, 0, 0)
+            # Prioritized once, not every time the data is looked for
+            if self.requested != self.position:
+                self.downloader.request_extracted_range(self.path, self.position)
+                self.requested = self.position
+            return None
+
+        volume_file = self._get_volume_file(file_writer)
+        return (volume_file.fileno(), volume_offset, min(size, length, end - volume_offset))
+
+    def get_cached(self, size):
+        """
+        Returns:
+            - data: at most size bytes from the current position on, from the
+              cache of the job, None if it does not hold them
+        """
+        size = min(size, self.complete_size - self.position)
+        if not self.downloader.cache or size <= 0:
+            return None
+
+        location = self.downloader.locate_stored_range(self.path, self.position)
+        if not location:
+            return None
+        file_writer, volume_offset, length = location
+        return self.downloader.cache.get(file_writer.path, volume_offset, min(size, length))
+
+    def advance(self, length):
+        # Moves past data read without read
+        self.position = self.position + length
+        served_bytes.add(length)
+
+    def _get_volume_file(self, file_writer):
+        # Handles opened on incomplete volumes remain valid once renamed, but
+        # not once replaced by a repaired file. They are unbuffered so that
+        # holes read ahead are never served later on. Only the handle on the
+        # volume being read is kept, for deleted volumes to free their space.
+        volume_file, complete = self.volume_files.get(file_writer, (None, False))
+        if volume_file and file_writer.complete and not complete:
+            if os.fstat(volume_file.fileno()).st_ino != os.stat(file_writer.path).st_ino:
+                volume_file.close()
+                volume_file = None
+            self.volume_files[file_writer] = (volume_file, True)
+
+        if not volume_file:
+            for other_file, other_complete in self.volume_files.values():
+                if other_file:
+                    other_file.close()
+            self.volume_files = {}
+
+            complete = file_writer.complete
+            try:
+                volume_file = open(file_writer.incomplete_path if not complete else file_writer.path, 'rb', 0)
+            except IOError:
+                complete    = True
+                volume_file = open(file_writer.path, 'rb', 0)
+            self.volume_files[file_writer] = (volume_file, complete)
+
+        return volume_file
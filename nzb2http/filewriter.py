@@ -0,0 +1,335 @@
+################################################################################
+import crc
+import fallocate
+import os
+import threading
+import watermark
+import zlib
+
+################################################################################
+# Bytes written to a file between two syncs to disk, the journal recording
+# segments once they are synced so that a crash never leaves it ahead of the
+# data
+JOURNAL_SYNC_SIZE = 64 * 1024 * 1024
+
+# fsync also writes metadata that does not matter here, where fdatasync exists
+_fdatasync = getattr(os, 'fdatasync', os.fsync)
+
+################################################################################
+class FileWriter:
+    ############################################################################
+    def __init__(self, path, segment_count, journal=None, cache=None):
+        self.path            = path
+        self.name            = os.path.basename(path)
+        self.journal         = journal
+        self.cache           = cache
+        self.repairer        = None
+        self.incomplete_path = path + '.incomplete'
+        self.segment_count   = segment_count
+        self.segments_done   = bytearray(segment_count)
+        self.segments_left   = segment_count
+        self.failed_segments = []
+        self.size            = None
+        self.available       = 0
+        self.complete        = False
+        self.deleted         = False
+        self.fd              = None
+        self.lock            = threading.Lock()
+        self.watermark       = watermark.Watermark()
+
+        # Notified whenever a segment is written, for readers of bytes beyond
+        # the watermark
+        self.written         = threading.Condition(self.lock)
+
+        # Written ranges that start beyond the contiguous watermark, keyed by
+        # start offset
+        self.pending_ranges  = {}
+
+        # (offset, length, crc32) of the segments written, keyed by index
+        self.segment_crc32s  = {}
+
+        # (index, offset, length, crc32, file size) of the segments written
+        # since the last sync, not journaled yet
+        self.unsynced_segments = []
+        self.unsynced_bytes    = 0
+
+        if self.journal:
+            self._resume()
+
+    ############################################################################
+    def write_segment(self, index, size, offset, data, crc32=None):
+        """
+        Writes a segment, crc32 being the CRC32 of data if already known.
+
+        Returns:
+            - complete: True if the segment completed the file
+        """
+        with self.lock:
+            if self.complete or self.segments_done[index]:
+                return False
+
+            if self.fd is None:
+                self._open(size)
+
+            fallocate.pwrite(self.fd, data, offset)
+
+            # Readers get the segment from memory while it is recent
+            if self.cache:
+                self.cache.put(self.path, offset, data)
+
+            if crc32 is None:
+                crc32 = zlib.crc32(data)
+            crc32 = crc32 & 0xffffffff
+
+            self.segments_done[index]  = 1
+            self.segments_left         = self.segments_left - 1
+            self.segment_crc32s[index] = (offset, len(data), crc32)
+            self._advance(offset, offset + len(data))
+            if self.journal:
+                self.unsynced_segments.append((index, offset, len(data), crc32, size))
+                self.unsynced_bytes = self.unsynced_bytes + len(data)
+                if self.unsynced_bytes >= JOURNAL_SYNC_SIZE:
+                    self._sync()
+
+            if not self.segments_left:
+                self._close()
+
+            self.written.notify_all()
+            return not self.segments_left
+
+    ############################################################################
+    def fail_segment(self, index):
+        # The segment is given up, leaving a hole in the file
+        with self.lock:
+            if self.complete or self.segments_done[index]:
+                return False
+
+            self.segments_done[index] = 1
+            self.segments_left        = self.segments_left - 1
+            self.failed_segments.append(index)
+
+            if not self.segments_left:
+                self._close()
+
+            self.written.notify_all()
+            return not self.segments_left
+
+    ############################################################################
+    def get_damaged_ranges(self):
+        """
+        Returns:
+            - ranges: (start, end) of the holes left by failed segments, bounded
+              by the segments written around them
+        """
+        with self.lock:
+            ranges = []
+            for index in sorted(self.failed_segments):
+                start = self.segment_crc32s[index - 1][0] + self.segment_crc32s[index - 1][1] if index - 1 in self.segment_crc32s else 0
+                end   = self.segment_crc32s[index + 1][0] if index + 1 in self.segment_crc32s else self.size
+                if ranges and start <= ranges[-1][1]:
+                    ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end))
+                else:
+                    ranges.append((start, end))
+            return ranges
+
+    ############################################################################
+    def repaired(self, success):
+        # Completes a file handed over to the repairer, holes and all if it
+        # could not be repaired
+        with self.lock:
+            if self.cache:
+                self.cache.discard(self.path)
+            if success:
+                os.remove(self.incomplete_path)
+                self.failed_segments = []
+                self.available       = self.size
+                self.watermark.advance(self.available)
+            else:
+                os.rename(self.incomplete_path, self.path)
+
+            # Files left with holes keep their segments journaled instead, for
+            # the next run to download the missing ones again
+            if self.journal and success:
+                self.journal.file_completed(self.name, self.size, None)
+
+            self.complete = True
+            self.watermark.finish()
+            self.written.notify_all()
+
+    ############################################################################
+    def sync(self):
+        # Journals the segments written so far, e.g. when the job is stopped
+        with self.lock:
+            if self.fd is not None:
+                self._sync()
+
+    ############################################################################
+    def delete(self):
+        # Frees the disk space of a complete file no longer needed, which the
+        # next run downloads again
+        with self.lock:
+            if os.path.isfile(self.path):
+                os.remove(self.path)
+            if self.cache:
+                self.cache.discard(self.path)
+            if self.journal:
+                self.journal.forget(self.name)
+            self.deleted = True
+
+    ############################################################################
+    def wait_written(self, offset):
+        """
+        Waits until the byte at offset is written, wherever it is in the file,
+        or the file is complete.
+
+        Returns:
+            - end: end of the bytes written contiguously from offset on
+        """
+        with self.lock:
+            end = self._get_written_end(offset)
+            while end <= offset and not self.complete:
+                self.written.wait()
+                end = self._get_written_end(offset)
+            return end
+
+    ############################################################################
+    def wait_complete(self, timeout):
+        """
+        Waits at most timeout seconds for the file to be complete, repaired if
+        it had to be.
+
+        Returns:
+            - complete: whether the file is complete
+        """
+        with self.lock:
+            if not self.complete:
+                self.written.wait(timeout)
+            return self.complete
+
+    ############################################################################
+    def is_written(self, offset):
+        with self.lock:
+            return self._get_written_end(offset) > offset
+
+    ############################################################################
+    def get_written_end(self, offset):
+        """
+        Returns:
+            - end: end of the bytes written contiguously from offset on, offset
+              if the byte there is not written yet
+        """
+        with self.lock:
+            return self._get_written_end(offset)
+
+    ############################################################################
+    def _get_written_end(self, offset):
+        if self.complete:
+            return self.size
+        if offset < self.available:
+            return self.available
+
+        for start, end in self.pending_ranges.items():
+            if start <= offset < end:
+                while end in self.pending_ranges:
+                    end = self.pending_ranges[end]
+                return end
+        return offset
+
+    ############################################################################
+    def _resume(self):
+        # Picks up where a previous run left off according to the journal
+        completed = self.journal.get_completed(self.name)
+        if completed and os.path.isfile(self.path) and os.path.getsize(self.path) == completed[0]:
+            self.size          = completed[0]
+            self.segments_done = bytearray([1]) * self.segment_count
+            self.segments_left = 0
+            self._advance(0, self.size)
+            self.complete      = True
+            self.watermark.finish()
+            return
+
+        # Files completed with holes are only journaled segment by segment, and
+        # are resumed like incomplete ones
+        segments = self.journal.get_segments(self.name)
+        if not completed and segments and not os.path.isfile(self.incomplete_path) and os.path.isfile(self.path):
+            os.rename(self.path, self.incomplete_path)
+
+        if completed or not segments or not os.path.isfile(self.incomplete_path):
+            self.journal.forget(self.name)
+            return
+
+        self.fd = os.open(self.incomplete_path, os.O_RDWR)
+        for index, (offset, length, crc32, size) in segments.items():
+            if index < self.segment_count and not self.segments_done[index]:
+                self.size                  = size
+                self.segments_done[index]  = 1
+                self.segments_left         = self.segments_left - 1
+                self.segment_crc32s[index] = (offset, length, crc32)
+                self._advance(offset, offset + length)
+
+        if not self.segments_left:
+            self._close()
+
+    ############################################################################
+    def _get_crc32(self):
+        # Combines the CRC32 of the segments if they cover the whole file
+        crc32    = 0
+        position = 0
+        for offset, length, segment_crc32 in sorted(self.segment_crc32s.values()):
+            if offset != position:
+                return None
+            crc32    = crc.crc32_combine(crc32, segment_crc32, length)
+            position = offset + length
+        if position != self.size:
+            return None
+        return crc32
+
+    ############################################################################
+    def _open(self, size):
+        if not os.path.isdir(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+
+        # The whole file is allocated up front where the file system allows
+        self.size = size
+        self.fd   = os.open(self.incomplete_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0666)
+        if not fallocate.allocate(self.fd, 0, size):
+            os.ftruncate(self.fd, size)
+
+    ############################################################################
+    def _sync(self):
+        _fdatasync(self.fd)
+        if self.journal and self.unsynced_segments:
+            self.journal.segments_written(self.name, self.unsynced_segments)
+        self.unsynced_segments = []
+        self.unsynced_bytes    = 0
+
+    ############################################################################
+    def _advance(self, start, end):
+        if start > self.available:
+            self.pending_ranges[start] = end
+            return
+
+        self.available = max(self.available, end)
+        while self.available in self.pending_ranges:
+            self.available = max(self.available, self.pending_ranges.pop(self.available))
+        self.watermark.advance(self.available)
+
+    ############################################################################
+    def _close(self):
+        if self.fd is not None:
+            # Written data reaches the disk before the file is renamed
+            self._sync()
+            os.close(self.fd)
+            self.fd = None
+
+            # Damaged files stay incomplete until the repairer is done with them
+            if self.failed_segments and self.repairer:
+                self.repairer.repair(self)
+                return
+
+            os.rename(self.incomplete_path, self.path)
+            if self.journal and not self.failed_segments:
+                self.journal.file_completed(self.name, self.size, self._get_crc32())
+
+        self.complete = True
+        self.watermark.finish()
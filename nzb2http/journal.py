@@ -0,0 +1,119 @@
+################################################################################
+import os
+import threading
+
+################################################################################
+class Journal:
+    """
+    Append-only record of the segments written to the files of an NZB and of
+    the files completed, so that a restart only downloads what is missing.
+
+    Each line is one of:
+        S <index> <offset> <length> <crc32> <file size> <name>
+        C <size> <crc32 or -> <name>
+        R <name>
+    for a segment written, a file completed and a file started over. Lines cut
+    off by a crash are ignored.
+    """
+    ############################################################################
+    def __init__(self, path):
+        self.path      = path
+        self.lock      = threading.Lock()
+        self.file      = None
+        self.segments  = {}
+        self.completed = {}
+        self._load()
+
+    ############################################################################
+    def get_segments(self, name):
+        """
+        Returns:
+            - segments: {index: (offset, length, crc32, file size)} of the
+              segments of the file written so far
+        """
+        with self.lock:
+            return dict(self.segments.get(name, {}))
+
+    ############################################################################
+    def get_completed(self, name):
+        """
+        Returns:
+            - completed: (size, crc32) of the file, crc32 being None when
+              unknown, None if the file was not completed
+        """
+        with self.lock:
+            return self.completed.get(name)
+
+    ############################################################################
+    def segments_written(self, name, segments):
+        # Records (index, offset, length, crc32, file size) segments at once
+        with self.lock:
+            lines = []
+            for index, offset, length, crc32, file_size in segments:
+                self.segments.setdefault(name, {})[index] = (offset, length, crc32, file_size)
+                lines.append('S {0} {1} {2} {3:08x} {4} {5}\n'.format(index, offset, length, crc32, file_size, name))
+            self._append(''.join(lines))
+
+    ############################################################################
+    def file_completed(self, name, size, crc32):
+        with self.lock:
+            self.segments.pop(name, None)
+            self.completed[name] = (size, crc32)
+            self._append('C {0} {1} {2}\n'.format(size, '{0:08x}'.format(crc32) if crc32 is not None else '-', name))
+
+    ############################################################################
+    def forget(self, name):
+        with self.lock:
+            if name in self.segments or name in self.completed:
+                self.segments.pop(name, None)
+                self.completed.pop(name, None)
+                self._append('R {0}\n'.format(name))
+
+    ############################################################################
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+    ############################################################################
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return
+
+        with open(self.path, 'r') as journal_file:
+            for line in journal_file:
+                if not line.endswith('\n'):
+                    continue
+                try:
+                    if line.startswith('S '):
+                        index, offset, length, crc32, file_size, name = line[2:-1].split(' ', 5)
+                        self.segments.setdefault(name, {})[int(index)] = (int(offset), int(length), int(crc32, 16), int(file_size))
+                    elif line.startswith('C '):
+                        size, crc32, name = line[2:-1].split(' ', 2)
+                        self.segments.pop(name, None)
+                        self.completed[name] = (int(size), int(crc32, 16) if crc32 != '-' else None)
+                    elif line.startswith('R '):
+                        name = line[2:-1]
+                        self.segments.pop(name, None)
+                        self.completed.pop(name, None)
+                except ValueError:
+                    continue
+
+    ############################################################################
+    def _append(self, line):
+        if not self.file:
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            self.file = open(self.path, 'a+')
+
+            # Keeps a line cut off by a crash apart from the next one
+            self.file.seek(0, os.SEEK_END)
+            if self.file.tell():
+                self.file.seek(-1, os.SEEK_END)
+                last_character = self.file.read(1)
+                self.file.seek(0, os.SEEK_END)
+                if last_character != '\n':
+                    self.file.write('\n')
+        self.file.write(line)
+        self.file.flush()
@@ -16,6 +16,11 @@ nntplib.LONGRESP.append('101')
 
 SSL_PORTS = [443, 563]
 
+# Initial size of the buffer pipelined responses are received into, grown when
+# a response does not fit
+RECV_BUFFER_SIZE = 2 * 1024 * 1024
+RECV_CHUNK_SIZE  = 256 * 1024
+
 def get_error_code(error):
     """
     Attempts to extract the NNTP error code number from an NNTPError, which
@@ -47,6 +52,9 @@ class NNTP(nntplib.NNTP):
         self.welcome    = self.getresp()
         self._caps      = None
         self.authenticated = False
+        self.recv_buffer   = None
+        self.recv_start    = 0
+        self.recv_end      = 0
 
         # RFC 4642 2.2.2: Both the client and the server MUST know if there is
         # a TLS session active.  A client MUST NOT attempt to start a TLS
@@ -90,10 +98,10 @@ class NNTP(nntplib.NNTP):
                 raise ValueError("TLS is already enabled.")
             if self.authenticated:
                 raise ValueError("TLS cannot be started after authentication.")
-            resp = self._shortcmd('STARTTLS')
+            resp = self.shortcmd('STARTTLS')
             if resp.startswith('382'):
                 self.file.close()
-                self.sock = self.wrap_socket(self.sock)
+                self.sock = self.wrap_socket(self.sock, True)
                 self.file = self.sock.makefile("rwb")
                 self.tls_on = True
                 # Capabilities may change after TLS starts up, so ask for them
@@ -116,14 +124,14 @@ class NNTP(nntplib.NNTP):
             except nntplib.NNTPPermanentError:
                 # Server doesn't support capabilities
                 self._caps = {}
-        else:
-            self._caps = caps
-            if 'VERSION' in caps:
-                # The server can advertise several supported versions,
-                # choose the highest.
-                self.nntp_version = max(map(int, caps['VERSION']))
-            if 'IMPLEMENTATION' in caps:
-                self.nntp_implementation = ' '.join(caps['IMPLEMENTATION'])
+            else:
+                self._caps = caps
+                if 'VERSION' in caps:
+                    # The server can advertise several supported versions,
+                    # choose the highest.
+                    self.nntp_version = max(map(int, caps['VERSION']))
+                if 'IMPLEMENTATION' in caps:
+                    self.nntp_implementation = ' '.join(caps['IMPLEMENTATION'])
         return self._caps
   
     def capabilities(self):
@@ -155,3 +163,103 @@ class NNTP(nntplib.NNTP):
             log.debug("Using SSL")
             return ssl.wrap_socket(sock, ssl_version=ssl.PROTOCOL_TLSv1)
         return sock
+
+    def send_body(self, message_id):
+        """
+        Sends a BODY command without waiting for its response, so several
+        commands can be pipelined. Responses are read in order by recv_body.
+        """
+        self.sock.sendall('BODY ' + message_id + '\r\n')
+
+    def send_stats(self, message_ids):
+        """
+        Sends STAT commands for several articles at once, their responses being
+        read in order by recv_stat.
+        """
+        self.sock.sendall(''.join('STAT ' + message_id + '\r\n' for message_id in message_ids))
+
+    def recv_stat(self):
+        """
+        Reads the response to the oldest pipelined STAT command.
+
+        Returns:
+            - resp: server response line, starting with 223 if the server has
+              the article and 430 if it does not
+        """
+        if self.recv_buffer is None:
+            self.recv_buffer = bytearray(RECV_BUFFER_SIZE)
+        if self.recv_start == self.recv_end:
+            self.recv_start, self.recv_end = 0, 0
+
+        resp_end        = self._recv_until('\r\n', self.recv_start)
+        resp            = str(self.recv_buffer[self.recv_start:resp_end])
+        self.recv_start = resp_end + 2
+        return resp
+
+    def recv_body(self):
+        """
+        Reads the response to the oldest pipelined BODY command into the
+        receive buffer, without splitting it into lines.
+
+        Returns:
+            - resp: server response line
+            - body: body with CRLF line endings and dot-stuffing removed
+
+        Raises NNTPTemporaryError or NNTPPermanentError on error responses,
+        the connection remaining usable for the next pipelined command.
+        """
+        if self.recv_buffer is None:
+            self.recv_buffer = bytearray(RECV_BUFFER_SIZE)
+        if self.recv_start == self.recv_end:
+            self.recv_start, self.recv_end = 0, 0
+
+        # Positions are kept relative to recv_start as the unread data can be
+        # moved while receiving
+        resp_length = self._recv_until('\r\n', self.recv_start) - self.recv_start
+        resp_end    = self.recv_start + resp_length
+        resp        = str(self.recv_buffer[self.recv_start:resp_end])
+        if resp[:1] == '4':
+            self.recv_start = resp_end + 2
+            raise nntplib.NNTPTemporaryError(resp)
+        if resp[:1] != '2':
+            self.recv_start = resp_end + 2
+            raise nntplib.NNTPPermanentError(resp)
+
+        # The terminator search starts on the CRLF of the response line so that
+        # an empty body is found as well
+        body_end = self._recv_until('\r\n.\r\n', resp_end)
+        resp_end = self.recv_start + resp_length
+        body     = str(self.recv_buffer[resp_end + 2:body_end + 2])
+        self.recv_start = body_end + 5
+
+        if body.startswith('..'):
+            body = body[1:]
+        return resp, body.replace('\r\n..', '\r\n.')
+
+    def _recv_until(self, terminator, start):
+        """
+        Receives data until terminator is found at or after start, moving the
+        unread data to the beginning of the buffer or growing it as needed.
+
+        Returns:
+            - position: position of terminator in the receive buffer
+        """
+        search_start = start
+        while True:
+            position = self.recv_buffer.find(terminator, search_start, self.recv_end)
+            if position != -1:
+                return position
+            search_start = max(start, self.recv_end - len(terminator) + 1)
+
+            if self.recv_start and self.recv_end + RECV_CHUNK_SIZE > len(self.recv_buffer):
+                shift = self.recv_start
+                self.recv_buffer[:self.recv_end - shift] = self.recv_buffer[shift:self.recv_end]
+                self.recv_start, self.recv_end = 0, self.recv_end - shift
+                start, search_start            = start - shift, search_start - shift
+            if self.recv_end + RECV_CHUNK_SIZE > len(self.recv_buffer):
+                self.recv_buffer.extend(bytearray(len(self.recv_buffer)))
+
+            count = self.sock.recv_into(memoryview(self.recv_buffer)[self.recv_end:])
+            if not count:
+                raise EOFError('Connection closed by server')
+            self.recv_end = self.recv_end + count
@@ -0,0 +1,118 @@
+################################################################################
+import array
+import cStringIO
+import gzip
+import re
+
+from xml.etree import cElementTree
+
+################################################################################
+RE_NZB_FILE_NAME = re.compile('\"(.+)\"')
+
+GZIP_MAGIC = '\x1f\x8b'
+
+################################################################################
+class NZBSegment:
+    ############################################################################
+    def __init__(self, number, bytes, message_id):
+        self.number     = number
+        self.bytes      = bytes
+        self.message_id = message_id
+
+################################################################################
+class NZBSegmentTable:
+    """
+    Segments of a file, kept in arrays rather than as one object per segment.
+    Indexing returns an NZBSegment built on the fly.
+    """
+    ############################################################################
+    def __init__(self):
+        self.numbers     = array.array('I')
+        self.sizes       = array.array('I')
+        self.message_ids = []
+
+    ############################################################################
+    def __len__(self):
+        return len(self.message_ids)
+
+    ############################################################################
+    def __getitem__(self, index):
+        return NZBSegment(self.numbers[index], self.sizes[index], self.message_ids[index])
+
+    ############################################################################
+    def __iter__(self):
+        for index in range(len(self.message_ids)):
+            yield self[index]
+
+    ############################################################################
+    def add(self, number, size, message_id):
+        self.numbers.append(number)
+        self.sizes.append(size)
+        self.message_ids.append(intern(message_id))
+
+    ############################################################################
+    def get_total_bytes(self):
+        return sum(self.sizes)
+
+    ############################################################################
+    def sort(self):
+        # Puts the segments in number order, that is in the order of their
+        # data in the file, which many NZBs do not list them in
+        order = sorted(range(len(self.message_ids)), key=self.numbers.__getitem__)
+        if order == range(len(order)):
+            return
+        self.numbers     = array.array('I', [self.numbers[index] for index in order])
+        self.sizes       = array.array('I', [self.sizes[index] for index in order])
+        self.message_ids = [self.message_ids[index] for index in order]
+
+################################################################################
+class NZBFile:
+    ############################################################################
+    def __init__(self, subject, groups, segments):
+        self.subject  = subject
+        self.groups   = groups
+        self.segments = segments
+        self.path     = None
+
+        match_result = RE_NZB_FILE_NAME.search(subject)
+        self.name    = match_result.group(1) if match_result else subject.strip()
+
+################################################################################
+def iter_files(nzb):
+    """
+    Parses an NZB as it is read, gzip compressed or not, without holding the
+    document in memory.
+
+    Arguments:
+        - nzb: file object or content of the NZB
+
+    Yields:
+        - nzb_file: NZBFile for every file of the NZB, in document order,
+          its segments in number order
+    """
+    if isinstance(nzb, basestring):
+        nzb = cStringIO.StringIO(nzb)
+
+    magic = nzb.read(len(GZIP_MAGIC))
+    nzb.seek(-len(magic), 1)
+    if magic == GZIP_MAGIC:
+        nzb = gzip.GzipFile(fileobj=nzb, mode='rb')
+
+    groups   = []
+    segments = NZBSegmentTable()
+    for event, element in cElementTree.iterparse(nzb):
+        # Tags are compared without the namespace, which some indexers omit
+        tag = element.tag.rsplit('}', 1)[-1]
+        if tag == 'segment':
+            segments.add(int(element.get('number', len(segments) + 1)), int(element.get('bytes', 0)), element.text.strip())
+            element.clear()
+        elif tag == 'group':
+            groups.append(element.text)
+        elif tag == 'file':
+            segments.sort()
+            yield NZBFile(element.get('subject', ''), groups, segments)
+            groups   = []
+            segments = NZBSegmentTable()
+
+            # Parsed files are emptied as they are handed out
+            element.clear()
@@ -0,0 +1,85 @@
+################################################################################
+import re
+import struct
+
+################################################################################
+PAR2_PACKET_MAGIC = 'PAR2\x00PKT'
+
+PAR2_PACKET_MAIN      = 'PAR 2.0\x00Main\x00\x00\x00\x00'
+PAR2_PACKET_FILE_DESC = 'PAR 2.0\x00FileDesc'
+
+PAR2_HEADER_SIZE = 64
+
+RE_PAR2_VOLUME = re.compile('\.vol(\d+)\+(\d+)\.par2$', re.IGNORECASE)
+
+################################################################################
+class Par2File:
+    ############################################################################
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+
+################################################################################
+class Par2Index:
+    ############################################################################
+    def __init__(self, slice_size, files):
+        self.slice_size = slice_size
+        self.files      = files
+
+    ############################################################################
+    def get_slices(self, start, end):
+        """
+        Returns:
+            - slices: indexes within their file of the slices holding bytes
+              start to end of a file
+        """
+        return range(start // self.slice_size, (end + self.slice_size - 1) // self.slice_size)
+
+################################################################################
+def parse_index(data):
+    """
+    Parses the main and file description packets of a PAR2 file.
+
+    Returns:
+        - index: Par2Index whose files are keyed by name, None if data holds no
+          main packet
+    """
+    slice_size = None
+    files      = {}
+    position   = 0
+    while True:
+        position = data.find(PAR2_PACKET_MAGIC, position)
+        if position == -1 or position + PAR2_HEADER_SIZE > len(data):
+            break
+
+        length      = struct.unpack_from('<Q', data, position + 8)[0]
+        packet_type = data[position + 48:position + 64]
+        if length < PAR2_HEADER_SIZE or position + length > len(data):
+            position = position + len(PAR2_PACKET_MAGIC)
+            continue
+
+        body = data[position + PAR2_HEADER_SIZE:position + length]
+        if packet_type == PAR2_PACKET_MAIN:
+            slice_size = struct.unpack_from('<Q', body, 0)[0]
+        elif packet_type == PAR2_PACKET_FILE_DESC:
+            size = struct.unpack_from('<Q', body, 48)[0]
+            name = body[56:].rstrip('\x00')
+            files[name] = Par2File(name, size)
+
+        position = position + length
+
+    if not slice_size:
+        return None
+    return Par2Index(slice_size, files)
+
+################################################################################
+def get_volume_blocks(name):
+    """
+    Returns:
+        - blocks: number of recovery blocks held by a PAR2 volume according to
+          its name, 0 if name is not the one of a PAR2 volume
+    """
+    match_result = RE_PAR2_VOLUME.search(name)
+    if not match_result:
+        return 0
+    return int(match_result.group(2))
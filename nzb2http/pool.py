@@ -0,0 +1,249 @@
+################################################################################
+import decoder
+import downloader
+import filewrapper
+import math
+import stats
+import sys
+import threading
+import time
+
+################################################################################
+# Seconds of video kept downloaded ahead of readers in adaptive mode
+DEFAULT_TARGET_BUFFER = 60
+
+# Seconds between two adjustments of the number of connections
+ADAPT_INTERVAL = 5
+
+# Weight of the last interval in the moving averages of the rates
+RATE_SMOOTHING = 0.3
+
+# Seconds in which a buffer short of its target is to be refilled
+REFILL_SECONDS = 30
+
+################################################################################
+class ConnectionPool:
+    """
+    Connections to the Usenet servers shared by every download job. Workers
+    get their segments from the pool, which hands them out from the jobs'
+    schedulers.
+
+    With min_connections, the connections to the first server are adapted
+    between it and their maximum to keep target_buffer seconds of video
+    downloaded ahead of readers, backup servers keeping all theirs.
+    """
+    ############################################################################
+    def __init__(self, nntp_servers, pipeline_depth, decode_processes=0, min_connections=None, target_buffer=DEFAULT_TARGET_BUFFER):
+        self.nntp_servers      = nntp_servers
+        self.pipeline_depth    = pipeline_depth
+        self.decode_processes  = decode_processes
+        self.min_connections   = min_connections
+        self.target_buffer     = target_buffer
+        self.decoder_pool      = None
+        self.adapter           = None
+        self.condition         = threading.Condition()
+        self.jobs              = []
+        self.workers           = []
+        self.retired_workers   = set()
+        self.received_counters = set()
+        self.connection_counts = [nntp_credentials['max_connections'] for nntp_credentials in nntp_servers]
+        self.stop_requested    = False
+
+        stats.gauge('nzb2http_connections', 'Connections open or being opened per server', self._get_connection_counts)
+
+    ############################################################################
+    def start(self):
+        sys.stdout.write('[nzb2http][pool] Started\n')
+
+        # Every connection decodes at most one article at a time
+        if self.decode_processes:
+            self.decoder_pool = decoder.DecoderPool(self.decode_processes, sum(nntp_credentials['max_connections'] for nntp_credentials in self.nntp_servers), downloader._yenc_decode)
+
+        with self.condition:
+            for server_index, connection_count in enumerate(self.connection_counts):
+                self._set_connection_count(server_index, connection_count)
+
+        if self.min_connections is not None and self.min_connections < self.connection_counts[0]:
+            self.adapter = threading.Thread(target=self._adapt_connections)
+            self.adapter.start()
+
+    ############################################################################
+    def stop(self):
+        sys.stdout.write('[nzb2http][pool] Stopping\n')
+        with self.condition:
+            self.stop_requested = True
+            self.condition.notify_all()
+        if self.adapter:
+            self.adapter.join()
+            self.adapter = None
+        for worker in self.workers:
+            worker.join()
+        self.workers         = []
+        self.retired_workers = set()
+        if self.decoder_pool:
+            self.decoder_pool.close()
+            self.decoder_pool = None
+        sys.stdout.write('[nzb2http][pool] Stopped\n')
+
+    ############################################################################
+    def add_job(self, job):
+        with self.condition:
+            self.jobs.append(job)
+            self.condition.notify_all()
+
+    ############################################################################
+    def remove_job(self, job):
+        with self.condition:
+            if job in self.jobs:
+                self.jobs.remove(job)
+            self.condition.notify_all()
+
+    ############################################################################
+    def get(self, server_index, block=True):
+        # Retired workers get nothing more, they close their connection once
+        # the requests in flight are read
+        worker = threading.current_thread()
+        with self.condition:
+            while not self.stop_requested and worker not in self.retired_workers:
+                job = self._next_job(server_index)
+                if job or not block:
+                    return job
+                self.condition.wait(1)
+
+    ############################################################################
+    def task_done(self, scheduled_file, index):
+        scheduled_file.scheduler.task_done(scheduled_file, index)
+
+    ############################################################################
+    def task_failed(self, scheduled_file, index, server_index, missing):
+        scheduled_file.scheduler.task_failed(scheduled_file, index, server_index, missing)
+
+    ############################################################################
+    def task_cancelled(self, scheduled_file, index, server_index):
+        scheduled_file.scheduler.task_cancelled(scheduled_file, index, server_index)
+
+    ############################################################################
+    def _next_job(self, server_index):
+        """
+        Every job gets a fair share of the requests in flight on the first
+        server. Within that share, the job with the least data downloaded ahead
+        of its readers goes first; jobs nobody reads from go last. Requests a
+        job leaves unused are handed to the others.
+        """
+        jobs = [job for job in self.jobs if not job.scheduler.stop_requested]
+        if not jobs:
+            return None
+
+        jobs.sort(key=lambda job: self._get_urgency(job))
+
+        slots      = self.connection_counts[0] * self.pipeline_depth
+        fair_share = max(1, slots // len(jobs))
+        for job in jobs:
+            if job.scheduler.get_in_flight() < fair_share:
+                next_job = job.scheduler.get(server_index, block=False)
+                if next_job:
+                    return next_job
+
+        for job in jobs:
+            next_job = job.scheduler.get(server_index, block=False)
+            if next_job:
+                return next_job
+
+    ############################################################################
+    def _get_urgency(self, job):
+        buffered_bytes = job.get_buffered_bytes()
+        return (buffered_bytes is None, buffered_bytes)
+
+    ############################################################################
+    def _adapt_connections(self):
+        """
+        Sets the connections to the first server to what downloads at the rate
+        readers consume, plus what refills their buffer when it is short of
+        its target. Without readers, every connection is used while there is
+        something to download, the minimum otherwise.
+        """
+        consumption_rate = None
+        connection_rate  = None
+        served_bytes     = filewrapper.served_bytes.value
+        received_bytes   = self._get_received_bytes()
+        last_time        = time.time()
+
+        with self.condition:
+            while not self.stop_requested:
+                self.condition.wait(max(0, last_time + ADAPT_INTERVAL - time.time()))
+                now = time.time()
+                if self.stop_requested or now - last_time < ADAPT_INTERVAL:
+                    continue
+
+                self.workers         = [worker for worker in self.workers if worker.is_alive()]
+                self.retired_workers = set(worker for worker in self.retired_workers if worker.is_alive())
+
+                jobs            = [job for job in self.jobs if not job.scheduler.stop_requested]
+                busy            = any(job.scheduler.get_queue_depth() for job in jobs)
+                readers         = [buffered_bytes for buffered_bytes in (job.get_buffered_bytes() for job in jobs) if buffered_bytes is not None]
+                current_count   = self.connection_counts[0]
+
+                # The rate per connection is only known while they have
+                # something to download
+                last_served_bytes, served_bytes     = served_bytes, filewrapper.served_bytes.value
+                last_received_bytes, received_bytes = received_bytes, self._get_received_bytes()
+                consumption_rate = self._smooth(consumption_rate, (served_bytes - last_served_bytes) / (now - last_time))
+                if busy:
+                    connection_rate = self._smooth(connection_rate, (received_bytes - last_received_bytes) / (now - last_time) / current_count)
+                last_time = now
+
+                if not busy and not any(job.scheduler.get_in_flight() for job in jobs):
+                    connection_count = self.min_connections
+                elif not readers or not connection_rate:
+                    connection_count = self.nntp_servers[0]['max_connections']
+                else:
+                    buffered_bytes   = min(readers)
+                    target_bytes     = consumption_rate * self.target_buffer
+                    wanted_rate      = consumption_rate + max(0, target_bytes - buffered_bytes) / REFILL_SECONDS
+                    connection_count = int(math.ceil(wanted_rate / connection_rate))
+
+                    # Grow at once when short, shrink keeping one spare
+                    # connection once the buffer is full
+                    if buffered_bytes < target_bytes:
+                        connection_count = max(connection_count, current_count)
+                    else:
+                        connection_count = min(connection_count + 1, current_count)
+
+                connection_count = max(self.min_connections, min(self.nntp_servers[0]['max_connections'], connection_count))
+                if connection_count != current_count:
+                    sys.stdout.write('[nzb2http][pool] {0} connections to {1}\n'.format(connection_count, self.nntp_servers[0]['host']))
+                    self._set_connection_count(0, connection_count)
+
+    ############################################################################
+    def _set_connection_count(self, server_index, connection_count):
+        # Extra workers are retired, missing ones started with the lowest free
+        # connection indexes
+        workers = [worker for worker in self.workers if worker.server_index == server_index and worker not in self.retired_workers]
+        for worker in workers[connection_count:]:
+            self.retired_workers.add(worker)
+
+        used_indexes = set(worker.connection_index for worker in workers[:connection_count])
+        free_indexes = (i for i in range(self.nntp_servers[server_index]['max_connections']) if i not in used_indexes)
+        for i in range(len(workers), connection_count):
+            worker = downloader.Worker(server_index, self.nntp_servers[server_index], self, self.pipeline_depth, next(free_indexes), self.decoder_pool)
+            worker.start()
+            self.workers.append(worker)
+            self.received_counters.add(worker.received_bytes)
+
+        self.connection_counts[server_index] = connection_count
+        self.condition.notify_all()
+
+    ############################################################################
+    def _get_received_bytes(self):
+        return sum(counter.value for counter in self.received_counters if counter.labels['server'] == self.nntp_servers[0]['host'])
+
+    ############################################################################
+    def _get_connection_counts(self):
+        with self.condition:
+            return [({'server': nntp_credentials['host']}, self.connection_counts[server_index]) for server_index, nntp_credentials in enumerate(self.nntp_servers)]
+
+    ############################################################################
+    def _smooth(self, average, value):
+        if average is None:
+            return value
+        return average + RATE_SMOOTHING * (value - average)
@@ -0,0 +1,224 @@
+################################################################################
+import struct
+
+################################################################################
+RAR4_MARKER = 'Rar!\x1a\x07\x00'
+RAR5_MARKER = 'Rar!\x1a\x07\x01\x00'
+
+RAR4_BLOCK_FILE = 0x74
+RAR4_BLOCK_END  = 0x7b
+
+RAR4_FLAG_SPLIT_BEFORE = 0x0001
+RAR4_FLAG_SPLIT_AFTER  = 0x0002
+RAR4_FLAG_PASSWORD     = 0x0004
+RAR4_FLAG_DIRECTORY    = 0x00e0
+RAR4_FLAG_LARGE        = 0x0100
+RAR4_FLAG_UNICODE      = 0x0200
+RAR4_FLAG_ADD_SIZE     = 0x8000
+RAR4_METHOD_STORE      = 0x30
+
+RAR5_BLOCK_FILE = 2
+RAR5_BLOCK_END  = 5
+
+RAR5_FLAG_EXTRA        = 0x0001
+RAR5_FLAG_DATA         = 0x0002
+RAR5_FLAG_SPLIT_BEFORE = 0x0008
+RAR5_FLAG_SPLIT_AFTER  = 0x0010
+RAR5_FILE_DIRECTORY    = 0x0001
+RAR5_FILE_MTIME        = 0x0002
+RAR5_FILE_CRC32        = 0x0004
+RAR5_EXTRA_CRYPT       = 0x01
+
+# Bytes read at once to parse a header, up to MAX_HEADER_SIZE for longer ones
+HEADER_READ_SIZE = 4 * 1024
+MAX_HEADER_SIZE  = 64 * 1024
+
+################################################################################
+class RarEntry:
+    ############################################################################
+    def __init__(self, name, unpacked_size, data_offset, data_size, is_stored, split_before, split_after):
+        self.name          = name
+        self.unpacked_size = unpacked_size
+        self.data_offset   = data_offset
+        self.data_size     = data_size
+        self.is_stored     = is_stored
+        self.split_before  = split_before
+        self.split_after   = split_after
+
+################################################################################
+def parse_volume(data):
+    """
+    Parses the file headers found in the first bytes of a RAR volume. Headers
+    which are cut off by the end of data are ignored, so the beginning of a
+    volume still being downloaded can be parsed. Directories are skipped.
+
+    Returns:
+        - entries: list of RarEntry in volume order, None if data is not the
+          beginning of a RAR volume
+    """
+    return read_volume(lambda offset, size: data[offset:offset + size])[0]
+
+################################################################################
+def read_volume(read):
+    """
+    Parses the file headers of a RAR volume wherever they are in it, such as
+    the header of an entry following the end of another one in the middle of
+    the volume. read(offset, size) returns the bytes of the volume available
+    from offset on, at most size of them.
+
+    Returns:
+        - entries: list of RarEntry in volume order, as far as the headers
+          could be read, None if the volume is not a RAR volume or its marker
+          is not available
+        - offset: offset of the first header which could not be read, None if
+          there are no more entries in the volume
+    """
+    marker = read(0, len(RAR5_MARKER))
+    if marker.startswith(RAR5_MARKER):
+        parse_header = _parse_rar5_header
+        position     = len(RAR5_MARKER)
+    elif marker.startswith(RAR4_MARKER):
+        parse_header = _parse_rar4_header
+        position     = len(RAR4_MARKER)
+    elif len(marker) < len(RAR5_MARKER) and (RAR4_MARKER.startswith(marker) or RAR5_MARKER.startswith(marker)):
+        return (None, 0)
+    else:
+        return (None, None)
+
+    entries = []
+    while True:
+        data   = read(position, HEADER_READ_SIZE)
+        header = parse_header(data, position)
+        if header is None and len(data) == HEADER_READ_SIZE:
+            data   = read(position, MAX_HEADER_SIZE)
+            header = parse_header(data, position)
+        if header is None:
+            return (entries, position)
+
+        entry, next_position, end = header
+        if entry:
+            entries.append(entry)
+
+        # An entry continued in the next volume is the last of the volume
+        if end or (entry and entry.split_after):
+            return (entries, None)
+        position = next_position
+
+################################################################################
+def _parse_rar4_header(data, position):
+    """
+    Parses the header at the beginning of data, found at position in the
+    volume.
+
+    Returns:
+        - (entry, next_position, end): entry being the RarEntry of a file
+          header, None for other headers, next_position the position of the
+          following header and end whether the header ends the volume; None if
+          data does not hold the whole header
+    """
+    if len(data) < 7:
+        return None
+    head_crc, head_type, head_flags, head_size = struct.unpack_from('<HBHH', data, 0)
+    if head_size < 7 or head_size > len(data):
+        return None
+
+    entry    = None
+    add_size = 0
+    if head_type == RAR4_BLOCK_FILE:
+        pack_size, unp_size, host_os, file_crc, ftime, unp_ver, method, name_size, attr = struct.unpack_from('<IIBIIBBHI', data, 7)
+        name_offset = 32
+        if head_flags & RAR4_FLAG_LARGE:
+            high_pack_size, high_unp_size = struct.unpack_from('<II', data, name_offset)
+            pack_size   = pack_size | (high_pack_size << 32)
+            unp_size    = unp_size | (high_unp_size << 32)
+            name_offset = name_offset + 8
+
+        name = data[name_offset:name_offset + name_size]
+        if head_flags & RAR4_FLAG_UNICODE:
+            # Only the ASCII part preceding the encoded unicode name is used
+            name = name.split('\x00')[0]
+
+        if (head_flags & RAR4_FLAG_DIRECTORY) != RAR4_FLAG_DIRECTORY:
+            entry = RarEntry(name.replace('\\', '/'), unp_size, position + head_size, pack_size, method == RAR4_METHOD_STORE and not head_flags & RAR4_FLAG_PASSWORD, bool(head_flags & RAR4_FLAG_SPLIT_BEFORE), bool(head_flags & RAR4_FLAG_SPLIT_AFTER))
+        add_size = pack_size
+    elif head_type == RAR4_BLOCK_END:
+        return (None, position + head_size, True)
+    elif head_flags & RAR4_FLAG_ADD_SIZE:
+        add_size = struct.unpack_from('<I', data, 7)[0]
+
+    return (entry, position + head_size + add_size, False)
+
+################################################################################
+def _parse_rar5_header(data, position):
+    # Same as _parse_rar4_header for RAR 5 headers
+    if len(data) < 5:
+        return None
+    header_size, offset = _read_vint(data, 4)
+    if offset is None or offset + header_size > len(data):
+        return None
+    header_end = offset + header_size
+
+    header_type,  offset = _read_vint(data, offset)
+    header_flags, offset = _read_vint(data, offset)
+    extra_size = 0
+    data_size  = 0
+    if header_flags & RAR5_FLAG_EXTRA:
+        extra_size, offset = _read_vint(data, offset)
+    if header_flags & RAR5_FLAG_DATA:
+        data_size, offset = _read_vint(data, offset)
+
+    entry = None
+    if header_type == RAR5_BLOCK_FILE:
+        file_flags,    offset = _read_vint(data, offset)
+        unpacked_size, offset = _read_vint(data, offset)
+        attributes,    offset = _read_vint(data, offset)
+        if file_flags & RAR5_FILE_MTIME:
+            offset = offset + 4
+        if file_flags & RAR5_FILE_CRC32:
+            offset = offset + 4
+        compression,   offset = _read_vint(data, offset)
+        host_os,       offset = _read_vint(data, offset)
+        name_length,   offset = _read_vint(data, offset)
+        name = data[offset:offset + name_length]
+
+        # Encrypted entries are never stored as is, whatever their method
+        encrypted = RAR5_EXTRA_CRYPT in _read_rar5_extra_types(data, header_end - extra_size, header_end)
+        if not file_flags & RAR5_FILE_DIRECTORY:
+            entry = RarEntry(name, unpacked_size, position + header_end, data_size, (compression >> 7) & 0x07 == 0 and not encrypted, bool(header_flags & RAR5_FLAG_SPLIT_BEFORE), bool(header_flags & RAR5_FLAG_SPLIT_AFTER))
+    elif header_type == RAR5_BLOCK_END:
+        return (None, position + header_end, True)
+
+    return (entry, position + header_end + data_size, False)
+
+################################################################################
+def _read_rar5_extra_types(data, start, end):
+    """
+    Returns:
+        - types: types of the records of the extra area of a header, each
+          record being its size, then its type and data
+    """
+    types  = []
+    offset = start
+    while offset < end:
+        record_size, record_offset = _read_vint(data, offset)
+        if record_size is None:
+            break
+        record_type, type_offset = _read_vint(data, record_offset)
+        if record_type is None:
+            break
+        types.append(record_type)
+        offset = record_offset + record_size
+    return types
+
+################################################################################
+def _read_vint(data, offset):
+    value = 0
+    shift = 0
+    while offset < len(data):
+        byte   = ord(data[offset])
+        value  = value | ((byte & 0x7f) << shift)
+        offset = offset + 1
+        if not byte & 0x80:
+            return (value, offset)
+        shift = shift + 7
+    return (None, None)
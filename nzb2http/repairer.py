@@ -0,0 +1,231 @@
+################################################################################
+import distutils.spawn
+import multiprocessing
+import os
+import par2index
+import Queue
+import shutil
+import subprocess
+import sys
+import threading
+
+################################################################################
+PAR2_EXECUTABLE = 'par2'
+
+# Repairs running at once, each in its own process
+REPAIR_PROCESSES = 1
+
+# Directory of the NZB directory in which par2 runs
+REPAIR_DIR_NAME = '.repair'
+
+################################################################################
+def is_available():
+    return distutils.spawn.find_executable(PAR2_EXECUTABLE) is not None
+
+################################################################################
+def _run_par2(directory, arguments):
+    # Runs in a process of the pool
+    process = subprocess.Popen([PAR2_EXECUTABLE, 'r', '-q'] + arguments, cwd=directory, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output  = process.communicate()[0]
+    return (process.returncode, output)
+
+################################################################################
+class Repairer(threading.Thread):
+    """
+    Repairs files left with holes by segments no server could provide. The
+    slices of the holes are located using the PAR2 index, and only enough
+    PAR2 volumes to cover them are downloaded. Recovery blocks depend on every
+    slice of the set, so files are repaired once the rest of the set is
+    downloaded; until then their readers wait.
+    """
+    ############################################################################
+    def __init__(self, nzb_dir, scheduler, file_writers, index_file, volume_files):
+        threading.Thread.__init__(self)
+        self.nzb_dir          = nzb_dir
+        self.scheduler        = scheduler
+        self.file_writers     = file_writers
+        self.index_file       = index_file
+        self.volume_files     = sorted(volume_files, key=lambda volume_file: par2index.get_volume_blocks(volume_file.name))
+        self.damaged_queue    = Queue.Queue()
+        self.process_pool     = None
+        self.stop_requested   = False
+
+        # Segments known to be missing from every server before they are
+        # downloaded, whose recovery volumes are downloaded ahead
+        self.missing_segments = []
+
+        # Names of the files of the set a pending repair waits for, which the
+        # downloader admits even if it holds them back
+        self.pending_names    = set()
+
+    ############################################################################
+    def repair(self, file_writer):
+        # Called by file writers with their lock held, only queues the file
+        self.damaged_queue.put(file_writer)
+
+    ############################################################################
+    def expect_missing(self, segments):
+        # segments are (nzb_file, index) tuples, which will leave holes
+        self.missing_segments = segments
+
+    ############################################################################
+    def run(self):
+        damaged_files    = []
+        scheduled_blocks = 0
+        scheduled_files  = []
+        index            = None
+
+        while not self.stop_requested:
+            try:
+                damaged_files.append(self.damaged_queue.get(timeout=1))
+                continue
+            except Queue.Empty:
+                pass
+
+            if not damaged_files and not self.missing_segments:
+                continue
+
+            index_writer = self.file_writers[self.index_file.path]
+            if not index_writer.complete:
+                continue
+
+            if not index:
+                index = self._read_index(index_writer.path)
+                if not index:
+                    sys.stdout.write('[nzb2http][repairer] No usable PAR2 index in {0}\n'.format(self.index_file.name))
+                    self._finish(damaged_files, False)
+                    damaged_files         = []
+                    self.missing_segments = []
+                    continue
+
+            # Recovery blocks are not used up by a repair, later repairs only
+            # need more of them if they have more slices to recover
+            needed_blocks = sum(self._get_damaged_slice_count(index, file_writer) for file_writer in damaged_files)
+            needed_blocks = max(needed_blocks, self._get_missing_slice_count(index))
+            for volume_file in self.volume_files:
+                if scheduled_blocks >= needed_blocks:
+                    break
+                if volume_file not in scheduled_files:
+                    if not self.file_writers[volume_file.path].complete:
+                        sys.stdout.write('[nzb2http][repairer] Downloading {0} for {1} damaged slices\n'.format(volume_file.name, needed_blocks))
+                        self.scheduler.add_file(volume_file, self.file_writers[volume_file.path])
+                    scheduled_files.append(volume_file)
+                    scheduled_blocks = scheduled_blocks + par2index.get_volume_blocks(volume_file.name)
+
+            if scheduled_blocks < needed_blocks:
+                sys.stdout.write('[nzb2http][repairer] Not enough recovery blocks for {0} damaged slices\n'.format(needed_blocks))
+                self._finish(damaged_files, False)
+                damaged_files         = []
+                self.missing_segments = []
+                continue
+
+            if not damaged_files:
+                continue
+
+            if not self._is_set_ready(index, damaged_files, scheduled_files):
+                if not self.pending_names:
+                    sys.stdout.write('[nzb2http][repairer] Waiting for the rest of the PAR2 set to repair {0}\n'.format(', '.join(file_writer.name for file_writer in damaged_files)))
+                    self.pending_names = set(index.files)
+                continue
+
+            self._finish(damaged_files, self._run_repair(index, damaged_files, scheduled_files))
+            damaged_files      = []
+            self.pending_names = set()
+
+    ############################################################################
+    def stop(self):
+        self.stop_requested = True
+        if self.is_alive():
+            self.join()
+        if self.process_pool:
+            self.process_pool.terminate()
+            self.process_pool = None
+
+    ############################################################################
+    def _read_index(self, path):
+        with open(path, 'rb') as index_file:
+            return par2index.parse_index(index_file.read())
+
+    ############################################################################
+    def _get_damaged_slice_count(self, index, file_writer):
+        slices = set()
+        for start, end in file_writer.get_damaged_ranges():
+            slices.update(index.get_slices(start, end))
+        return len(slices)
+
+    ############################################################################
+    def _get_missing_slice_count(self, index):
+        # The slices of a missing segment are only known once it is given up,
+        # each segment is counted for as many as its encoded size may span
+        slice_count = 0
+        for nzb_file, segment_index in self.missing_segments:
+            if nzb_file.name in index.files:
+                slice_count = slice_count + nzb_file.segments[segment_index].bytes // index.slice_size + 2
+        return slice_count
+
+    ############################################################################
+    def _is_set_ready(self, index, damaged_files, scheduled_files):
+        for scheduled_file in scheduled_files:
+            if not self.file_writers[scheduled_file.path].complete:
+                return False
+
+        for name in index.files:
+            file_writer = self.file_writers.get(os.path.join(self.nzb_dir, name))
+            if file_writer and not file_writer.complete and file_writer not in damaged_files:
+                return False
+
+        return True
+
+    ############################################################################
+    def _run_repair(self, index, damaged_files, scheduled_files):
+        """
+        par2 writes repaired files in place, where unrar could open them half
+        written. It runs on links to the files of the set in a directory of
+        its own instead, and repaired files are then moved into place.
+        """
+        repair_dir = os.path.join(self.nzb_dir, REPAIR_DIR_NAME)
+        shutil.rmtree(repair_dir, True)
+        os.makedirs(repair_dir)
+
+        try:
+            # The damaged files are given under their incomplete name for par2
+            # to pick up their intact slices
+            arguments = [self.index_file.name]
+            for name in [self.index_file.name] + [scheduled_file.name for scheduled_file in scheduled_files] + index.files.keys():
+                if os.path.isfile(os.path.join(self.nzb_dir, name)) and not os.path.exists(os.path.join(repair_dir, name)):
+                    os.link(os.path.join(self.nzb_dir, name), os.path.join(repair_dir, name))
+            for scheduled_file in scheduled_files:
+                arguments.append(scheduled_file.name)
+            for file_writer in damaged_files:
+                os.link(file_writer.incomplete_path, os.path.join(repair_dir, os.path.basename(file_writer.incomplete_path)))
+                arguments.append(os.path.basename(file_writer.incomplete_path))
+
+            sys.stdout.write('[nzb2http][repairer] Repairing {0}\n'.format(', '.join(file_writer.name for file_writer in damaged_files)))
+            if not self.process_pool:
+                self.process_pool = multiprocessing.Pool(REPAIR_PROCESSES)
+
+            result = self.process_pool.apply_async(_run_par2, (repair_dir, arguments))
+            while not result.ready():
+                if self.stop_requested:
+                    return False
+                result.wait(1)
+
+            returncode, output = result.get()
+            if returncode:
+                sys.stdout.write('[nzb2http][repairer] par2 failed ({0}): {1}\n'.format(returncode, output.strip()))
+                return False
+
+            for file_writer in damaged_files:
+                if os.path.isfile(os.path.join(repair_dir, file_writer.name)):
+                    os.rename(os.path.join(repair_dir, file_writer.name), file_writer.path)
+            return True
+        finally:
+            shutil.rmtree(repair_dir, True)
+
+    ############################################################################
+    def _finish(self, damaged_files, success):
+        for file_writer in damaged_files:
+            repaired = success and os.path.isfile(file_writer.path)
+            sys.stdout.write('[nzb2http][repairer] {0} {1}\n'.format('Repaired' if repaired else 'Could not repair', file_writer.path))
+            file_writer.repaired(repaired)
+        self.scheduler.remove_complete_files()
@@ -0,0 +1,272 @@
+################################################################################
+import collections
+import sys
+import threading
+import time
+
+################################################################################
+# Attempts on one server for a segment failing because of a connection problem
+# before it is handed over to the next server
+MAX_ATTEMPTS = 3
+
+# Delay before the first retry on the same server, doubled on every attempt
+RETRY_DELAY = 1.0
+
+################################################################################
+class ScheduledFile:
+    ############################################################################
+    def __init__(self, scheduler, nzb_file, file_writer, indexes=None):
+        # With indexes, only those segments are downloaded, ahead of the
+        # active files
+        self.scheduler   = scheduler
+        self.nzb_file    = nzb_file
+        self.file_writer = file_writer
+        self.partial     = indexes is not None
+        self.pending     = collections.deque(index for index in (range(len(nzb_file.segments)) if indexes is None else indexes) if not file_writer.segments_done[index])
+        self.in_flight   = 0
+        self.attempts    = {}
+
+################################################################################
+class Scheduler:
+    ############################################################################
+    def __init__(self, max_active_files, server_count, condition=None):
+        # Schedulers of jobs sharing a connection pool share its condition
+        self.max_active_files = max_active_files
+        self.server_count     = server_count
+        self.condition        = condition or threading.Condition()
+        self.files            = []
+        self.urgent           = collections.deque()
+        self.retries          = []
+        self.stop_requested   = False
+
+        # AvailabilityScan of the segments, whose STAT batches are handed out
+        # with them and which tells the servers that miss them
+        self.availability     = None
+
+    ############################################################################
+    def add_file(self, nzb_file, file_writer, indexes=None):
+        """
+        Schedules the segments of a file, or only those in indexes, e.g. the
+        segments holding the headers of a RAR volume. The rest of a file
+        scheduled partially is scheduled by adding it again.
+        """
+        with self.condition:
+            for scheduled_file in self.files:
+                if scheduled_file.nzb_file == nzb_file:
+                    scheduled_file.partial = scheduled_file.partial and indexes is not None
+                    for index in (range(len(nzb_file.segments)) if indexes is None else indexes):
+                        if not file_writer.segments_done[index] and index not in scheduled_file.pending:
+                            scheduled_file.pending.append(index)
+                    break
+            else:
+                self.files.append(ScheduledFile(self, nzb_file, file_writer, indexes))
+            self.condition.notify_all()
+
+    ############################################################################
+    def scan_availability(self, availability):
+        with self.condition:
+            self.availability = availability
+            self.condition.notify_all()
+
+    ############################################################################
+    def get(self, server_index, block=True):
+        """
+        Returns:
+            - job: (scheduled file, segment index) to download, or
+              (availability scan, segments) to check with STAT commands, None
+              if there is nothing to do and block is False
+        """
+        with self.condition:
+            while not self.stop_requested:
+                job = self._next_job(server_index)
+                if job or not block:
+                    return job
+                self.condition.wait(1)
+
+    ############################################################################
+    def task_done(self, scheduled_file, index):
+        with self.condition:
+            scheduled_file.in_flight = scheduled_file.in_flight - 1
+            scheduled_file.attempts.pop(index, None)
+            self._remove_if_complete(scheduled_file)
+            self.condition.notify_all()
+
+    ############################################################################
+    def task_failed(self, scheduled_file, index, server_index, missing):
+        """
+        Schedules a failed segment again. Segments missing from a server, or
+        corrupt on it, move to the next server straight away. Other failures
+        are retried on the same server with an increasing delay, up to
+        MAX_ATTEMPTS times. Segments no server could provide are given up.
+        """
+        with self.condition:
+            scheduled_file.in_flight = scheduled_file.in_flight - 1
+
+            attempts = scheduled_file.attempts.get(index, 0) + 1
+            if missing or attempts >= MAX_ATTEMPTS:
+                server_index = server_index + 1
+                attempts     = 0
+
+            if server_index < self.server_count:
+                scheduled_file.attempts[index] = attempts
+                delay = RETRY_DELAY * (2 ** (attempts - 1)) if attempts else 0
+                self.retries.append((time.time() + delay, scheduled_file, index, server_index))
+            else:
+                sys.stdout.write('[nzb2http][scheduler] Giving up segment {0} of {1}\n'.format(index + 1, scheduled_file.file_writer.path))
+                scheduled_file.attempts.pop(index, None)
+                scheduled_file.file_writer.fail_segment(index)
+                self._remove_if_complete(scheduled_file)
+
+            self.condition.notify_all()
+
+    ############################################################################
+    def task_cancelled(self, scheduled_file, index, server_index):
+        # Requeues a segment which was not attempted, e.g. queued in a pipeline
+        # when its connection was lost
+        with self.condition:
+            scheduled_file.in_flight = scheduled_file.in_flight - 1
+            if server_index == 0:
+                scheduled_file.pending.appendleft(index)
+            else:
+                self.retries.append((0, scheduled_file, index, server_index))
+            self.condition.notify_all()
+
+    ############################################################################
+    def prioritize(self, segments):
+        """
+        Moves segments, a list of (nzb_file, index) tuples, to the front of the
+        queue, ahead of the max_active_files limit. Concurrent readers each
+        prioritize their own segments: those from previous calls keep their
+        priority, and are only dropped once handed out or written.
+        """
+        with self.condition:
+            self.urgent = collections.deque((scheduled_file, index) for scheduled_file, index in self.urgent if not scheduled_file.file_writer.segments_done[index])
+            urgent      = set(self.urgent)
+            for nzb_file, index in segments:
+                for scheduled_file in self.files:
+                    if scheduled_file.nzb_file == nzb_file:
+                        if (scheduled_file, index) not in urgent and index in scheduled_file.pending:
+                            urgent.add((scheduled_file, index))
+                            self.urgent.append((scheduled_file, index))
+                        break
+            self.condition.notify_all()
+
+    ############################################################################
+    def remove_complete_files(self):
+        # For files completed outside of the scheduler, e.g. once repaired
+        with self.condition:
+            for scheduled_file in list(self.files):
+                self._remove_if_complete(scheduled_file)
+            self.condition.notify_all()
+
+    ############################################################################
+    def get_queue_depth(self):
+        with self.condition:
+            return sum(len(scheduled_file.pending) for scheduled_file in self.files) + len(self.retries)
+
+    ############################################################################
+    def get_in_flight(self):
+        with self.condition:
+            return sum(scheduled_file.in_flight for scheduled_file in self.files)
+
+    ############################################################################
+    def wait_finished(self, timeout):
+        with self.condition:
+            if self.files and not self.stop_requested:
+                self.condition.wait(timeout)
+            return not self.files
+
+    ############################################################################
+    def stop(self):
+        with self.condition:
+            self.stop_requested = True
+            self.condition.notify_all()
+
+    ############################################################################
+    def _next_job(self, server_index):
+        current_time = time.time()
+        for retry in self.retries:
+            retry_time, scheduled_file, index, retry_server_index = retry
+            if retry_server_index == server_index and retry_time <= current_time:
+                self.retries.remove(retry)
+                scheduled_file.in_flight = scheduled_file.in_flight + 1
+                return (scheduled_file, index)
+
+        # Segments are tried on the first server before any other, unless
+        # known to be missing from it
+        if server_index != 0:
+            return self._next_stat_batch(server_index)
+
+        # Availability is checked ahead of every segment but those readers
+        # wait for
+        while True:
+            job = self._next_urgent_job() or self._next_stat_batch(server_index) or self._next_queued_job()
+            if not job or not self._reroute(job):
+                return job
+
+    ############################################################################
+    def _next_urgent_job(self):
+        while self.urgent:
+            scheduled_file, index = self.urgent.popleft()
+            if index in scheduled_file.pending:
+                scheduled_file.pending.remove(index)
+                scheduled_file.in_flight = scheduled_file.in_flight + 1
+                return (scheduled_file, index)
+
+    ############################################################################
+    def _next_stat_batch(self, server_index):
+        if self.availability:
+            batch = self.availability.get_batch(server_index)
+            if batch:
+                return (self.availability, batch)
+
+    ############################################################################
+    def _next_queued_job(self):
+        for scheduled_file in self.files:
+            if scheduled_file.partial and scheduled_file.pending:
+                scheduled_file.in_flight = scheduled_file.in_flight + 1
+                return (scheduled_file, scheduled_file.pending.popleft())
+
+        # Files are kept in download order; only the first max_active_files of
+        # them hand out segments, a file staying active until fully written.
+        # Files waiting for a repair have no segments left to write.
+        active_files = [scheduled_file for scheduled_file in self.files if scheduled_file.file_writer.segments_left and not scheduled_file.partial]
+        for scheduled_file in active_files[:self.max_active_files]:
+            if scheduled_file.pending:
+                scheduled_file.in_flight = scheduled_file.in_flight + 1
+                return (scheduled_file, scheduled_file.pending.popleft())
+
+    ############################################################################
+    def _reroute(self, job):
+        """
+        Hands a segment known to be missing from the first server over to the
+        next server which may have it, or gives it up if none has.
+
+        Returns:
+            - rerouted: whether the segment was taken off the first server
+        """
+        scheduled_file, index = job
+        if not self.availability or scheduled_file is self.availability:
+            return False
+
+        server_index = self.availability.get_server_index(scheduled_file.nzb_file, index)
+        if server_index == 0:
+            return False
+
+        scheduled_file.in_flight = scheduled_file.in_flight - 1
+        if server_index is None:
+            sys.stdout.write('[nzb2http][scheduler] Giving up segment {0} of {1}, missing from every server\n'.format(index + 1, scheduled_file.file_writer.path))
+            scheduled_file.file_writer.fail_segment(index)
+            self._remove_if_complete(scheduled_file)
+        else:
+            self.retries.append((0, scheduled_file, index, server_index))
+        return True
+
+    ############################################################################
+    def _remove_if_complete(self, scheduled_file):
+        # Files scheduled partially are done once their segments are
+        done = scheduled_file.file_writer.complete
+        if scheduled_file.partial and not scheduled_file.pending and not scheduled_file.in_flight:
+            done = not [retry for retry in self.retries if retry[1] is scheduled_file]
+        if done and scheduled_file in self.files:
+            self.files.remove(scheduled_file)
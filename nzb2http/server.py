@@ -1,13 +1,21 @@
 ################################################################################
+import cgi
 import cherrypy
+import chunkcache
+import collections
 import datetime
 import downloader
 import json
 import filewrapper
 import mimetypes
 import os
+import pool
 import rarfile
 import re
+import stats
+import streamserver
+import StringIO
+import threading
 import time
 
 from cherrypy.lib.static import serve_fileobj
@@ -27,10 +35,18 @@ class ConnectionCounterTool(cherrypy.Tool):
 
     ############################################################################
     def _before_handler(self):
-        self.connection_count = self.connection_count + 1
+        self.start_request()
 
     ############################################################################
     def _on_end_request(self):
+        self.end_request()
+
+    ############################################################################
+    def start_request(self):
+        self.connection_count = self.connection_count + 1
+
+    ############################################################################
+    def end_request(self):
         self.connection_count = self.connection_count - 1
         if not self.connection_count:
             self.last_connection_time = datetime.datetime.now()
@@ -50,84 +66,484 @@ class AutoShutdownMonitor(cherrypy.process.plugins.Monitor):
             cherrypy.engine.exit()
 
 ################################################################################
-class NzbDownloaderPlugin(cherrypy.process.plugins.SimplePlugin):
+class JobManagerPlugin(cherrypy.process.plugins.SimplePlugin):
+    """
+    Download jobs, one per NZB, sharing one pool of Usenet connections and
+    one cache of the data they write.
+    """
     ############################################################################
-    def __init__(self, bus, nntp_credentials, download_dir, nzb_name, nzb_content):
+    def __init__(self, bus, nntp_servers, download_options, download_dir):
         cherrypy.process.plugins.SimplePlugin.__init__(self, bus)
-        self.downloader = downloader.Downloader(nntp_credentials, download_dir, nzb_name, nzb_content)
+        self.download_options = download_options
+        self.download_dir     = download_dir
+        self.connection_pool  = pool.ConnectionPool(nntp_servers, download_options['pipeline_depth'], download_options['decode_processes'], download_options['min_connections'], download_options['target_buffer'])
+        self.cache            = chunkcache.ChunkCache(download_options['cache_size']) if download_options['cache_size'] else None
+        self.jobs             = collections.OrderedDict()
+        self.lock             = threading.Lock()
+        self.next_job_id      = 1
+        self.started          = False
+
+        stats.gauge('nzb2http_queue_depth', 'Segments waiting to be downloaded per job', self._get_queue_depths)
 
     ############################################################################
     def start(self):
-        self.downloader.start()
+        with self.lock:
+            self.started = True
+            self.connection_pool.start()
+            for job in self.jobs.values():
+                job.start()
 
     ############################################################################
     def stop(self):
-        self.downloader.stop()
+        with self.lock:
+            if self.started:
+                for job in self.jobs.values():
+                    job.stop()
+                self.connection_pool.stop()
+            self.started = False
+
+    ############################################################################
+    def add_job(self, nzb_name, nzb_content):
+        """
+        Returns:
+            - job_id: identifier of the job downloading the NZB
+        """
+        job = downloader.Downloader(self.connection_pool, self.cache, self.download_options, self.download_dir, nzb_name, nzb_content)
+        with self.lock:
+            job_id           = str(self.next_job_id)
+            self.next_job_id = self.next_job_id + 1
+            self.jobs[job_id] = job
+            if self.started:
+                job.start()
+        return job_id
+
+    ############################################################################
+    def remove_job(self, job_id):
+        # Stopping a job can take a while, other requests go on meanwhile
+        with self.lock:
+            job     = self.jobs.pop(job_id, None)
+            started = self.started
+        if job and started:
+            job.stop()
+        return job is not None
+
+    ############################################################################
+    def get_job(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    ############################################################################
+    def _get_queue_depths(self):
+        with self.lock:
+            return [({'job': job_id}, job.scheduler.get_queue_depth()) for job_id, job in self.jobs.items()]
 
 ################################################################################
 class Server:
     ############################################################################
-    def __init__(self, port, nntp_credentials, download_dir, timeout, nzb_name, nzb_content):
-        self.port = port
+    def __init__(self, port, nntp_servers, download_options, download_dir, timeout, nzb_name=None, nzb_content=None, http_engine='cherrypy'):
+        self.port        = port
+        self.http_engine = http_engine
         
-        cherrypy.engine.autoshutdown = AutoShutdownMonitor(cherrypy.engine, timeout)
-        cherrypy.engine.autoshutdown.subscribe()
+        if timeout:
+            cherrypy.engine.autoshutdown = AutoShutdownMonitor(cherrypy.engine, timeout)
+            cherrypy.engine.autoshutdown.subscribe()
         
-        cherrypy.engine.nzbdownloader = NzbDownloaderPlugin(cherrypy.engine, nntp_credentials, download_dir, nzb_name, nzb_content)
-        cherrypy.engine.nzbdownloader.subscribe()
+        cherrypy.engine.jobmanager = JobManagerPlugin(cherrypy.engine, nntp_servers, download_options, download_dir)
+        cherrypy.engine.jobmanager.subscribe()
+
+        # The NZB given on the command line is also served at the root
+        self.default_job_id = None
+        if nzb_content:
+            self.default_job_id = cherrypy.engine.jobmanager.add_job(nzb_name, nzb_content)
 
     ############################################################################
     def run(self):
         cherrypy.config.update({'server.socket_host':'0.0.0.0'})
         cherrypy.config.update({'server.socket_port':self.port})
 
-        cherrypy.quickstart(ServerRoot())
+        if self.http_engine != 'stream':
+            cherrypy.quickstart(ServerRoot(self.default_job_id))
+            return
+
+        # The engine still runs the plugins, the stream server taking the place
+        # of the CherryPy one
+        cherrypy.server.unsubscribe()
+        cherrypy.engine.streamserver = StreamServerPlugin(cherrypy.engine, '0.0.0.0', self.port, StreamRoot(self.default_job_id))
+        cherrypy.engine.streamserver.subscribe()
+        cherrypy.engine.signals.subscribe()
+        cherrypy.engine.start()
+        cherrypy.engine.block()
+
+################################################################################
+class StreamServerPlugin(cherrypy.process.plugins.SimplePlugin):
+    """
+    Runs the stream server in a thread of its own while the engine runs.
+    """
+    ############################################################################
+    def __init__(self, bus, host, port, application):
+        cherrypy.process.plugins.SimplePlugin.__init__(self, bus)
+        self.host        = host
+        self.port        = port
+        self.application = application
+        self.server      = None
+        self.thread      = None
+
+    ############################################################################
+    def start(self):
+        self.server = streamserver.StreamServer(self.host, self.port, self.application)
+        self.thread = threading.Thread(target=self.server.serve_forever, name='StreamServer')
+        self.thread.start()
+        self.bus.log('Serving on http://{0}:{1}'.format(self.host, self.port))
+
+    ############################################################################
+    def stop(self):
+        if self.server:
+            self.server.stop()
+            self.thread.join()
+            self.server = None
 
 ################################################################################
 class ServerRoot:
+    ############################################################################
+    def __init__(self, default_job_id):
+        self.default_job_id = default_job_id
+        self.jobs           = JobsRoot()
+
     ############################################################################
     @cherrypy.expose
     @cherrypy.tools.connectioncounter()
     def index(self):
-        return json.dumps(cherrypy.engine.nzbdownloader.downloader.extractor.files)
+        return json.dumps(self._get_default_job().files)
 
     ############################################################################
     @cherrypy.expose
     @cherrypy.tools.connectioncounter()
-    def download(self):
-        video_file = self._get_first_video_file(cherrypy.engine.nzbdownloader.downloader.extractor.files)
-        if not video_file:
-            return 'Not ready!'
+    def files(self, index=None):
+        if index is None:
+            return json.dumps(self._get_default_job().files)
+        return serve_file(self._get_default_job(), index)
 
-        return serve_fileobj(filewrapper.FileWrapper(video_file['path'], video_file['size']), content_type='application/x-download', content_length=video_file['size'], disposition='attachment', name=os.path.basename(video_file['path']))
+    ############################################################################
+    @cherrypy.expose
+    @cherrypy.tools.connectioncounter()
+    def download(self):
+        return serve_download(self._get_default_job())
 
     ############################################################################
     @cherrypy.expose
     @cherrypy.tools.connectioncounter()
     def video(self):
-        video_file = self._get_first_video_file(cherrypy.engine.nzbdownloader.downloader.extractor.files)
-        if not video_file:
-            return 'Not ready!'
+        return serve_video(self._get_default_job())
 
-        content_type = mimetypes.types_map.get(os.path.splitext(video_file['path']), None)
-        
-        if not content_type:
-            if video_file['path'].endswith('.mkv'):
-                content_type = 'video/x-matroska'
-            elif video_file['path'].endswith('.mp4'):
-                content_type = 'video/mp4'
+    ############################################################################
+    @cherrypy.expose
+    def stats(self, format='json'):
+        if format == 'prometheus':
+            cherrypy.response.headers['Content-Type'] = 'text/plain; version=0.0.4'
+            return stats.get_prometheus()
 
-        return serve_fileobj(filewrapper.FileWrapper(video_file['path'], video_file['size']), content_type=content_type, content_length=video_file['size'], name=os.path.basename(video_file['path']))
+        cherrypy.response.headers['Content-Type'] = 'application/json'
+        return json.dumps(stats.get_json())
 
     ############################################################################
     @cherrypy.expose
     def shutdown(self):
-        cherrypy.engine.exit()
+        # Stopping the engine stops the HTTP server, which must answer first
+        threading.Thread(target=cherrypy.engine.exit).start()
         return 'OK'
 
     ############################################################################
-    def _get_first_video_file(self, files):
-        video_file = None
-        for file in cherrypy.engine.nzbdownloader.downloader.extractor.files:
-            if file['path'].endswith('.mkv') or file['path'].endswith('.mp4'):
-                return file
+    def _get_default_job(self):
+        job = cherrypy.engine.jobmanager.get_job(self.default_job_id)
+        if not job:
+            raise cherrypy.NotFound()
+        return job
+
+################################################################################
+class JobsRoot:
+    """
+    POST /jobs                  adds a job from an uploaded NZB, gzip
+                                compressed or not (nzb field, or the request
+                                body with a name parameter)
+    GET  /jobs                  lists jobs
+    GET  /jobs/<id>             lists the files of a job
+    GET  /jobs/<id>/files/<i>   streams file i of the list, downloading only
+                                the volumes it spans
+    GET  /jobs/<id>/video       streams the video file of a job
+    GET  /jobs/<id>/download    downloads the video file of a job
+    DELETE /jobs/<id>           stops a job and deletes its extracted files
+    """
+    # A redirection to /jobs/ would turn POST requests into GET ones
+    _cp_config = {'tools.trailing_slash.on': False}
+
+    ############################################################################
+    @cherrypy.expose
+    @cherrypy.tools.connectioncounter()
+    def index(self, nzb=None, name=None):
+        if cherrypy.request.method == 'POST':
+            if nzb is not None and hasattr(nzb, 'file'):
+                nzb_name    = name or nzb.filename
+                nzb_content = nzb.file.read()
+            else:
+                nzb_name    = name
+                nzb_content = nzb or cherrypy.request.body.read()
+
+            try:
+                job_id = _add_job(nzb_name, nzb_content)
+            except ValueError as exception:
+                raise cherrypy.HTTPError(400, str(exception))
+
+            cherrypy.response.status = 201
+            return json.dumps({'id': job_id})
+
+        return json.dumps(_get_jobs())
+
+    ############################################################################
+    @cherrypy.expose
+    @cherrypy.tools.connectioncounter()
+    def default(self, job_id, action=None, index=None):
+        if cherrypy.request.method == 'DELETE' and not action:
+            if not cherrypy.engine.jobmanager.remove_job(job_id):
+                raise cherrypy.NotFound()
+            return 'OK'
+
+        job = cherrypy.engine.jobmanager.get_job(job_id)
+        if not job:
+            raise cherrypy.NotFound()
+
+        if not action or (action == 'files' and index is None):
+            return json.dumps(job.files)
+        if action == 'files':
+            return serve_file(job, index)
+        if action == 'video':
+            return serve_video(job)
+        if action == 'download':
+            return serve_download(job)
+        raise cherrypy.NotFound()
+
+################################################################################
+class StreamRoot:
+    """
+    Same routes as ServerRoot and JobsRoot for the stream server, which sends
+    files without a thread per client.
+    """
+    ############################################################################
+    def __init__(self, default_job_id):
+        self.default_job_id = default_job_id
+
+    ############################################################################
+    def request_started(self, request):
+        # As with CherryPy, polling the stats does not keep the server up
+        if request.path not in ('/stats', '/shutdown'):
+            cherrypy.tools.connectioncounter.start_request()
+
+    ############################################################################
+    def request_ended(self, request):
+        if request.path not in ('/stats', '/shutdown'):
+            cherrypy.tools.connectioncounter.end_request()
+
+    ############################################################################
+    def handle(self, request):
+        """
+        Returns:
+            - response: streamserver.Response or streamserver.FileResponse
+        """
+        parts = [part for part in request.path.split('/') if part]
+
+        if parts == ['stats']:
+            if request.query.get('format') == 'prometheus':
+                return streamserver.Response(stats.get_prometheus(), 'text/plain; version=0.0.4')
+            return streamserver.Response(json.dumps(stats.get_json()), 'application/json')
+
+        if parts == ['shutdown']:
+            # Stopping the engine stops this server, which must answer first
+            threading.Thread(target=cherrypy.engine.exit).start()
+            return streamserver.Response('OK')
+
+        if parts and parts[0] == 'jobs':
+            return self._handle_jobs(request, parts[1:])
+
+        job = cherrypy.engine.jobmanager.get_job(self.default_job_id)
+        if not job:
+            raise streamserver.HTTPError(404)
+        return self._handle_job(request, job, parts)
+
+    ############################################################################
+    def _handle_jobs(self, request, parts):
+        if not parts:
+            if request.method == 'POST':
+                return self._add_job(request)
+            return streamserver.Response(json.dumps(_get_jobs()))
+
+        job_id = parts[0]
+        if request.method == 'DELETE' and len(parts) == 1:
+            if not cherrypy.engine.jobmanager.get_job(job_id):
+                raise streamserver.HTTPError(404)
+            # Stopping a job waits for its threads, which other clients do not
+            threading.Thread(target=cherrypy.engine.jobmanager.remove_job, args=(job_id,)).start()
+            return streamserver.Response('OK')
+
+        job = cherrypy.engine.jobmanager.get_job(job_id)
+        if not job:
+            raise streamserver.HTTPError(404)
+        return self._handle_job(request, job, parts[1:])
+
+    ############################################################################
+    def _handle_job(self, request, job, parts):
+        if not parts or parts == ['files']:
+            return streamserver.Response(json.dumps(job.files))
+
+        if len(parts) == 2 and parts[0] == 'files':
+            file = _get_file(job, parts[1])
+            if not file and job.layout_known:
+                raise streamserver.HTTPError(404)
+            return self._serve_file(request, job, file)
+
+        if parts not in (['video'], ['download']):
+            raise streamserver.HTTPError(404)
+        return self._serve_file(request, job, _get_first_video_file(job.files), parts == ['download'])
+
+    ############################################################################
+    def _serve_file(self, request, job, file, attachment=False):
+        if not file:
+            return streamserver.Response('Not ready!')
+        job.select_file(file['path'])
+        if not job.is_file_ready(file):
+            return streamserver.Response('Not ready!')
+
+        file_wrapper = _open_file(job, file, request.client)
+        name         = os.path.basename(file['path'])
+        if attachment:
+            return streamserver.FileResponse(file_wrapper, file['size'], 'application/x-download', name, attachment=True)
+        return streamserver.FileResponse(file_wrapper, file['size'], _get_content_type(file['path']), name)
+
+    ############################################################################
+    def _add_job(self, request):
+        nzb_name    = request.query.get('name')
+        nzb_content = None
+
+        content_type = request.headers.get('content-type', '')
+        if content_type.startswith('multipart/form-data') or content_type.startswith('application/x-www-form-urlencoded'):
+            form = cgi.FieldStorage(fp=StringIO.StringIO(request.body), headers={'content-type': content_type, 'content-length': str(len(request.body))}, environ={'REQUEST_METHOD': 'POST'})
+            if 'nzb' in form:
+                nzb_name    = form.getfirst('name') or nzb_name or form['nzb'].filename
+                nzb_content = form['nzb'].value
+        else:
+            nzb_content = request.body
+
+        try:
+            job_id = _add_job(nzb_name, nzb_content)
+        except ValueError as exception:
+            raise streamserver.HTTPError(400, str(exception))
+        return streamserver.Response(json.dumps({'id': job_id}), status=201)
+
+################################################################################
+def serve_download(job):
+    video_file = _get_first_video_file(job.files)
+    if not video_file:
+        return 'Not ready!'
+    return _serve_file(job, video_file, attachment=True)
+
+################################################################################
+def serve_video(job):
+    video_file = _get_first_video_file(job.files)
+    if not video_file:
+        return 'Not ready!'
+    return _serve_file(job, video_file)
+
+################################################################################
+def serve_file(job, index):
+    # Serves an entry of the archive by its index in the list of files
+    file = _get_file(job, index)
+    if not file:
+        if job.layout_known:
+            raise cherrypy.NotFound()
+        return 'Not ready!'
+    return _serve_file(job, file)
+
+################################################################################
+def _serve_file(job, file, attachment=False):
+    # Only the volumes of the entries asked for are downloaded
+    job.select_file(file['path'])
+    if not job.is_file_ready(file):
+        return 'Not ready!'
+
+    name = os.path.basename(file['path'])
+    if attachment:
+        return serve_fileobj(_open_file(job, file), content_type='application/x-download', content_length=file['size'], disposition='attachment', name=name)
+    return serve_fileobj(_open_file(job, file), content_type=_get_content_type(file['path']), content_length=file['size'], name=name)
+
+################################################################################
+def _add_job(nzb_name, nzb_content):
+    """
+    Adds a job from an uploaded NZB, raising ValueError if it is invalid.
+    Other failures, e.g. writing to the download directory, are raised as is
+    and answered with a 500.
+
+    Returns:
+        - job_id: identifier of the job downloading the NZB
+    """
+    if not nzb_name or not nzb_content:
+        raise ValueError('An NZB and its name are required')
+    if nzb_name.endswith('.gz'):
+        nzb_name = nzb_name[:-3]
+    if not nzb_name.endswith('.nzb'):
+        nzb_name = nzb_name + '.nzb'
+
+    # The XML parser raises SyntaxError subclasses, the downloader ValueError
+    # for NZBs without files
+    try:
+        return cherrypy.engine.jobmanager.add_job(os.path.basename(nzb_name), nzb_content)
+    except (SyntaxError, ValueError) as exception:
+        raise ValueError('Invalid NZB: {0}'.format(exception))
+
+################################################################################
+def _get_jobs():
+    jobs = []
+    for job_id, job in cherrypy.engine.jobmanager.jobs.items():
+        jobs.append({'id': job_id, 'name': job.nzb_name, 'files': job.files})
+    return jobs
+
+################################################################################
+def _get_content_type(path):
+    content_type = mimetypes.types_map.get(os.path.splitext(path)[1].lower(), None)
+
+    if not content_type:
+        if path.endswith('.mkv'):
+            content_type = 'video/x-matroska'
+        elif path.endswith('.mp4'):
+            content_type = 'video/mp4'
+        else:
+            content_type = 'application/octet-stream'
+    return content_type
+
+################################################################################
+def _get_file(job, index):
+    """
+    Returns:
+        - file: file at index in the list of files of a job, None if there is
+          no such file or not yet
+    """
+    try:
+        index = int(index)
+    except ValueError:
+        return None
+    files = job.files
+    if 0 <= index < len(files):
+        return files[index]
+    return None
+
+################################################################################
+def _get_first_video_file(files):
+    for file in files:
+        if file['path'].endswith('.mkv') or file['path'].endswith('.mp4'):
+            return file
+
+################################################################################
+def _open_file(job, file, client=None):
+    if file.get('stored'):
+        file_wrapper = filewrapper.StoredFileWrapper(file['path'], file['size'], job)
+    else:
+        file_wrapper = filewrapper.FileWrapper(file['path'], file['size'], job.extractor.watermarks[file['path']], job)
+    file_wrapper.client = client or '{0}:{1}'.format(cherrypy.request.remote.ip, cherrypy.request.remote.port)
+    return file_wrapper
@@ -0,0 +1,175 @@
+################################################################################
+import bisect
+import threading
+import time
+
+################################################################################
+# Upper bounds of the histogram buckets in seconds, from 100us to about 100s
+HISTOGRAM_BUCKETS = [0.0001 * (2 ** i) for i in range(21)]
+
+################################################################################
+_metrics      = {}
+_metrics_lock = threading.Lock()
+
+################################################################################
+class Counter:
+    """
+    Total of a quantity, with the amount added during the last full second to
+    get a rate without keeping samples.
+    """
+    ############################################################################
+    def __init__(self, name, help, labels):
+        self.name        = name
+        self.help        = help
+        self.labels      = labels
+        self.lock        = threading.Lock()
+        self.value       = 0
+        self.second      = 0
+        self.second_sum  = 0
+        self.last_sum    = 0
+
+    ############################################################################
+    def add(self, value=1):
+        second = int(time.time())
+        with self.lock:
+            self.value = self.value + value
+            if second != self.second:
+                self.last_sum   = self.second_sum if second == self.second + 1 else 0
+                self.second     = second
+                self.second_sum = 0
+            self.second_sum = self.second_sum + value
+
+    ############################################################################
+    def get_rate(self):
+        second = int(time.time())
+        with self.lock:
+            if second == self.second:
+                return self.last_sum
+            if second == self.second + 1:
+                return self.second_sum
+            return 0
+
+################################################################################
+class Histogram:
+    ############################################################################
+    def __init__(self, name, help, labels):
+        self.name   = name
+        self.help   = help
+        self.labels = labels
+        self.lock   = threading.Lock()
+        self.counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        self.sum    = 0.0
+        self.count  = 0
+
+    ############################################################################
+    def observe(self, value):
+        index = bisect.bisect_left(HISTOGRAM_BUCKETS, value)
+        with self.lock:
+            self.counts[index] = self.counts[index] + 1
+            self.sum           = self.sum + value
+            self.count         = self.count + 1
+
+################################################################################
+class Gauge:
+    """
+    Values computed when collected by function, which returns a list of
+    (labels, value) tuples.
+    """
+    ############################################################################
+    def __init__(self, name, help, function):
+        self.name     = name
+        self.help     = help
+        self.function = function
+
+################################################################################
+def counter(name, help, **labels):
+    return _get_metric(Counter, name, help, labels)
+
+################################################################################
+def histogram(name, help, **labels):
+    return _get_metric(Histogram, name, help, labels)
+
+################################################################################
+def gauge(name, help, function):
+    with _metrics_lock:
+        _metrics[(name, ())] = Gauge(name, help, function)
+
+################################################################################
+def get_json():
+    """
+    Returns:
+        - stats: {name: [sample, ...]}, a sample being a dict of the labels and
+          value and rate of counters, count, sum and [upper bound, count]
+          buckets of histograms or value of gauges
+    """
+    result = {}
+    for metric in _get_metrics():
+        if isinstance(metric, Gauge):
+            for labels, value in metric.function():
+                result.setdefault(metric.name, []).append(dict(labels, value=value))
+            continue
+
+        sample = dict(metric.labels)
+        if isinstance(metric, Counter):
+            sample['value'] = metric.value
+            sample['rate']  = metric.get_rate()
+        else:
+            with metric.lock:
+                sample['count']   = metric.count
+                sample['sum']     = metric.sum
+                sample['buckets'] = [list(bucket) for bucket in zip(HISTOGRAM_BUCKETS + ['+Inf'], metric.counts)]
+        result.setdefault(metric.name, []).append(sample)
+    return result
+
+################################################################################
+def get_prometheus():
+    """
+    Returns:
+        - text: metrics in the Prometheus text exposition format
+    """
+    lines = []
+    names = set()
+    for metric in _get_metrics():
+        if metric.name not in names:
+            names.add(metric.name)
+            metric_type = {Counter: 'counter', Histogram: 'histogram', Gauge: 'gauge'}[metric.__class__]
+            lines.append('# HELP {0} {1}'.format(metric.name, metric.help))
+            lines.append('# TYPE {0} {1}'.format(metric.name, metric_type))
+
+        if isinstance(metric, Gauge):
+            for labels, value in metric.function():
+                lines.append('{0}{1} {2}'.format(metric.name, _format_labels(labels), value))
+        elif isinstance(metric, Counter):
+            lines.append('{0}{1} {2}'.format(metric.name, _format_labels(metric.labels), metric.value))
+        else:
+            with metric.lock:
+                counts      = list(metric.counts)
+                total_sum   = metric.sum
+                total_count = metric.count
+            cumulative = 0
+            for bound, count in zip([repr(bound) for bound in HISTOGRAM_BUCKETS] + ['+Inf'], counts):
+                cumulative = cumulative + count
+                lines.append('{0}_bucket{1} {2}'.format(metric.name, _format_labels(dict(metric.labels, le=bound)), cumulative))
+            lines.append('{0}_sum{1} {2!r}'.format(metric.name, _format_labels(metric.labels), total_sum))
+            lines.append('{0}_count{1} {2}'.format(metric.name, _format_labels(metric.labels), total_count))
+
+    return '\n'.join(lines) + '\n'
+
+################################################################################
+def _get_metric(metric_class, name, help, labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        if key not in _metrics:
+            _metrics[key] = metric_class(name, help, labels)
+        return _metrics[key]
+
+################################################################################
+def _get_metrics():
+    with _metrics_lock:
+        return [_metrics[key] for key in sorted(_metrics)]
+
+################################################################################
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in sorted(labels.items())) + '}'
@@ -0,0 +1,424 @@
+################################################################################
+import asyncore
+import collections
+import ctypes
+import ctypes.util
+import errno
+import os
+import socket
+import sys
+import time
+import traceback
+import urlparse
+
+################################################################################
+# Seconds between two looks at the data awaited by suspended responses
+POLL_INTERVAL = 0.1
+
+# Bytes sent at most at once for one connection, for the others to be served
+# in between
+SEND_SIZE = 1024 * 1024
+
+# Seconds given to responses under way to be sent once the server is stopped
+STOP_TIMEOUT = 1
+
+RECV_SIZE        = 64 * 1024
+MAX_HEADER_SIZE  = 64 * 1024
+MAX_BODY_SIZE    = 64 * 1024 * 1024
+
+STATUS_MESSAGES = {
+                    200: 'OK',
+                    201: 'Created',
+                    206: 'Partial Content',
+                    400: 'Bad Request',
+                    404: 'Not Found',
+                    405: 'Method Not Allowed',
+                    413: 'Request Entity Too Large',
+                    416: 'Requested Range Not Satisfiable',
+                    431: 'Request Header Fields Too Large',
+                    500: 'Internal Server Error'
+                  }
+
+################################################################################
+# Linux sendfile, files being read and sent by the server otherwise
+try:
+    _libc     = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _sendfile = getattr(_libc, 'sendfile64', None) or _libc.sendfile
+    _sendfile.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_longlong), ctypes.c_size_t]
+    _sendfile.restype  = ctypes.c_ssize_t
+    if not sys.platform.startswith('linux'):
+        _sendfile = None
+except (OSError, AttributeError):
+    _sendfile = None
+
+################################################################################
+class HTTPError(Exception):
+    ############################################################################
+    def __init__(self, status, message=None):
+        Exception.__init__(self, message or STATUS_MESSAGES.get(status, ''))
+        self.status = status
+
+################################################################################
+class Request:
+    ############################################################################
+    def __init__(self, method, target, version, headers, body, client):
+        url          = urlparse.urlsplit(target)
+        self.method  = method
+        self.path    = urlparse.unquote(url.path)
+        self.query   = dict(urlparse.parse_qsl(url.query))
+        self.version = version
+        self.headers = headers
+        self.body    = body
+        self.client  = client
+
+################################################################################
+class Response:
+    ############################################################################
+    def __init__(self, body, content_type='text/html;charset=utf-8', status=200):
+        self.body         = body
+        self.content_type = content_type
+        self.status       = status
+
+################################################################################
+class FileResponse:
+    """
+    File sent in full or in the ranges asked for. The reader is a FileWrapper
+    or StoredFileWrapper, which tells what can be sent without waiting.
+    """
+    ############################################################################
+    def __init__(self, reader, size, content_type, name=None, attachment=False):
+        self.reader       = reader
+        self.size         = size
+        self.content_type = content_type
+        self.name         = name
+        self.attachment   = attachment
+
+################################################################################
+def parse_ranges(header, size):
+    """
+    Parses a Range header.
+
+    Returns:
+        - ranges: [(start, end), ...] of the satisfiable ranges, end being
+          exclusive, None if the header is missing or invalid and the whole
+          file is to be sent
+    """
+    if not header or not header.strip().startswith('bytes='):
+        return None
+
+    ranges = []
+    for spec in header.strip()[6:].split(','):
+        first, separator, last = spec.strip().partition('-')
+        if not separator:
+            return None
+        try:
+            if not first:
+                if int(last) and size:
+                    ranges.append((max(0, size - int(last)), size))
+                continue
+            start = int(first)
+            end   = min(size, int(last) + 1) if last else size
+            if last and int(last) < start:
+                return None
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, end))
+    return ranges
+
+################################################################################
+class StreamConnection(asyncore.dispatcher):
+    """
+    One HTTP/1.1 client connection, keeping alive between requests. Files are
+    sent as their data becomes available: a response waiting for data being
+    downloaded or extracted is suspended, without holding a thread, and looked
+    at again every POLL_INTERVAL seconds.
+    """
+    ############################################################################
+    def __init__(self, server, sock, address):
+        asyncore.dispatcher.__init__(self, sock, map=server.map)
+        self.server       = server
+        self.client       = '{0}:{1}'.format(address[0], address[1])
+        self.input        = ''
+        self.output       = collections.deque()
+        self.reader       = None
+        self.responding   = False
+        self.keep_alive   = True
+        self.suspend_time = None
+
+    ############################################################################
+    def readable(self):
+        return len(self.input) < MAX_HEADER_SIZE + MAX_BODY_SIZE
+
+    ############################################################################
+    def writable(self):
+        if not self.output:
+            return False
+        return self.suspend_time is None or time.time() - self.suspend_time >= POLL_INTERVAL
+
+    ############################################################################
+    def handle_read(self):
+        data = self.recv(RECV_SIZE)
+        if data:
+            self.input = self.input + data
+            if not self.responding:
+                self._handle_request()
+
+    ############################################################################
+    def handle_write(self):
+        self.suspend_time = None
+        while self.output:
+            item = self.output[0]
+            if item[0] == 'data':
+                sent = self.send(item[1])
+                if sent < len(item[1]):
+                    self.output[0] = ('data', item[1][sent:])
+                    return
+                self.output.popleft()
+                continue
+
+            # One chunk of a file at a time, other connections going on
+            # in between
+            position, end = item[1], item[2]
+            if position >= end:
+                self.output.popleft()
+                continue
+            sent = self._send_file(position, end)
+            if sent is None:
+                return
+            if position + sent < end:
+                self.output[0] = ('file', position + sent, end)
+                return
+            self.output.popleft()
+
+        self._end_response()
+
+    ############################################################################
+    def handle_close(self):
+        self._close_reader()
+        if self.responding:
+            self.responding = False
+            self.server.application.request_ended(self.request)
+        self.close()
+
+    ############################################################################
+    def handle_error(self):
+        # Clients going away in the middle of a response are not worth a line
+        exception = sys.exc_info()[1]
+        if not isinstance(exception, socket.error) or exception.errno not in (errno.EPIPE, errno.ECONNRESET):
+            sys.stdout.write('[nzb2http][streamserver] Closing connection of {0}: {1}\n'.format(self.client, exception))
+        self.handle_close()
+
+    ############################################################################
+    def _handle_request(self):
+        header_end = self.input.find('\r\n\r\n')
+        if header_end < 0:
+            if len(self.input) > MAX_HEADER_SIZE:
+                self._send_error(431)
+            return
+
+        lines = self.input[:header_end].split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ', 2)
+        except ValueError:
+            self._send_error(400)
+            return
+
+        headers = {}
+        for line in lines[1:]:
+            name, separator, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            body_size = int(headers.get('content-length', 0))
+        except ValueError:
+            self._send_error(400)
+            return
+        if body_size > MAX_BODY_SIZE:
+            self._send_error(413)
+            return
+        if len(self.input) < header_end + 4 + body_size:
+            return
+
+        body       = self.input[header_end + 4:header_end + 4 + body_size]
+        self.input = self.input[header_end + 4 + body_size:]
+
+        connection      = headers.get('connection', '').lower()
+        self.keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+        self.request    = Request(method, target, version, headers, body, self.client)
+        self.responding = True
+        self.server.application.request_started(self.request)
+
+        try:
+            response = self.server.application.handle(self.request)
+        except HTTPError as exception:
+            response = Response(str(exception), 'text/plain', exception.status)
+        except Exception as exception:
+            sys.stdout.write('[nzb2http][streamserver] Failed to handle {0} {1}: {2}\n{3}'.format(method, target, exception, traceback.format_exc()))
+            response = Response('Internal Server Error', 'text/plain', 500)
+
+        if isinstance(response, FileResponse):
+            self._start_file_response(response)
+        else:
+            self._start_response(response.status, [('Content-Type', response.content_type)], [('data', response.body)], len(response.body))
+
+    ############################################################################
+    def _start_file_response(self, response):
+        self.reader = response.reader
+
+        headers = [('Accept-Ranges', 'bytes')]
+        if response.name:
+            headers.append(('Content-Disposition', '{0}; filename="{1}"'.format('attachment' if response.attachment else 'inline', response.name)))
+
+        ranges = parse_ranges(self.request.headers.get('range'), response.size)
+        if ranges is None:
+            headers.append(('Content-Type', response.content_type))
+            self._start_response(200, headers, [('file', 0, response.size)], response.size)
+        elif not ranges:
+            headers.append(('Content-Range', 'bytes */{0}'.format(response.size)))
+            self._start_response(416, headers, [], 0)
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            headers.append(('Content-Type', response.content_type))
+            headers.append(('Content-Range', 'bytes {0}-{1}/{2}'.format(start, end - 1, response.size)))
+            self._start_response(206, headers, [('file', start, end)], end - start)
+        else:
+            boundary = os.urandom(12).encode('hex')
+            items    = []
+            for start, end in ranges:
+                part_header = '--{0}\r\nContent-Type: {1}\r\nContent-Range: bytes {2}-{3}/{4}\r\n\r\n'.format(boundary, response.content_type, start, end - 1, response.size)
+                items.extend([('data', part_header), ('file', start, end), ('data', '\r\n')])
+            items.append(('data', '--{0}--\r\n'.format(boundary)))
+            headers.append(('Content-Type', 'multipart/byteranges; boundary={0}'.format(boundary)))
+            self._start_response(206, headers, items, sum(len(item[1]) if item[0] == 'data' else item[2] - item[1] for item in items))
+
+    ############################################################################
+    def _start_response(self, status, headers, items, length):
+        lines = ['HTTP/1.1 {0} {1}'.format(status, STATUS_MESSAGES.get(status, ''))]
+        lines.extend('{0}: {1}'.format(name, value) for name, value in headers)
+        lines.append('Content-Length: {0}'.format(length))
+        lines.append('Date: {0}'.format(time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime())))
+        if not self.keep_alive:
+            lines.append('Connection: close')
+        self.output.append(('data', '\r\n'.join(lines) + '\r\n\r\n'))
+        if self.request.method != 'HEAD':
+            self.output.extend(items)
+
+        sys.stdout.write('{0} - - [{1}] "{2} {3} {4}" {5} {6}\n'.format(self.client.rsplit(':', 1)[0], time.strftime('%d/%b/%Y:%H:%M:%S'), self.request.method, self.request.path, self.request.version, status, length))
+
+    ############################################################################
+    def _send_error(self, status):
+        self.request    = Request('GET', '/', 'HTTP/1.1', {}, '', self.client)
+        self.keep_alive = False
+        self.responding = True
+        self.server.application.request_started(self.request)
+        self._start_response(status, [('Content-Type', 'text/plain')], [('data', STATUS_MESSAGES[status])], len(STATUS_MESSAGES[status]))
+
+    ############################################################################
+    def _send_file(self, position, end):
+        """
+        Sends what is available of a file from position on, suspending the
+        response if nothing is.
+
+        Returns:
+            - sent: number of bytes sent, None if none could be
+        """
+        if self.reader.get_position() != position:
+            self.reader.seek(position)
+
+        readable = self.reader.get_readable()
+        if readable is None:
+            self.suspend_time = time.time()
+            return None
+
+        fileno, offset, length = readable
+        if not length:
+            # No more data will come, e.g. a read past the end of a file being
+            # extracted; the client sees the response cut short
+            raise IOError('No data for {0} at {1}'.format(self.reader.path, position))
+
+        count = min(length, end - position, SEND_SIZE)
+
+        # Recent data is sent from memory, as read by other clients
+        data = self.reader.get_cached(count)
+        if data is not None:
+            sent = self.send(data)
+            self.reader.advance(sent)
+            return sent
+
+        if not _sendfile:
+            # What the socket does not take is read again from the next
+            # position
+            return self.send(self.reader.read(count))
+
+        file_offset = ctypes.c_longlong(offset)
+        sent        = _sendfile(self.socket.fileno(), fileno, ctypes.byref(file_offset), count)
+        if sent < 0:
+            error = ctypes.get_errno()
+            if error in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return None
+            raise socket.error(error, os.strerror(error))
+        self.reader.advance(sent)
+        return sent
+
+    ############################################################################
+    def _end_response(self):
+        self._close_reader()
+        if self.responding:
+            self.responding = False
+            self.server.application.request_ended(self.request)
+
+        if not self.keep_alive:
+            self.close()
+        elif self.input:
+            self._handle_request()
+
+    ############################################################################
+    def _close_reader(self):
+        if self.reader:
+            self.reader.close()
+            self.reader = None
+
+################################################################################
+class StreamServer(asyncore.dispatcher):
+    """
+    HTTP server sending files from a single thread, with sendfile where the
+    system has it. The application handles requests, returning a Response or
+    a FileResponse or raising HTTPError, and is told when a request starts and
+    ends.
+    """
+    ############################################################################
+    def __init__(self, host, port, application):
+        self.map            = {}
+        self.application    = application
+        self.stop_requested = False
+        asyncore.dispatcher.__init__(self, map=self.map)
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind((host, port))
+        self.listen(128)
+
+    ############################################################################
+    def handle_accept(self):
+        pair = self.accept()
+        if pair:
+            StreamConnection(self, pair[0], pair[1])
+
+    ############################################################################
+    def serve_forever(self):
+        while not self.stop_requested:
+            asyncore.loop(POLL_INTERVAL, map=self.map, count=1)
+
+        # No new connection, but e.g. the answer to /shutdown is sent
+        self.del_channel()
+        deadline = time.time() + STOP_TIMEOUT
+        while time.time() < deadline and [dispatcher for dispatcher in self.map.values() if dispatcher.output]:
+            asyncore.loop(POLL_INTERVAL, map=self.map, count=1)
+
+        for dispatcher in list(self.map.values()):
+            dispatcher.handle_close()
+        self.socket.close()
+
+    ############################################################################
+    def stop(self):
+        self.stop_requested = True
@@ -0,0 +1,40 @@
+################################################################################
+import threading
+
+################################################################################
+class Watermark:
+    """
+    Number of bytes available from the start of a file being written, which
+    readers can wait on instead of polling the file size.
+    """
+    ############################################################################
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.position  = 0
+        self.complete  = False
+
+    ############################################################################
+    def advance(self, position):
+        with self.condition:
+            if position > self.position:
+                self.position = position
+                self.condition.notify_all()
+
+    ############################################################################
+    def finish(self):
+        with self.condition:
+            self.complete = True
+            self.condition.notify_all()
+
+    ############################################################################
+    def wait(self, position):
+        """
+        Waits until more than position bytes are available or no more will be.
+
+        Returns:
+            - position: number of bytes available
+        """
+        with self.condition:
+            while self.position <= position and not self.complete:
+                self.condition.wait()
+            return self.position
@@ -0,0 +1,39 @@
+################################################################################
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from nzb2http import nzbparser
+
+################################################################################
+def _nzb(segment_numbers):
+    segments = ''.join('<segment bytes="{0}" number="{1}">part{1}@example</segment>'.format(1000 + number, number) for number in segment_numbers)
+    return ('<?xml version="1.0" encoding="iso-8859-1" ?>'
+            '<nzb xmlns="http://www.newzbin.com/DTD/2003/nzb">'
+            '<file poster="poster" date="0" subject="[1/1] - &quot;movie.part01.rar&quot; yEnc (1/{0})">'
+            '<groups><group>alt.binaries.test</group></groups>'
+            '<segments>{1}</segments></file></nzb>').format(len(segment_numbers), segments)
+
+################################################################################
+class IterFilesTest(unittest.TestCase):
+    ############################################################################
+    def test_ordered_segments(self):
+        nzb_file = next(nzbparser.iter_files(_nzb(range(1, 11))))
+        self.assertEqual(nzb_file.name, 'movie.part01.rar')
+        self.assertEqual([segment.number for segment in nzb_file.segments], range(1, 11))
+
+    ############################################################################
+    def test_shuffled_segments(self):
+        numbers = range(1, 51)
+        random.Random(1).shuffle(numbers)
+        nzb_file = next(nzbparser.iter_files(_nzb(numbers)))
+        self.assertEqual([segment.number for segment in nzb_file.segments], range(1, 51))
+        self.assertEqual([segment.message_id for segment in nzb_file.segments], ['part{0}@example'.format(number) for number in range(1, 51)])
+        self.assertEqual([segment.bytes for segment in nzb_file.segments], [1000 + number for number in range(1, 51)])
+
+################################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+################################################################################
+import os
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from nzb2http import rarheader
+
+################################################################################
+def _vint(value):
+    data = ''
+    while True:
+        byte  = value & 0x7f
+        value = value >> 7
+        if not value:
+            return data + chr(byte)
+        data = data + chr(byte | 0x80)
+
+################################################################################
+def _rar5_header(body):
+    # The CRC32 of headers is not checked by the parser
+    return struct.pack('<I', 0) + _vint(len(body)) + body
+
+################################################################################
+def _rar5_file_header(name, data_size, method=0, extra=''):
+    flags = rarheader.RAR5_FLAG_DATA | (rarheader.RAR5_FLAG_EXTRA if extra else 0)
+    body  = _vint(rarheader.RAR5_BLOCK_FILE) + _vint(flags)
+    if extra:
+        body = body + _vint(len(extra))
+    body = body + _vint(data_size)
+    body = body + _vint(0) + _vint(data_size) + _vint(0x20) + _vint(method << 7) + _vint(0) + _vint(len(name)) + name
+    return _rar5_header(body + extra)
+
+################################################################################
+def _rar5_volume(name, data, method=0, extra=''):
+    end = _rar5_header(_vint(rarheader.RAR5_BLOCK_END) + _vint(0) + _vint(0))
+    return rarheader.RAR5_MARKER + _rar5_file_header(name, len(data), method, extra) + data + end
+
+################################################################################
+def _rar5_record(record_type, data):
+    return _vint(len(_vint(record_type) + data)) + _vint(record_type) + data
+
+################################################################################
+class Rar5HeaderTest(unittest.TestCase):
+    ############################################################################
+    def test_stored_entry(self):
+        entries = rarheader.parse_volume(_rar5_volume('movie.mkv', 'x' * 100))
+        self.assertEqual([entry.name for entry in entries], ['movie.mkv'])
+        self.assertTrue(entries[0].is_stored)
+        self.assertEqual(entries[0].data_size, 100)
+
+    ############################################################################
+    def test_compressed_entry(self):
+        entries = rarheader.parse_volume(_rar5_volume('movie.mkv', 'x' * 100, method=3))
+        self.assertFalse(entries[0].is_stored)
+
+    ############################################################################
+    def test_encrypted_stored_entry(self):
+        # Version, flags, KDF count, salt and IV of the encryption record
+        crypt   = _rar5_record(rarheader.RAR5_EXTRA_CRYPT, _vint(0) + _vint(0) + '\x0f' + '\x00' * 32)
+        entries = rarheader.parse_volume(_rar5_volume('movie.mkv', 'x' * 100, extra=crypt))
+        self.assertEqual([entry.name for entry in entries], ['movie.mkv'])
+        self.assertFalse(entries[0].is_stored)
+
+    ############################################################################
+    def test_other_extra_records(self):
+        # File time record, which leaves the entry stored
+        time_record = _rar5_record(0x03, _vint(0x02) + '\x00' * 4)
+        entries     = rarheader.parse_volume(_rar5_volume('movie.mkv', 'x' * 100, extra=time_record))
+        self.assertTrue(entries[0].is_stored)
+
+################################################################################
+if __name__ == '__main__':
+    unittest.main()